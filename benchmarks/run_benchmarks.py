@@ -0,0 +1,228 @@
+# Time the catalog pipeline and the helper scripts against a synthetic model library.
+# Each phase (scan, parse, thumbnail encode, html write) is timed separately, and the results are
+# written as JSON so runs from different commits can be compared with --compare.
+#
+# Run from the root of the repository:
+#     python3 -m benchmarks.run_benchmarks --models 1000 --output results.json
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import dedup
+import directory_rename
+import fingerprints
+import folder_names
+import generate_model_info
+import image_header
+import invalid
+import main
+import stl_info
+import stl_preview
+import zip_contents
+from directory_index import build_directory_index
+from search_functions import find_directories
+from scanner import scan_models, walk_library
+
+from benchmarks.synthetic_library import add_library_arguments, generate_library, library_options_from_args
+
+# The templates are read relative to the working directory, so run from the root of the repository
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Folder names collected from real libraries, one per line
+FOLDER_NAME_CORPUS = os.path.join(REPO_DIR, 'benchmarks', 'folder_names.txt')
+
+
+def get_commit():
+    """Return the current git commit of the repository, or None if it can't be found."""
+    try:
+        result = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True)
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def time_phase(function, repeat):
+    """Run a function repeat times and return its timings, or the error it raised."""
+    timings = []
+    for _ in range(repeat):
+        # Start every run with a cold image header cache
+        image_header._image_info_cache.clear()
+
+        start = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                function()
+        except Exception as e:
+            return {'error': f"{type(e).__name__}: {e}"}
+        timings.append(time.perf_counter() - start)
+
+    return {
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'runs': timings,
+    }
+
+
+def parse_folder_name_corpus(cold=True, copies=200):
+    """Parse and plan renames for every name in the folder name corpus, copies times over.
+
+    With cold set the parser caches are cleared before each pass, so every name is parsed from scratch.
+    """
+    with open(FOLDER_NAME_CORPUS, 'r', encoding='utf-8') as f:
+        names = [line.strip() for line in f if line.strip()]
+
+    for _ in range(copies):
+        if cold:
+            folder_names.parse_folder_name.cache_clear()
+            folder_names.plan_folder_name.cache_clear()
+
+        for name in names:
+            folder_names.parse_folder_name(name)
+            folder_names.plan_folder_name(name)
+
+
+def render_stl_previews(models, jobs):
+    """Render a preview for every model as if none of them had an image, into a folder that's thrown away."""
+    with tempfile.TemporaryDirectory() as preview_dir:
+        stl_preview.add_stl_previews([{'model_dir': model['model_dir'], 'image_path': None} for model in models],
+                                     preview_dir, jobs=jobs)
+
+
+def run_benchmarks(base_dir, repeat, jobs):
+    """Time each phase of the pipeline and each entry point against the library in base_dir."""
+    results = {}
+
+    # Scan phases
+    results['scan.walk_library'] = time_phase(lambda: list(walk_library(base_dir)), repeat)
+    results['scan.scan_models'] = time_phase(lambda: list(scan_models(base_dir)), repeat)
+    results['scan.find_directories'] = time_phase(
+        lambda: find_directories(base_dir, build_directory_index(base_dir)), repeat)
+    results['scan.scan_models_threaded'] = time_phase(lambda: list(scan_models(base_dir, workers=jobs)), repeat)
+    results['scan.find_directories_threaded'] = time_phase(lambda: find_directories(base_dir, workers=jobs), repeat)
+
+    # Parse phases, run over the model folders found by one scan
+    model_records = list(scan_models(base_dir))
+    folder_name = os.path.basename(base_dir)
+    model_info_files = [os.path.join(record['path'], 'model-info.txt')
+                        for record in model_records if record['has_model_info']]
+
+    results['parse.directory_names'] = time_phase(
+        lambda: [main.parse_model_directory(record['path'], folder_name) for record in model_records], repeat)
+    results['parse.folder_names_cold'] = time_phase(parse_folder_name_corpus, repeat)
+    results['parse.folder_names_warm'] = time_phase(lambda: parse_folder_name_corpus(cold=False), repeat)
+    results['parse.model_info'] = time_phase(
+        lambda: [main.parse_model_info(model_info_file) for model_info_file in model_info_files], repeat)
+
+    # Thumbnail encode phases, without the cache so every image is encoded
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, models, all_tags = main.gen_from_directory_structure(base_dir)
+    results['encode.serial'] = time_phase(
+        lambda: [main.encode_thumbnail(model['image_path']) for model in models], repeat)
+    results['encode.process_pool'] = time_phase(lambda: list(main.encode_images(models, jobs)), repeat)
+
+    # Html write phase, with the thumbnails encoded up front so only the writing is timed
+    rows = list(main.encode_images(models, jobs))
+
+    def write_html():
+        with tempfile.TemporaryFile('w') as f:
+            main.write_header(f)
+            main.write_filters(f, all_tags)
+            main.write_table(f, rows)
+            main.write_close(f)
+
+    results['write.html'] = time_phase(write_html, repeat)
+
+    # Entry points, generate_model_info goes last because it writes into the library
+    results['entry.gen_from_directory_structure'] = time_phase(
+        lambda: main.gen_from_directory_structure(base_dir), repeat)
+    results['entry.gen_from_model_info_file'] = time_phase(lambda: main.gen_from_model_info_file(base_dir), repeat)
+    results['entry.invalid'] = time_phase(lambda: invalid.find_invalid_folders(base_dir), repeat)
+    results['entry.directory_rename'] = time_phase(lambda: directory_rename.rename_dirs(base_dir), repeat)
+    results['entry.dedup'] = time_phase(lambda: dedup.find_duplicates(base_dir, jobs=jobs), repeat)
+    results['entry.fingerprints'] = time_phase(
+        lambda: fingerprints.fingerprint_models([{'model_dir': model['model_dir']} for model in models]), repeat)
+    results['entry.stl_info'] = time_phase(
+        lambda: stl_info.read_models_stl_info([{'model_dir': model['model_dir']} for model in models], jobs=jobs), repeat)
+    results['entry.stl_preview'] = time_phase(lambda: render_stl_previews(models, jobs), repeat)
+    results['entry.zip_contents'] = time_phase(
+        lambda: zip_contents.inspect_zips([{'model_dir': model['model_dir']} for model in models]), repeat)
+    results['entry.generate_model_info'] = time_phase(
+        lambda: generate_model_info.gen_model_info_from_directory_structure(base_dir), repeat)
+
+    return results
+
+
+def compare_results(previous, current):
+    """Print how each phase changed between two sets of results."""
+    print(f"{'Phase':<40} {'Before':>10} {'After':>10} {'Change':>8}")
+    for name, result in current['results'].items():
+        before = previous['results'].get(name, {})
+        if 'min' not in before or 'min' not in result:
+            print(f"{name:<40} {'-':>10} {'-':>10} {'-':>8}")
+            continue
+
+        change = (result['min'] - before['min']) / before['min'] * 100 if before['min'] else 0.0
+        print(f"{name:<40} {before['min']:>10.4f} {result['min']:>10.4f} {change:>+7.1f}%")
+
+
+def main_benchmarks():
+    parser = argparse.ArgumentParser(description="Benchmark the catalog scripts against a synthetic library")
+    parser.add_argument('--output', type=str, help="File to write the JSON results to")
+    parser.add_argument('--compare', type=str, help="JSON results from an earlier run to compare against")
+    parser.add_argument('--repeat', type=int, default=3, help="Number of times to run each phase")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help="Number of processes for encoding")
+    parser.add_argument('--library', type=str,
+                        help="Existing directory to generate the library in, instead of a temp directory")
+    add_library_arguments(parser)
+    args = parser.parse_args()
+
+    os.chdir(REPO_DIR)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # The library folder needs a name that doesn't show up anywhere else in the path
+        base_dir = os.path.join(args.library or temp_dir, '3D Models')
+
+        print(f"Generating {args.models} models in {base_dir}...")
+        summary = generate_library(base_dir, library_options_from_args(args))
+
+        print('Running benchmarks...')
+        results = run_benchmarks(base_dir, args.repeat, args.jobs)
+
+    output = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': get_commit(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'library': {key: value for key, value in summary.items() if key != 'base_dir'},
+        'repeat': args.repeat,
+        'jobs': args.jobs,
+        'results': results,
+    }
+
+    for name, result in results.items():
+        if 'error' in result:
+            print(f"{name:<40} error: {result['error']}")
+        else:
+            print(f"{name:<40} {result['min']:.4f}s")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            previous = json.load(f)
+        compare_results(previous, output)
+
+
+if __name__ == '__main__':
+    main_benchmarks()
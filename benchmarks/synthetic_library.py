@@ -0,0 +1,185 @@
+# Generate a synthetic model library that follows the directory structure from the README.
+# Used by the benchmarks so every entry point can be timed against a library of a known size and shape.
+import argparse
+import os
+import random
+import shutil
+from io import BytesIO
+
+from PIL import Image
+
+# Words used to build the folder names
+CHARACTER_NAMES = ['Millennium Falcon', 'X-Wing', 'Darth Vader', 'Master Chief', 'Link', 'Samus', 'Geralt',
+                   'Optimus Prime', 'Gundam', 'Pikachu', 'Batman', 'Spider Man', 'Iron Man', 'Totoro']
+MODEL_VARIANTS = ['Original Trilogy', 'Sequel Trilogy', 'Armored', 'Classic', 'Battle Damaged', 'Bust']
+TAGS = ['FDM', 'Resin', 'Chibi', 'NSFW', 'Supported', 'Prequel', 'Sequel']
+
+# Default shape of the library
+DEFAULT_OPTIONS = {
+    'models': 200,
+    'categories': 4,
+    'series_per_category': 5,
+    'series_depth': 1,
+    'image_width': 1200,
+    'image_height': 900,
+    'image_format': 'JPEG',
+    'model_info_ratio': 0.5,
+    'stl_files': 2,
+    'zips': True,
+    'renders': True,
+    'stray_folders': 5,
+    'seed': 0,
+}
+
+
+def make_image_data(width, height, image_format, seed):
+    """Encode a noisy test image once, so it can be copied into every model folder."""
+    rng = random.Random(seed)
+    img = Image.effect_noise((width, height), 64).convert('RGB')
+    img.paste((rng.randrange(256), rng.randrange(256), rng.randrange(256)), (0, 0, width // 4, height // 4))
+
+    buffered = BytesIO()
+    img.save(buffered, format=image_format)
+    return buffered.getvalue()
+
+
+def make_model_name(rng, model_number):
+    """Build a model folder name following the naming conventions, unique to the model number."""
+    name = f"{rng.choice(CHARACTER_NAMES)} {model_number}"
+    if rng.random() < 0.5:
+        name = f"{name}_{rng.choice(MODEL_VARIANTS)}"
+    if rng.random() < 0.6:
+        name = f"{name} - {' '.join(rng.sample(TAGS, rng.randrange(1, 3)))}"
+    return name
+
+
+def write_binary_stl(file_path, triangles):
+    """Write a small binary STL file with the given number of empty triangles."""
+    with open(file_path, 'wb') as f:
+        f.write(b'synthetic'.ljust(80, b' '))
+        f.write(triangles.to_bytes(4, 'little'))
+        f.write(b'\0' * 50 * triangles)
+
+
+def generate_library(base_dir, options=None):
+    """Create a synthetic library under base_dir and return a summary of what was created."""
+    options = dict(DEFAULT_OPTIONS, **(options or {}))
+    rng = random.Random(options['seed'])
+
+    image_format = options['image_format'].upper()
+    extension = '.png' if image_format == 'PNG' else '.jpg'
+    image_data = make_image_data(options['image_width'], options['image_height'], image_format, options['seed'])
+
+    # Build the series folders, with any number of folders between the category and the series
+    series_dirs = []
+    for category_number in range(options['categories']):
+        category_dir = os.path.join(base_dir, f"Category {category_number}")
+        for series_number in range(options['series_per_category']):
+            series_dir = category_dir
+            for depth in range(options['series_depth'] - 1):
+                series_dir = os.path.join(series_dir, f"Group {depth}")
+            series_dirs.append(os.path.join(series_dir, f"Series {category_number}-{series_number}"))
+
+    model_dirs = []
+    model_info_files = 0
+    for model_number in range(options['models']):
+        series_dir = series_dirs[model_number % len(series_dirs)]
+        model_dir = os.path.join(series_dir, make_model_name(rng, model_number))
+
+        stl_dir = os.path.join(model_dir, 'STL')
+        os.makedirs(stl_dir, exist_ok=True)
+        for stl_number in range(options['stl_files']):
+            write_binary_stl(os.path.join(stl_dir, f"part {stl_number}.stl"), 12)
+
+        if options['zips']:
+            os.makedirs(os.path.join(model_dir, 'Zips'), exist_ok=True)
+        if options['renders']:
+            os.makedirs(os.path.join(model_dir, 'Renders'), exist_ok=True)
+
+        with open(os.path.join(model_dir, f"preview{extension}"), 'wb') as f:
+            f.write(image_data)
+
+        if rng.random() < options['model_info_ratio']:
+            with open(os.path.join(model_dir, 'model-info.txt'), 'w') as f:
+                f.write(f"Model Name: {os.path.basename(model_dir)}\n")
+                f.write(f"Character Name: {os.path.basename(model_dir)}\n")
+                f.write(f"Series: {os.path.basename(series_dir)}\n")
+                f.write(f"Tags: {', '.join(rng.sample(TAGS, 2))}\n")
+                f.write(f"Model Category: {os.path.relpath(series_dir, base_dir).split(os.sep)[0]}\n")
+            model_info_files += 1
+
+        model_dirs.append(model_dir)
+
+    # Stray folders with loose images that don't follow the structure
+    for stray_number in range(options['stray_folders']):
+        stray_dir = os.path.join(rng.choice(series_dirs), f"Unsorted {stray_number}")
+        os.makedirs(stray_dir, exist_ok=True)
+        with open(os.path.join(stray_dir, f"loose{extension}"), 'wb') as f:
+            f.write(image_data)
+
+    return {
+        'base_dir': base_dir,
+        'options': options,
+        'model_dirs': len(model_dirs),
+        'model_info_files': model_info_files,
+        'image_bytes': len(image_data),
+    }
+
+
+def add_library_arguments(parser):
+    """Add the options that control the shape of the synthetic library to an argument parser."""
+    parser.add_argument('--models', type=int, default=DEFAULT_OPTIONS['models'], help="Number of model folders")
+    parser.add_argument('--categories', type=int, default=DEFAULT_OPTIONS['categories'], help="Number of categories")
+    parser.add_argument('--series-per-category', type=int, default=DEFAULT_OPTIONS['series_per_category'],
+                        help="Number of series in each category")
+    parser.add_argument('--series-depth', type=int, default=DEFAULT_OPTIONS['series_depth'],
+                        help="Number of folders between the category and the model")
+    parser.add_argument('--image-size', type=str, default='1200x900', help="Preview image size, as WIDTHxHEIGHT")
+    parser.add_argument('--image-format', choices=['jpeg', 'png'], default='jpeg', help="Preview image format")
+    parser.add_argument('--model-info-ratio', type=float, default=DEFAULT_OPTIONS['model_info_ratio'],
+                        help="Fraction of model folders with a model-info.txt file")
+    parser.add_argument('--stl-files', type=int, default=DEFAULT_OPTIONS['stl_files'],
+                        help="Number of STL files in each model folder")
+    parser.add_argument('--no-zips', action='store_true', help="Don't create Zips folders")
+    parser.add_argument('--no-renders', action='store_true', help="Don't create Renders folders")
+    parser.add_argument('--stray-folders', type=int, default=DEFAULT_OPTIONS['stray_folders'],
+                        help="Number of folders that don't follow the structure")
+    parser.add_argument('--seed', type=int, default=DEFAULT_OPTIONS['seed'], help="Random seed for the folder names")
+
+
+def library_options_from_args(args):
+    """Turn the parsed library arguments into options for generate_library."""
+    width, height = (int(value) for value in args.image_size.lower().split('x'))
+    return {
+        'models': args.models,
+        'categories': args.categories,
+        'series_per_category': args.series_per_category,
+        'series_depth': args.series_depth,
+        'image_width': width,
+        'image_height': height,
+        'image_format': args.image_format.upper(),
+        'model_info_ratio': args.model_info_ratio,
+        'stl_files': args.stl_files,
+        'zips': not args.no_zips,
+        'renders': not args.no_renders,
+        'stray_folders': args.stray_folders,
+        'seed': args.seed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic model library")
+    parser.add_argument('path', type=str, help="Directory to create the library in")
+    parser.add_argument('--clean', action='store_true', help="Remove the directory first if it exists")
+    add_library_arguments(parser)
+    args = parser.parse_args()
+
+    if args.clean and os.path.isdir(args.path):
+        shutil.rmtree(args.path)
+
+    summary = generate_library(args.path, library_options_from_args(args))
+    print(f"Created {summary['model_dirs']} model folders in {summary['base_dir']}")
+
+
+if __name__ == '__main__':
+    main()
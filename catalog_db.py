@@ -0,0 +1,336 @@
+# SQLite catalog of the model library.
+# A scan saves every directory listing, every model with its tags and image, and the encoded thumbnails,
+# so the html, the invalid folder report and the rename plan can be built from the database without
+# walking the library again. Tags, series and categories are indexed so reports only take milliseconds.
+import argparse
+import json
+import os
+import sqlite3
+import time
+
+from directory_index import build_directory_index
+from fingerprints import format_files
+from instrumentation import phase
+from scanner import MODEL_SUBFOLDER_NAMES
+from search_functions import is_valid_folder
+from stl_info import format_dimensions, format_triangles
+from zip_contents import format_zip_contents
+
+# Default location of the catalog file
+DEFAULT_CATALOG_FILE = 'catalog.sqlite'
+
+# Columns that can be used to filter and group models
+MODEL_GROUP_COLUMNS = ['series_name', 'category']
+
+# Columns added to the models table since it was first made, so catalogs from before them get them added
+MODEL_DETAIL_COLUMNS = {
+    'stl_count': 'INTEGER',
+    'zip_count': 'INTEGER',
+    'payload_bytes': 'INTEGER',
+    'payload_hash': 'TEXT',
+    'broken_zips': 'INTEGER',
+    'triangle_count': 'INTEGER',
+    'size_x': 'REAL',
+    'size_y': 'REAL',
+    'size_z': 'REAL',
+    'zip_stl_count': 'INTEGER',
+    'zip_image_count': 'INTEGER',
+    'zip_bytes': 'INTEGER',
+    'zip_compressed_bytes': 'INTEGER',
+}
+
+
+def open_catalog(catalog_file=DEFAULT_CATALOG_FILE):
+    """Open (or create) the catalog and return a handle for the other catalog functions."""
+    connection = sqlite3.connect(catalog_file)
+    connection.executescript(
+        'CREATE TABLE IF NOT EXISTS library ('
+        'key TEXT PRIMARY KEY, '
+        'value TEXT);'
+
+        'CREATE TABLE IF NOT EXISTS directories ('
+        'path TEXT PRIMARY KEY, '
+        'position INTEGER NOT NULL, '
+        'parent TEXT, '
+        'mtime_ns INTEGER, '
+        'files TEXT NOT NULL, '
+        'dirs TEXT NOT NULL);'
+
+        'CREATE TABLE IF NOT EXISTS models ('
+        'model_dir TEXT PRIMARY KEY, '
+        'position INTEGER NOT NULL, '
+        'character_name TEXT NOT NULL, '
+        'model_name TEXT NOT NULL, '
+        'series_name TEXT NOT NULL, '
+        'category TEXT NOT NULL, '
+        'tags TEXT NOT NULL, '
+        'image_path TEXT NOT NULL, '
+        'image_mtime_ns INTEGER, '
+        'thumbnail_hash TEXT);'
+
+        'CREATE TABLE IF NOT EXISTS model_tags ('
+        'model_dir TEXT NOT NULL, '
+        'tag TEXT NOT NULL, '
+        'PRIMARY KEY (model_dir, tag));'
+
+        'CREATE TABLE IF NOT EXISTS thumbnails ('
+        'hash TEXT PRIMARY KEY, '
+        'format TEXT NOT NULL, '
+        'data BLOB NOT NULL);'
+
+        'CREATE INDEX IF NOT EXISTS models_series ON models (series_name);'
+        'CREATE INDEX IF NOT EXISTS models_category ON models (category);'
+        'CREATE INDEX IF NOT EXISTS models_position ON models (position);'
+        'CREATE INDEX IF NOT EXISTS model_tags_tag ON model_tags (tag);'
+    )
+
+    existing_columns = {row[1] for row in connection.execute('PRAGMA table_info(models)')}
+    for column, column_type in MODEL_DETAIL_COLUMNS.items():
+        if column not in existing_columns:
+            connection.execute(f'ALTER TABLE models ADD COLUMN {column} {column_type}')
+
+    return {'connection': connection}
+
+
+def close_catalog(catalog):
+    """Save and close the catalog."""
+    connection = catalog['connection']
+    connection.commit()
+    connection.close()
+
+
+def get_library_info(catalog):
+    """Return the library the catalog was scanned from, as {'base_dir', 'scanned_at'}, or None if it's empty."""
+    rows = dict(catalog['connection'].execute('SELECT key, value FROM library').fetchall())
+    if 'base_dir' not in rows:
+        return None
+    return {'base_dir': rows['base_dir'], 'scanned_at': float(rows.get('scanned_at', 0))}
+
+
+def check_library(catalog, base_dir):
+    """Return True if the catalog was scanned from base_dir, printing why not if it wasn't."""
+    library_info = get_library_info(catalog)
+    if library_info is None:
+        print('The catalog is empty, run a scan first.')
+        return False
+    if library_info['base_dir'] != os.path.abspath(base_dir):
+        print(f"The catalog is for {library_info['base_dir']}, not {os.path.abspath(base_dir)}.")
+        return False
+
+    scanned_at = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(library_info['scanned_at']))
+    print(f'Using the catalog scanned at {scanned_at}')
+    return True
+
+
+def store_directory_index(catalog, base_dir, index):
+    """Replace the directory listings in the catalog with an index from build_directory_index."""
+    connection = catalog['connection']
+    with phase('catalog_store'):
+        connection.execute('DELETE FROM directories')
+        connection.executemany(
+            'INSERT INTO directories (path, position, parent, mtime_ns, files, dirs) VALUES (?, ?, ?, ?, ?, ?)',
+            ((path, position, listing['parent'], listing['mtime_ns'], json.dumps(listing['files']),
+              json.dumps(listing['dirs'])) for position, (path, listing) in enumerate(index.items())))
+
+        connection.executemany('INSERT OR REPLACE INTO library (key, value) VALUES (?, ?)',
+                               [('base_dir', os.path.abspath(base_dir)), ('scanned_at', str(time.time()))])
+        connection.commit()
+
+
+def load_directory_index(catalog):
+    """Return the directory listings saved in the catalog, in the same form as build_directory_index."""
+    index = {}
+    with phase('catalog_load'):
+        rows = catalog['connection'].execute(
+            'SELECT path, parent, mtime_ns, files, dirs FROM directories ORDER BY position')
+        for path, parent, mtime_ns, files, dirs in rows:
+            files = json.loads(files)
+            index[path] = {
+                'path': path,
+                'files': files,
+                'dirs': json.loads(dirs),
+                'extensions': {os.path.splitext(file_name)[1].lower() for file_name in files},
+                'mtime_ns': mtime_ns,
+                'identity': None,
+                'parent': parent,
+            }
+    return index
+
+
+def scan_library(catalog, base_dir):
+    """List every directory below base_dir once and save the listings into the catalog."""
+    index = build_directory_index(base_dir)
+    store_directory_index(catalog, base_dir, index)
+    return index
+
+
+def store_library_listings(catalog, base_dir, listings):
+    """Save the directory listings from the scanner's walk into the catalog, without listing the library again.
+
+    listings is path -> {'mtime_ns', 'files', 'dirs'} in top-down order, like the manifest records them.
+    The walk doesn't list STL, Zips and Renders folders. Below a valid model folder nothing is checked anyway,
+    so only the ones anywhere else are listed here, so the invalid folder report still sees what's in them.
+    """
+    index = {}
+    for path, listing in listings.items():
+        index[path] = {
+            'path': path,
+            'files': listing['files'],
+            'dirs': listing['dirs'],
+            'extensions': {os.path.splitext(file_name)[1].lower() for file_name in listing['files']},
+            'mtime_ns': listing['mtime_ns'],
+            'identity': None,
+            'parent': None if path == base_dir else os.path.dirname(path),
+        }
+
+        if is_valid_folder(path, index):
+            continue
+        for subfolder in listing['dirs']:
+            if subfolder.lower() in MODEL_SUBFOLDER_NAMES:
+                subfolder_index = build_directory_index(os.path.join(path, subfolder))
+                next(iter(subfolder_index.values()))['parent'] = path
+                index.update(subfolder_index)
+
+    store_directory_index(catalog, base_dir, index)
+    return index
+
+
+def store_models(catalog, models):
+    """Replace the models in the catalog, then drop any thumbnails that no model uses anymore."""
+    connection = catalog['connection']
+    with phase('catalog_store'):
+        connection.execute('DELETE FROM models')
+        connection.execute('DELETE FROM model_tags')
+
+        for position, model in enumerate(models):
+            try:
+                image_mtime_ns = os.stat(model['image_path']).st_mtime_ns
+            except OSError:
+                image_mtime_ns = None
+
+            connection.execute(
+                'INSERT INTO models (model_dir, position, character_name, model_name, series_name, category, tags, '
+                f'image_path, image_mtime_ns, thumbnail_hash, {", ".join(MODEL_DETAIL_COLUMNS)}) '
+                f'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?{", ?" * len(MODEL_DETAIL_COLUMNS)})',
+                (model['model_dir'], position, model['character_name'], model['model_name'], model['series_name'],
+                 model['category'], model['tags'], model['image_path'], image_mtime_ns,
+                 model.get('thumbnail_hash'), *(model.get(column) for column in MODEL_DETAIL_COLUMNS)))
+
+            tags = {tag for tag in model['tags'].split(', ') if tag != ''}
+            connection.executemany('INSERT INTO model_tags (model_dir, tag) VALUES (?, ?)',
+                                   ((model['model_dir'], tag) for tag in tags))
+
+        connection.execute('DELETE FROM thumbnails WHERE hash NOT IN '
+                           '(SELECT thumbnail_hash FROM models WHERE thumbnail_hash IS NOT NULL)')
+        connection.commit()
+
+
+def load_models(catalog, tag=None, series_name=None, category=None):
+    """Return the models in the catalog in the order they were found, optionally only those matching a filter."""
+    query = ('SELECT model_dir, character_name, model_name, series_name, category, tags, image_path, thumbnail_hash, '
+             f'{", ".join(MODEL_DETAIL_COLUMNS)} FROM models')
+    conditions = []
+    parameters = []
+    if tag is not None:
+        conditions.append('model_dir IN (SELECT model_dir FROM model_tags WHERE tag = ?)')
+        parameters.append(tag)
+    if series_name is not None:
+        conditions.append('series_name = ?')
+        parameters.append(series_name)
+    if category is not None:
+        conditions.append('category = ?')
+        parameters.append(category)
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY position'
+
+    models = []
+    with phase('catalog_load'):
+        for row in catalog['connection'].execute(query, parameters):
+            model = {
+                'model_dir': row[0],
+                'character_name': row[1],
+                'model_name': row[2],
+                'series_name': row[3],
+                'category': row[4],
+                'tags': row[5],
+                'image_path': row[6],
+            }
+            if row[7] is not None:
+                model['thumbnail_hash'] = row[7]
+
+            # Only models that were fingerprinted, had their STL files read or their zips listed
+            # have the details and column text
+            model.update(zip(MODEL_DETAIL_COLUMNS, row[8:]))
+            if model['stl_count'] is not None:
+                model['files'] = format_files(model)
+            if model['triangle_count'] is not None:
+                model['triangles'] = format_triangles(model)
+                model['dimensions'] = format_dimensions(model)
+            if model['zip_stl_count'] is not None:
+                model['zip_contents'] = format_zip_contents(model)
+            models.append(model)
+    return models
+
+
+def store_catalog_thumbnail(catalog, thumbnail_hash, image_format, data):
+    """Save an encoded thumbnail under the hash of its content."""
+    catalog['connection'].execute('INSERT OR IGNORE INTO thumbnails (hash, format, data) VALUES (?, ?, ?)',
+                                  (thumbnail_hash, image_format, data))
+
+
+def get_catalog_thumbnail(catalog, thumbnail_hash):
+    """Return (format, data) for a saved thumbnail, or None if it isn't in the catalog."""
+    return catalog['connection'].execute('SELECT format, data FROM thumbnails WHERE hash = ?',
+                                         (thumbnail_hash,)).fetchone()
+
+
+def find_missing_thumbnails(catalog, thumbnail_hashes):
+    """Return the hashes out of thumbnail_hashes that don't have a thumbnail saved in the catalog."""
+    connection = catalog['connection']
+    return {thumbnail_hash for thumbnail_hash in set(thumbnail_hashes)
+            if connection.execute('SELECT 1 FROM thumbnails WHERE hash = ?', (thumbnail_hash,)).fetchone() is None}
+
+
+def count_models_by(catalog, column):
+    """Return [(value, number of models)] for a column in MODEL_GROUP_COLUMNS, or for 'tag'."""
+    connection = catalog['connection']
+    if column == 'tag':
+        return connection.execute('SELECT tag, COUNT(*) FROM model_tags GROUP BY tag ORDER BY tag').fetchall()
+    if column not in MODEL_GROUP_COLUMNS:
+        raise ValueError(f'Unable to group models by {column}')
+    return connection.execute(f'SELECT {column}, COUNT(*) FROM models GROUP BY {column} ORDER BY {column}').fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report on the models in the catalog database")
+    parser.add_argument('--catalog-db', type=str, default=DEFAULT_CATALOG_FILE, help="Path to the catalog file")
+    parser.add_argument('--scan', type=str, help="Scan the directories of this library into the catalog first")
+    parser.add_argument('--by', choices=['tag'] + MODEL_GROUP_COLUMNS, default='category',
+                        help="Count the models by tag, series or category")
+    parser.add_argument('--tag', type=str, help="List the models with this tag")
+    parser.add_argument('--series', type=str, help="List the models in this series")
+    parser.add_argument('--category', type=str, help="List the models in this category")
+    args = parser.parse_args()
+
+    catalog = open_catalog(args.catalog_db)
+    try:
+        if args.scan:
+            index = scan_library(catalog, args.scan)
+            print(f'Saved {len(index)} directories to {args.catalog_db}')
+
+        if args.tag or args.series or args.category:
+            models = load_models(catalog, args.tag, args.series, args.category)
+            for model in models:
+                print(f"{model['character_name']}\t{model['model_name']}\t{model['series_name']}\t"
+                      f"{model['category']}\t{model['tags']}")
+            print(f'{len(models)} models')
+        else:
+            for value, total in count_models_by(catalog, args.by):
+                print(f'{value or "(none)"}: {total}')
+    finally:
+        close_catalog(catalog)
+
+
+if __name__ == '__main__':
+    main()
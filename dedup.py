@@ -0,0 +1,258 @@
+# Find models that are probably copies of each other, so the extra copies can be cleaned out of the library.
+# Two models are flagged when their preview images look the same (a perceptual hash within a few bits)
+# or when they hold the same STL/zip files (same size and sampled content).
+# The image hashes go into a BK-tree, so each model is only compared against the hashes near it
+# instead of against every other model in the library.
+import argparse
+import hashlib
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from directory_index import DEFAULT_DISCOVERY_WORKERS
+from fingerprints import format_size, list_payload_files
+from instrumentation import count, phase
+from main import shrink_image
+from scanner import scan_models
+
+# Images whose hashes differ by this many bits or less (out of 64) are treated as the same picture
+DEFAULT_MAX_DISTANCE = 6
+
+# The hash is built from a grayscale image this size, one bit per pair of neighbouring pixels
+HASH_WIDTH = 9
+HASH_HEIGHT = 8
+
+# Bytes read from the start and end of each STL/zip file for its fingerprint
+SAMPLE_BYTES = 64 * 1024
+
+
+def hash_image(image_path):
+    """Return the 64 bit difference hash of an image.
+
+    Each bit says whether a pixel is brighter than the one to its right, so the hash survives resizing,
+    recompression and small colour changes.
+    """
+    with Image.open(image_path) as img:
+        pixels = shrink_image(img, (HASH_WIDTH, HASH_HEIGHT), 'L').tobytes()
+
+    image_hash = 0
+    for y in range(HASH_HEIGHT):
+        row = pixels[y * HASH_WIDTH:(y + 1) * HASH_WIDTH]
+        for x in range(HASH_WIDTH - 1):
+            image_hash = (image_hash << 1) | (row[x] > row[x + 1])
+    return image_hash
+
+
+def hash_image_safe(image_path):
+    """Hash an image in a worker process, returning None if it can't be read."""
+    try:
+        return hash_image(image_path)
+    except Exception:
+        return None
+
+
+def hamming_distance(a, b):
+    """Return the number of bits that differ between two hashes."""
+    return bin(a ^ b).count('1')
+
+
+def new_bk_tree():
+    """Create an empty BK-tree of hashes, for finding the hashes within a distance of another one."""
+    return {'root': None, 'size': 0}
+
+
+def add_to_bk_tree(tree, image_hash, item):
+    """Add an item to the tree under its hash, items with the same hash share a node."""
+    tree['size'] += 1
+    if tree['root'] is None:
+        tree['root'] = {'hash': image_hash, 'items': [item], 'children': {}}
+        return
+
+    node = tree['root']
+    while True:
+        distance = hamming_distance(image_hash, node['hash'])
+        if distance == 0:
+            node['items'].append(item)
+            return
+
+        child = node['children'].get(distance)
+        if child is None:
+            node['children'][distance] = {'hash': image_hash, 'items': [item], 'children': {}}
+            return
+        node = child
+
+
+def find_in_bk_tree(tree, image_hash, max_distance):
+    """Return [(distance, item)] for every item in the tree within max_distance bits of the hash."""
+    found = []
+    if tree['root'] is None:
+        return found
+
+    stack = [tree['root']]
+    while stack:
+        node = stack.pop()
+        distance = hamming_distance(image_hash, node['hash'])
+        if distance <= max_distance:
+            found.extend((distance, item) for item in node['items'])
+
+        # By the triangle inequality, only children this close to the node's distance can hold a match
+        for child_distance, child in node['children'].items():
+            if distance - max_distance <= child_distance <= distance + max_distance:
+                stack.append(child)
+
+    return found
+
+
+def fingerprint_file(file_path):
+    """Return (size, hash of the first and last SAMPLE_BYTES) for a file.
+
+    Copies of the same file always match, and different files almost never do without reading all of them.
+    """
+    size = os.path.getsize(file_path)
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        sha1.update(f.read(SAMPLE_BYTES))
+        if size > SAMPLE_BYTES * 2:
+            f.seek(-SAMPLE_BYTES, os.SEEK_END)
+        sha1.update(f.read(SAMPLE_BYTES))
+    return size, sha1.hexdigest()
+
+
+def find_group(groups, item):
+    """Return the first item of the group an item is in, joining up the path as it goes."""
+    while groups[item] != item:
+        groups[item] = groups[groups[item]]
+        item = groups[item]
+    return item
+
+
+def join_groups(groups, a, b):
+    """Put two items in the same group."""
+    groups[find_group(groups, a)] = find_group(groups, b)
+
+
+def find_duplicates(base_dir, max_distance=DEFAULT_MAX_DISTANCE, jobs=None, workers=DEFAULT_DISCOVERY_WORKERS):
+    """Return the groups of model directories that look like copies of each other.
+
+    Each group is {'models', 'similar_images', 'shared_files', 'wasted_bytes'}, largest waste first.
+    similar_images and shared_files are the (model, model) pairs that matched on their image or their files,
+    and wasted_bytes is the size of the files that are stored more than once in the group.
+    """
+    models = list(scan_models(base_dir, workers=workers))
+    model_dirs = [model['path'] for model in models]
+    groups = list(range(len(models)))
+    similar_images = []
+    shared_files = set()
+
+    # Hash the images across a process pool, decoding is the slow part
+    with phase('dedup_image_hashes'):
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            image_hashes = list(executor.map(hash_image_safe, [model['image_path'] for model in models],
+                                             chunksize=16))
+
+    with phase('dedup_image_matches'):
+        tree = new_bk_tree()
+        for model_id, image_hash in enumerate(image_hashes):
+            # A flat image hashes to 0, and every other flat image would match it
+            if image_hash is None or image_hash == 0:
+                count('dedup_images_skipped')
+                continue
+
+            # Join every match, but only report the closest one so a big group doesn't list every pair
+            matches = find_in_bk_tree(tree, image_hash, max_distance)
+            for distance, other_id in matches:
+                join_groups(groups, other_id, model_id)
+            if matches:
+                distance, other_id = min(matches)
+                similar_images.append((other_id, model_id, distance))
+
+            add_to_bk_tree(tree, image_hash, model_id)
+
+    # Files with the same fingerprint are the same file, however far apart they are in the library
+    models_by_fingerprint = {}
+    with phase('dedup_file_fingerprints'):
+        for model_id, model_dir in enumerate(model_dirs):
+            for file_path in list_payload_files(model_dir):
+                try:
+                    fingerprint = fingerprint_file(file_path)
+                except OSError:
+                    continue
+                count('dedup_files_fingerprinted')
+                models_by_fingerprint.setdefault(fingerprint, set()).add(model_id)
+
+    shared_fingerprints = []
+    for fingerprint, model_ids in models_by_fingerprint.items():
+        if len(model_ids) < 2:
+            continue
+        model_ids = sorted(model_ids)
+        shared_fingerprints.append((fingerprint, model_ids))
+        for model_id in model_ids[1:]:
+            shared_files.add((model_ids[0], model_id))
+            join_groups(groups, model_ids[0], model_id)
+
+    # Collect the groups with more than one model in them
+    members = {}
+    for model_id in range(len(models)):
+        members.setdefault(find_group(groups, model_id), []).append(model_id)
+
+    duplicates = {}
+    for group_id, model_ids in members.items():
+        if len(model_ids) > 1:
+            duplicates[group_id] = {
+                'models': [model_dirs[model_id] for model_id in model_ids],
+                'similar_images': [],
+                'shared_files': [],
+                'wasted_bytes': 0,
+            }
+
+    for a, b, distance in similar_images:
+        duplicates[find_group(groups, a)]['similar_images'].append((model_dirs[a], model_dirs[b], distance))
+
+    for a, b in sorted(shared_files):
+        duplicates[find_group(groups, a)]['shared_files'].append((model_dirs[a], model_dirs[b]))
+
+    # Every copy of a file after the first is wasted space
+    for (size, _), model_ids in shared_fingerprints:
+        duplicates[find_group(groups, model_ids[0])]['wasted_bytes'] += size * (len(model_ids) - 1)
+
+    return sorted(duplicates.values(), key=lambda group: (-group['wasted_bytes'], group['models']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List model folders that are probably copies of each other")
+    parser.add_argument('base_path', type=str, help="Path to the root models directory")
+    parser.add_argument('--max-distance', type=int, default=DEFAULT_MAX_DISTANCE,
+                        help="Number of bits (out of 64) two image hashes can differ by and still match")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help="Number of processes used to hash the images (defaults to the CPU count)")
+    parser.add_argument('--discovery-workers', type=int, default=DEFAULT_DISCOVERY_WORKERS,
+                        help="Number of threads listing directories at once, more helps on network shares")
+    args = parser.parse_args()
+
+    base_path = args.base_path
+    if not os.path.isdir(base_path):
+        print(f"Error: The directory {base_path} does not exist.")
+        sys.exit(1)
+
+    duplicates = find_duplicates(base_path, args.max_distance, args.jobs, args.discovery_workers)
+    if not duplicates:
+        print("No duplicate models found.")
+        return
+
+    for group in duplicates:
+        print(f"\n{len(group['models'])} copies, {format_size(group['wasted_bytes'])} stored more than once:")
+        for model_dir in group['models']:
+            print(f"\t{model_dir}")
+        for a, b, distance in group['similar_images']:
+            print(f"\tSimilar images ({distance} bits apart): {os.path.basename(a)} / {os.path.basename(b)}")
+        for a, b in group['shared_files']:
+            print(f"\tSame files: {os.path.basename(a)} / {os.path.basename(b)}")
+
+    total_wasted = sum(group['wasted_bytes'] for group in duplicates)
+    print(f"\n{len(duplicates)} groups of duplicates, {format_size(total_wasted)} could be freed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+# In-memory index of the model library.
+# Each directory is listed once with os.scandir, and the search functions query the cached
+# listing instead of calling os.listdir on the same folder again.
+# On network shares where every listing has to wait on the server, the walk can list the directories
+# it's about to reach on a pool of threads, while still visiting them in the same order as a serial walk.
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import count, phase
+
+# Number of threads listing directories, 1 lists them one at a time
+DEFAULT_DISCOVERY_WORKERS = 1
+
+# Directories listed ahead of the walk for each thread, so the threads never run out of work
+PREFETCH_PER_WORKER = 4
+
+
+def list_directory(path):
+    """List a directory once and return its files, subfolders and file extensions, sorted by name."""
+    files = []
+    dirs = []
+    mtime_ns = None
+    identity = None
+
+    count('directories_listed')
+    with phase('list_directory'):
+        try:
+            stat = os.stat(path)
+            mtime_ns = stat.st_mtime_ns
+            identity = (stat.st_dev, stat.st_ino)
+
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+
+                    if is_dir:
+                        dirs.append(entry.name)
+                    else:
+                        files.append(entry.name)
+        except OSError as e:
+            print(f"Unable to list {path}: {e}")
+
+    files.sort()
+    dirs.sort()
+
+    return {
+        'path': path,
+        'files': files,
+        'dirs': dirs,
+        'extensions': {os.path.splitext(file_name)[1].lower() for file_name in files},
+        'mtime_ns': mtime_ns,
+        'identity': identity,
+    }
+
+
+def open_listing_pool(workers=DEFAULT_DISCOVERY_WORKERS):
+    """Return a thread pool to list directories ahead of the walk, or None to list them one at a time."""
+    if workers is None or workers <= 1:
+        return None
+    return {
+        'executor': ThreadPoolExecutor(max_workers=workers, thread_name_prefix='list_directory'),
+        'window': workers * PREFETCH_PER_WORKER,
+    }
+
+
+def close_listing_pool(pool):
+    """Stop the listing threads, dropping any listings that were never used."""
+    if pool is not None:
+        pool['executor'].shutdown(cancel_futures=True)
+
+
+def get_subfolder_paths(listing):
+    """Return the paths of the subfolders in a listing."""
+    return [os.path.join(listing['path'], subfolder) for subfolder in listing['dirs']]
+
+
+def prefetch_listings(pool, pending, paths, list_function, get_children=get_subfolder_paths):
+    """Start listing the next paths on the pool, keeping a few listings per thread in flight.
+
+    paths should come in the order the walk will reach them, pending maps path -> future.
+    Once a path has been listed, its subfolders are started too, so the walk doesn't have to
+    wait on every folder one level at a time. Finished listings don't count towards the limit.
+    """
+    if pool is None:
+        return
+
+    in_flight = sum(1 for future in pending.values() if not future.done())
+    for path in paths:
+        if in_flight >= pool['window']:
+            break
+
+        future = pending.get(path)
+        if future is None:
+            pending[path] = pool['executor'].submit(list_function, path)
+            in_flight += 1
+            continue
+
+        if future.done() and future.exception() is None:
+            for child_path in get_children(future.result()):
+                if in_flight >= pool['window']:
+                    break
+                if child_path not in pending:
+                    pending[child_path] = pool['executor'].submit(list_function, child_path)
+                    in_flight += 1
+
+
+def take_listing(pending, path, list_function):
+    """Return the listing for a path, waiting on the pool if it was prefetched or listing it now if not."""
+    future = pending.pop(path, None)
+    if future is None:
+        return list_function(path)
+    return future.result()
+
+
+def build_directory_index(base_dir, follow_links=True, workers=DEFAULT_DISCOVERY_WORKERS):
+    """Walk the tree below base_dir once and return a dict of path -> listing, in top-down order.
+
+    When following symlinks, a link that points back at one of its own parent folders is skipped
+    so symlink loops can't send the walk around forever.
+    With more than one worker, directories are listed ahead of the walk on a thread pool,
+    the index comes out in the same order either way.
+    """
+    index = {}
+    stack = [(base_dir, None, ())]
+    pending = {}
+    pool = open_listing_pool(workers)
+
+    try:
+        while stack:
+            path, parent, ancestors = stack.pop()
+
+            listing = take_listing(pending, path, list_directory)
+
+            # The (device, inode) pair identifies the real folder behind any symlinks
+            identity = listing['identity']
+            if identity is not None and identity in ancestors:
+                print(f"Skipping symlink loop: {path}")
+                count('symlink_loops_skipped')
+                continue
+
+            listing['parent'] = parent
+            index[path] = listing
+
+            ancestors = ancestors + (identity,)
+
+            # Push in reverse so the subfolders come off the stack in sorted order
+            for subfolder in reversed(listing['dirs']):
+                subfolder_path = os.path.join(path, subfolder)
+                if not follow_links and os.path.islink(subfolder_path):
+                    continue
+                stack.append((subfolder_path, path, ancestors))
+
+            # Start listing the folders the walk reaches next, the top of the stack comes off first
+            prefetch_listings(pool, pending, (entry[0] for entry in reversed(stack)), list_directory)
+    finally:
+        close_listing_pool(pool)
+
+    return index
+
+
+def get_listing(folder_path, index=None):
+    """Return the listing for a folder, using the index when the folder is in it."""
+    if index is not None and folder_path in index:
+        return index[folder_path]
+    return list_directory(folder_path)
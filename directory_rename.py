@@ -1,14 +1,24 @@
 import argparse
 import os
 
+from catalog_db import check_library, close_catalog, load_directory_index, open_catalog
+from directory_index import build_directory_index
+from folder_names import DEFAULT_TAG_VOCABULARY, parse_tag_vocabulary, plan_folder_name
 from search_functions import find_directories
 
 
-def rename_dirs(base_dir):
+# With a catalog, the rename is planned from the folders saved by the last scan instead of listing the library again
+# tag_vocabulary is the tags to look for in the folder names, set your own with --tag-vocabulary
+def rename_dirs(base_dir, catalog=None, tag_vocabulary=DEFAULT_TAG_VOCABULARY):
     changed_dirs = []
     unchanged_dirs = []
 
-    invalid_folders, valid_folders = find_directories(base_dir)
+    # List every folder once, and check all of them from the index
+    if catalog is not None:
+        index = load_directory_index(catalog)
+    else:
+        index = build_directory_index(base_dir)
+    invalid_folders, valid_folders = find_directories(base_dir, index)
 
     # Walk through all directories and subdirectories
     for model_dir in valid_folders:
@@ -16,67 +26,9 @@ def rename_dirs(base_dir):
         parent_folder = os.path.dirname(model_dir)
         dirname = os.path.basename(model_dir)
 
-        # Look for the tags in the directory name
-        # These are the only tags I have, so set your own here if you need to.
-        # Also, might want to jump down a few lines and add your own tags to the character_name and model_version
-        tags = []
-        if 'chibi' in dirname.lower():
-            tags.append('Chibi')
-        if 'nsfw' in dirname.lower():
-            tags.append('NSFW')
-
-        character_name = ''
-        model_version = ''
-
-        # Check if ' - ' is in the directory name
-        if ' - ' in dirname:
-            # Split the directory name by ' - ', take the first part as the character name
-            # and the second part as the model version
-            character_name, model_version = dirname.split(' - ')
-
-        else:
-            character_name = dirname
-
-        # Replace the word 'chibi' and 'nsfw' with an empty string.
-        # Leave the rest of the directory name as is, including case.
-        # Also do the same for any custom tags here.
-        character_name = (character_name.replace('chibi', '')
-                  .replace('nsfw', '')
-                  .replace('Chibi', '')
-                  .replace('Nsfw', '')
-                  .replace('CHIBI', '')
-                  .replace('NSFW', '')
-                  .strip())
-
-        model_version = (model_version.replace('chibi', '')
-                  .replace('nsfw', '')
-                  .replace('Chibi', '')
-                  .replace('Nsfw', '')
-                  .replace('CHIBI', '')
-                  .replace('NSFW', '')
-                  .strip())
-
-        # If the character name has a number at the end, remove it and trim the whitespace.
-        # Only do this if it's a single number (for now).
-        version = ''
-        if character_name[-1].isdigit():
-            if character_name[-2].isspace():
-                version = character_name[-1]
-                character_name = character_name[:-1]
-
-
-        # Rebuild the directory name as
+        # Move the tags from the vocabulary to the end and rebuild the directory name as
         # <character_name>_<model_version> <number> - <tags>
-
-        newdir = f"{character_name.strip()}"
-        if model_version:
-            newdir = f"{newdir.strip()}_{model_version.strip()}"
-        if version:
-            newdir = f"{newdir.strip()} {version.strip()}"
-        if tags:
-            newdir = f"{newdir.strip()} - {' '.join(tags)}"
-
-        newdir = newdir.strip()
+        newdir = plan_folder_name(dirname, tag_vocabulary)
 
         newdir = os.path.join(parent_folder, newdir)
 
@@ -128,6 +80,10 @@ def main():
 
         # Add a flag for using model-info.txt
         parser.add_argument('path', type=str, help="Path to the root models directory")
+        parser.add_argument('--catalog-db', type=str, help="Plan the renames from this catalog database")
+        parser.add_argument('--tag-vocabulary', type=parse_tag_vocabulary, default=DEFAULT_TAG_VOCABULARY,
+                            help="Comma separated tags to move to the end of the folder names, "
+                                 f"defaults to {','.join(DEFAULT_TAG_VOCABULARY)}")
 
         # Parse the arguments
         args = parser.parse_args()
@@ -138,7 +94,16 @@ def main():
             print('Invalid path')
             return
 
-        rename_dirs(path)
+        catalog = None
+        if args.catalog_db:
+            catalog = open_catalog(args.catalog_db)
+            if not check_library(catalog, path):
+                return
+
+        rename_dirs(path, catalog, args.tag_vocabulary)
+
+        if catalog is not None:
+            close_catalog(catalog)
 
     except Exception as e:
         print(e)
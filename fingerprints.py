@@ -0,0 +1,273 @@
+# Fingerprint the STL and zip files in each model directory: how many there are, how much space they take,
+# a hash of their content, and whether the zips can still be opened.
+# Files are hashed a fixed size buffer at a time so even huge archives never sit in memory, and the hashes
+# are cached by path, size and modified time so re-runs only read the files that changed.
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from directory_index import DEFAULT_DISCOVERY_WORKERS
+from instrumentation import count, phase
+from scanner import scan_models
+from search_functions import VALID_FILE_EXTENSIONS
+
+# Default location of the cache file
+DEFAULT_FINGERPRINT_CACHE = 'fingerprint-cache.sqlite'
+
+# Bytes read at a time while hashing
+HASH_BUFFER_SIZE = 1024 * 1024
+
+# Threads hashing files at once, hashing and reading both let other threads run
+DEFAULT_HASH_WORKERS = 4
+
+
+def open_fingerprint_cache(cache_file=DEFAULT_FINGERPRINT_CACHE):
+    """Open (or create) the fingerprint cache and return a handle for the other fingerprint functions."""
+    connection = sqlite3.connect(cache_file)
+    connection.execute('CREATE TABLE IF NOT EXISTS files ('
+                       'path TEXT PRIMARY KEY, '
+                       'size INTEGER NOT NULL, '
+                       'mtime_ns INTEGER NOT NULL, '
+                       'hash TEXT NOT NULL, '
+                       'zip_ok INTEGER, '
+                       'last_seen REAL NOT NULL)')
+
+    return {'connection': connection, 'hits': 0, 'misses': 0, 'started': time.time()}
+
+
+def get_cached_fingerprint(cache, file_path, stat):
+    """Return the cached (hash, zip_ok) for a file, or None if it changed since it was hashed."""
+    connection = cache['connection']
+    row = connection.execute('SELECT hash, zip_ok FROM files WHERE path = ? AND size = ? AND mtime_ns = ?',
+                             (file_path, stat.st_size, stat.st_mtime_ns)).fetchone()
+    if row is None:
+        cache['misses'] += 1
+        return None
+
+    connection.execute('UPDATE files SET last_seen = ? WHERE path = ?', (time.time(), file_path))
+    cache['hits'] += 1
+    return row[0], None if row[1] is None else bool(row[1])
+
+
+def store_fingerprint(cache, file_path, stat, file_hash, zip_ok):
+    """Save the hash of a file, along with the size and modified time it was hashed at."""
+    cache['connection'].execute(
+        'INSERT OR REPLACE INTO files (path, size, mtime_ns, hash, zip_ok, last_seen) VALUES (?, ?, ?, ?, ?, ?)',
+        (file_path, stat.st_size, stat.st_mtime_ns, file_hash, None if zip_ok is None else int(zip_ok), time.time()))
+
+
+def close_fingerprint_cache(cache, prune=False):
+    """Save and close the cache.
+
+    With prune set, files that weren't looked at since the cache was opened are dropped first,
+    so only prune when every model in the library was fingerprinted.
+    """
+    connection = cache['connection']
+    pruned = 0
+    if prune:
+        pruned = connection.execute('DELETE FROM files WHERE last_seen < ?', (cache['started'],)).rowcount
+    connection.commit()
+    connection.close()
+
+    print(f"Fingerprint cache: {cache['hits']} hits, {cache['misses']} misses, {pruned} removed")
+
+
+def hash_file(file_path):
+    """Return the sha1 of a file, read HASH_BUFFER_SIZE bytes at a time into the same buffer."""
+    sha1 = hashlib.sha1()
+    buffer = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(file_path, 'rb', buffering=0) as f:
+        while True:
+            size = f.readinto(buffer)
+            if not size:
+                break
+            sha1.update(view[:size])
+    return sha1.hexdigest()
+
+
+def check_zip(file_path):
+    """Return True if the zip's central directory can be read, which catches truncated and corrupt downloads.
+
+    Only the directory at the end of the file is read, the members aren't decompressed.
+    """
+    try:
+        with zipfile.ZipFile(file_path) as archive:
+            size = os.path.getsize(file_path)
+            return all(member.header_offset + member.compress_size <= size for member in archive.infolist())
+    except (zipfile.BadZipFile, OSError, ValueError):
+        return False
+
+
+def read_fingerprint(file_path):
+    """Hash a file and check it if it's a zip, returning (hash, zip_ok). Runs on the hashing threads."""
+    file_hash = hash_file(file_path)
+    zip_ok = check_zip(file_path) if file_path.lower().endswith('.zip') else None
+    return file_hash, zip_ok
+
+
+def list_payload_files(model_dir):
+    """Return the paths of the STL and zip files anywhere in a model directory."""
+    payload_files = []
+    for root, dirs, files in os.walk(model_dir):
+        dirs.sort()
+        for file_name in sorted(files):
+            if os.path.splitext(file_name)[1].lower() in VALID_FILE_EXTENSIONS:
+                payload_files.append(os.path.join(root, file_name))
+    return payload_files
+
+
+def format_size(size):
+    """Return a number of bytes as a short human readable size."""
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024:
+            return f'{size:.1f} {unit}' if unit != 'B' else f'{size} B'
+        size /= 1024
+    return f'{size:.1f} TB'
+
+
+def format_files(model):
+    """Return the text shown in the Files column of the table for a fingerprinted model."""
+    parts = []
+    if model['stl_count']:
+        parts.append(f"{model['stl_count']} STL")
+    if model['zip_count']:
+        parts.append(f"{model['zip_count']} zip")
+    parts.append(format_size(model['payload_bytes']))
+    if model['broken_zips']:
+        parts.append(f"{model['broken_zips']} broken zip")
+    return ', '.join(parts)
+
+
+def fingerprint_models(models, cache=None, workers=DEFAULT_HASH_WORKERS):
+    """Fingerprint the STL and zip files of each model, hashing the ones that aren't cached on a thread pool.
+
+    Each model gets stl_count, zip_count, payload_bytes, payload_hash (a hash of the hashes of all its files,
+    so two copies of a model match wherever they are), broken_zips and the files column text.
+    Returns the paths of the zips that couldn't be read.
+    """
+    broken_zips = []
+
+    # Keep a few models hashing per thread so the pool never sits idle between models
+    window = workers * 4
+    in_flight = deque()
+
+    # Wait for a model's files to be hashed, then fill in its fingerprint
+    def finish(entry):
+        model, stats, fingerprints, futures = entry
+        with phase('fingerprint_hash'):
+            for file_path, future in futures.items():
+                try:
+                    fingerprints[file_path] = future.result()
+                except OSError as e:
+                    print(f"Unable to hash {file_path}: {e}")
+                    continue
+                count('files_hashed')
+                count('bytes_hashed', stats[file_path].st_size)
+                if cache is not None:
+                    store_fingerprint(cache, file_path, stats[file_path], *fingerprints[file_path])
+
+        payload_hash = hashlib.sha1()
+        for file_hash in sorted(file_hash for file_hash, _ in fingerprints.values()):
+            payload_hash.update(file_hash.encode('ascii'))
+
+        model_broken_zips = sorted(file_path for file_path, (_, zip_ok) in fingerprints.items() if zip_ok is False)
+        broken_zips.extend(model_broken_zips)
+
+        model['stl_count'] = sum(1 for file_path in fingerprints if file_path.lower().endswith('.stl'))
+        model['zip_count'] = sum(1 for file_path in fingerprints if file_path.lower().endswith('.zip'))
+        model['payload_bytes'] = sum(stats[file_path].st_size for file_path in fingerprints)
+        model['payload_hash'] = payload_hash.hexdigest()
+        model['broken_zips'] = len(model_broken_zips)
+        model['files'] = format_files(model)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for model in models:
+            with phase('fingerprint_list'):
+                payload_files = list_payload_files(model['model_dir'])
+
+            # Look everything up in the cache first, only the files that changed get read
+            stats = {}
+            fingerprints = {}
+            futures = {}
+            for file_path in payload_files:
+                try:
+                    stats[file_path] = os.stat(file_path)
+                except OSError:
+                    continue
+
+                fingerprint = None
+                if cache is not None:
+                    fingerprint = get_cached_fingerprint(cache, file_path, stats[file_path])
+                if fingerprint is None:
+                    futures[file_path] = executor.submit(read_fingerprint, file_path)
+                else:
+                    fingerprints[file_path] = fingerprint
+
+            in_flight.append((model, stats, fingerprints, futures))
+            while len(in_flight) > window:
+                finish(in_flight.popleft())
+
+        while in_flight:
+            finish(in_flight.popleft())
+
+    return broken_zips
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the STL and zip files in each model directory")
+    parser.add_argument('base_path', type=str, help="Path to the root models directory")
+    parser.add_argument('--fingerprint-cache', type=str, default=DEFAULT_FINGERPRINT_CACHE,
+                        help="Path to the fingerprint cache file")
+    parser.add_argument('--no-fingerprint-cache', action='store_true', help="Hash every file without the cache")
+    parser.add_argument('--hash-workers', type=int, default=DEFAULT_HASH_WORKERS,
+                        help="Number of threads hashing files at once")
+    parser.add_argument('--discovery-workers', type=int, default=DEFAULT_DISCOVERY_WORKERS,
+                        help="Number of threads listing directories at once, more helps on network shares")
+    args = parser.parse_args()
+
+    base_path = args.base_path
+    if not os.path.isdir(base_path):
+        print(f"Error: The directory {base_path} does not exist.")
+        sys.exit(1)
+
+    models = [{'model_dir': record['path']} for record in scan_models(base_path, workers=args.discovery_workers)]
+
+    cache = None
+    if not args.no_fingerprint_cache:
+        cache = open_fingerprint_cache(args.fingerprint_cache)
+    try:
+        broken_zips = fingerprint_models(models, cache, args.hash_workers)
+    finally:
+        if cache is not None:
+            close_fingerprint_cache(cache, prune=True)
+
+    # Biggest models first
+    models.sort(key=lambda model: (-model['payload_bytes'], model['model_dir']))
+    for model in models:
+        print(f"{model['files']:<32} {model['model_dir']}")
+
+    empty_models = [model['model_dir'] for model in models if model['stl_count'] + model['zip_count'] == 0]
+    if empty_models:
+        print(f"\nModels without any STL or zip files: {len(empty_models)}")
+        for model_dir in sorted(empty_models):
+            print(model_dir)
+
+    if broken_zips:
+        print(f"\nZips that can't be opened: {len(broken_zips)}")
+        for file_path in broken_zips:
+            print(file_path)
+
+    total_bytes = sum(model['payload_bytes'] for model in models)
+    print(f"\n{len(models)} models, {sum(model['stl_count'] for model in models)} STL files, "
+          f"{sum(model['zip_count'] for model in models)} zips, {format_size(total_bytes)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# Parser for the model folder naming conventions, shared by main.py, generate_model_info.py and directory_rename.py.
+#     {Model Name}_{Model Variant} {Number} - {Space Separated Tags}
+# The patterns are compiled once, and results are cached per folder name since the same names
+# get parsed again on every run and by every script.
+import os
+import re
+from functools import lru_cache
+
+# ' - ' splits the name from the tags, '_' splits the character from the variant
+TAG_SEPARATOR = re.compile(r' - ')
+VARIANT_SEPARATOR = re.compile(r'_')
+
+# A single digit number at the end of a name, after a space
+TRAILING_NUMBER = re.compile(r'(?<= )(\d)\Z')
+
+# Tags directory_rename.py looks for anywhere in a folder name, set your own with --tag-vocabulary
+DEFAULT_TAG_VOCABULARY = ('Chibi', 'NSFW')
+
+# Number of folder names to keep the parsed results of
+NAME_CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=NAME_CACHE_SIZE)
+def parse_folder_name(folder_name):
+    """Split a model folder name into (character name, model name, tags)."""
+    character_name = folder_name
+    model_name = folder_name
+    tags = ()
+
+    # If the name has a ' - ' in it, the first part is the name and the second part is the space separated tags
+    parts = TAG_SEPARATOR.split(character_name)
+    if len(parts) > 1:
+        tags = tuple(parts[1].strip().split(' '))
+        character_name = parts[0].strip()
+        model_name = character_name
+
+    # If the character name has a single number at the end, remove it
+    character_name = TRAILING_NUMBER.sub('', character_name, count=1)
+
+    # If the character name has an '_' in it, the first part is the character name and the second part is the variant
+    parts = VARIANT_SEPARATOR.split(character_name)
+    if len(parts) > 1:
+        character_name = parts[0].strip()
+        model_name = character_name + ' - ' + parts[1].strip()
+    else:
+        character_name = character_name.strip()
+
+    return character_name, model_name, tags
+
+
+def parse_model_path(model_dir, folder_name):
+    """Work out the model details from the names of the model folder and the folders above it.
+
+    folder_name is the name of the library folder, the folder below it is the category.
+    Returns {'character_name', 'model_name', 'series_name', 'category', 'tags'} with the tags as a list.
+    """
+    # Break the path up into tokens separated by the path separator
+    tokens = model_dir.split(os.sep)
+
+    # Start at the token that matches the folder name.
+    # Could probably screw up here if the folder name is not unique to a subfolder.
+    category = ''
+    for i in range(len(tokens) - 1):
+        if tokens[i] == folder_name:
+            category = tokens[i + 1]
+            break
+
+    character_name, model_name, tags = parse_folder_name(tokens[-1])
+
+    return {
+        'character_name': character_name,
+        'model_name': model_name,
+        'series_name': tokens[-2] if len(tokens) > 1 else '',
+        'category': category,
+        'tags': list(tags),
+    }
+
+
+@lru_cache(maxsize=None)
+def compile_tag_pattern(tag_vocabulary):
+    """Compile a pattern that finds any of the tags in a folder name, ignoring case."""
+    return re.compile('|'.join(re.escape(tag) for tag in tag_vocabulary), re.IGNORECASE)
+
+
+@lru_cache(maxsize=NAME_CACHE_SIZE)
+def plan_folder_name(folder_name, tag_vocabulary=DEFAULT_TAG_VOCABULARY):
+    """Return the folder name rebuilt to follow the naming conventions, for directory_rename.py.
+
+    Tags from the vocabulary found anywhere in the name (ignoring case) are moved to the end,
+    as <character_name>_<model_version> <number> - <tags>
+    """
+    tag_pattern = compile_tag_pattern(tag_vocabulary)
+    found_tags = {match.lower() for match in tag_pattern.findall(folder_name)}
+    tags = [tag for tag in tag_vocabulary if tag.lower() in found_tags]
+
+    # Split the name by ' - ', the first part is the character name and the second part is the model version
+    parts = TAG_SEPARATOR.split(folder_name, maxsplit=1)
+    character_name = parts[0]
+    model_version = parts[1] if len(parts) > 1 else ''
+
+    # Remove the tags, leaving the rest of the name as is, including case
+    character_name = tag_pattern.sub('', character_name).strip()
+    model_version = tag_pattern.sub('', model_version).strip()
+
+    # If the character name has a single number at the end, it's the version number
+    version = ''
+    match = TRAILING_NUMBER.search(character_name)
+    if match:
+        version = match.group(1)
+        character_name = character_name[:match.start()]
+
+    new_name = character_name.strip()
+    if model_version:
+        new_name = f"{new_name.strip()}_{model_version}"
+    if version:
+        new_name = f"{new_name.strip()} {version}"
+    if tags:
+        new_name = f"{new_name.strip()} - {' '.join(tags)}"
+
+    return new_name.strip()
+
+
+def parse_tag_vocabulary(value):
+    """Turn a comma separated list of tags from the command line into a tag vocabulary."""
+    return tuple(tag.strip() for tag in value.split(',') if tag.strip())
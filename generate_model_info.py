@@ -1,9 +1,14 @@
 # Write a program to go through all subdirectories of a given directory.
 # If the directory contains an image, and a folder called 'STL' under it, print the name of the folder.
 import argparse
+import difflib
 import os
+import sys
 
-from search_functions import is_valid_folder, find_directories
+from directory_index import build_directory_index
+from folder_names import parse_model_path
+from instrumentation import count, phase, reset_stats, start_profile, stop_profile, write_stats_json
+from search_functions import find_directories
 
 
 # Method to read files
@@ -12,124 +17,154 @@ def read_file(file):
         data = f.read()
     return data
 
-def create_model_info(file_path, model_name, character_name, series, tags, model_category):
-    """Create a model-info.txt file with the provided model details."""
-    # Overwrite the file if it already exists
-    with open(file_path, 'w') as f:
-        f.write(f"Model Name: {model_name}\n")
-        f.write(f"Character Name: {character_name}\n")
-        f.write(f"Series: {series}\n")
-        f.write(f"Tags: {', '.join(tags)}\n")
-        f.write(f"Model Category: {model_category}\n")
-
-def print_model_info(file_path, model_name, character_name, series, tags, model_category):
-    """Print the model details to the console."""
-    print(f"\nDirectory: {file_path}")
-    print("Model Info:")
-    print(f"\tModel Name: {model_name}")
-    print(f"\tCharacter Name: {character_name}")
-    print(f"\tSeries: {series}")
-    print(f"\tTags: {', '.join(tags)}")
-    print(f"\tModel Category: {model_category}")
-
-
-# Method to generate the html file from the directory structure
-def gen_model_info_from_directory_structure(path):
+# Number of lines of output collected before they're written to the console in one go
+OUTPUT_BATCH_SIZE = 500
+
+def format_model_info(model_name, character_name, series, tags, model_category):
+    """Return the contents of a model-info.txt file with the provided model details."""
+    return (f"Model Name: {model_name}\n"
+            f"Character Name: {character_name}\n"
+            f"Series: {series}\n"
+            f"Tags: {', '.join(tags)}\n"
+            f"Model Category: {model_category}\n")
+
+def read_model_info(file_path):
+    """Return the current contents of a model-info.txt file, or None if it doesn't exist or can't be read."""
+    try:
+        return read_file(file_path)
+    except (OSError, UnicodeDecodeError):
+        return None
+
+def write_model_info(file_path, content):
+    """Write a model-info.txt file through a temp file, so a failed write never leaves half a file behind."""
+    temp_path = os.path.join(os.path.dirname(file_path), '.model-info.txt.tmp')
+    with open(temp_path, 'w') as f:
+        f.write(content)
+    os.replace(temp_path, file_path)
+
+def update_model_info(file_path, content, dry_run=False):
+    """Write a model-info.txt file only if its contents changed.
+
+    Returns ('created' | 'changed' | 'unchanged', old contents). With dry_run nothing is written.
+    """
+    old_content = read_model_info(file_path)
+    if old_content == content:
+        return 'unchanged', old_content
+
+    if not dry_run:
+        with phase('write_model_info'):
+            write_model_info(file_path, content)
+        count('model_info_written')
+
+    return ('created' if old_content is None else 'changed'), old_content
+
+def get_model_info_diff(file_path, old_content, content):
+    """Return the lines that changed in a model-info.txt file, as a unified diff without context."""
+    return list(difflib.unified_diff((old_content or '').splitlines(), content.splitlines(),
+                                     fromfile=file_path, tofile=file_path, n=0, lineterm=''))
+
+def print_model_info(file_path, model_name, character_name, series, tags, model_category, output=None):
+    """Print the model details to the console, or add them to output to be printed later."""
+    lines = [
+        f"\nDirectory: {file_path}",
+        "Model Info:",
+        f"\tModel Name: {model_name}",
+        f"\tCharacter Name: {character_name}",
+        f"\tSeries: {series}",
+        f"\tTags: {', '.join(tags)}",
+        f"\tModel Category: {model_category}",
+    ]
+    if output is None:
+        print('\n'.join(lines))
+    else:
+        output.extend(lines)
+
+def flush_output(output, force=False):
+    """Write the collected lines to the console once there's a batch of them, or now if force is set."""
+    if output and (force or len(output) >= OUTPUT_BATCH_SIZE):
+        sys.stdout.write('\n'.join(output) + '\n')
+        output.clear()
+
+
+# Method to generate the model-info.txt files from the directory structure
+# Only files whose contents changed are written. With dry_run nothing is written, and the changes are
+# reported as diffs instead, up to max_diffs of them. With verbose the details of every model are printed.
+def gen_model_info_from_directory_structure(path, dry_run=False, verbose=False, max_diffs=20):
 
     total_dirs = 0
     models_to_check = []
-    invalid_folders, valid_folders = find_directories(path)
-
-    for model_dir in valid_folders:
-
-        # Break the path up into tokens separated by '/'
-        tokens = model_dir.split('\\')
-        folder_name = os.path.basename(path)
-
-        category = ''
-
-        # Start at the token that matches the folder name.
-        # Could probably screw up here if the folder name is not unique to a subfolder.
-        # But that doesn't sound like a "me" problem.
-        for i in range(len(tokens)):
-            if tokens[i] == folder_name:
-                # Save the next token as the category.
-                category = tokens[i + 1]
-                break
-
-        tags = []
-
-        # Save the folder above the Model folder as 'Series Name'.
-        series_name = tokens[-2]
-        # Save the Name of the folder as 'Model Name'.
-        model_name = tokens[-1]
-        character_name = tokens[-1]
-
-        # If the character name has a '-' in it, split it and take the first part.
-        if ' - ' in character_name:
-            model_tags = character_name.split(' - ')[1].strip()
-            character_name = character_name.split(' - ')[0]
-            character_name = character_name.strip()
-            model_name = character_name
-
-            # Get the model tags
-            # Split the model_tags by spaces, and add them to the tags list.
-            model_tags = model_tags.split(' ')
-            for tag in model_tags:
-                tags.append(tag)
-
-        # If the character name has a number at the end, remove it and trim the whitespace.
-        # Only do this if it's a single number (for now).
-        if character_name[-1].isdigit():
-            if character_name[-2] == ' ':
-                character_name = character_name[:-1]
-
-        # If the character name has an '_' in it, split it.
-        # The first part becomes the character name, and the second part becomes the model name.
-        if '_' in character_name:
-            model_name = character_name.split('_')[1]
-            character_name = character_name.split('_')[0]
-
-            character_name = character_name.strip()
-            model_name = character_name + ' - ' + model_name.strip()
-
-        else:
-            character_name = character_name.strip()
-
-        # Print the model info to the console
-        print_model_info(
-            file_path=model_dir,
-            model_name=model_name,
-            character_name=character_name,
-            series=series_name,
-            tags=tags,
-            model_category=category
-        )
-
-        # Write the output to the html file
-        # Embed the image data in the html file as a base64 string
-        create_model_info(
-            file_path=os.path.join(model_dir, 'model-info.txt'),
-            model_name=model_name,
-            character_name=character_name,
-            series=series_name,
-            tags=tags,
-            model_category=category
-        )
+    results = {'created': [], 'changed': [], 'unchanged': []}
+    output = []
+
+    # List every folder once, and check all of them from the index
+    index = build_directory_index(path)
+    invalid_folders, valid_folders = find_directories(path, index)
+    folder_name = os.path.basename(path)
+
+    for model_dir in sorted(valid_folders):
+
+        # Work out the model details from the folder names
+        model = parse_model_path(model_dir, folder_name)
+        model_name = model['model_name']
+        character_name = model['character_name']
+        series_name = model['series_name']
+        category = model['category']
+        tags = model['tags']
+
+        # Print the model info to the console, in batches so a big library doesn't flood it one line at a time
+        if verbose:
+            print_model_info(
+                file_path=model_dir,
+                model_name=model_name,
+                character_name=character_name,
+                series=series_name,
+                tags=tags,
+                model_category=category,
+                output=output
+            )
+            flush_output(output)
+
+        # Only write the model-info.txt file if it changed
+        model_info_file = os.path.join(model_dir, 'model-info.txt')
+        content = format_model_info(model_name, character_name, series_name, tags, category)
+        status, old_content = update_model_info(model_info_file, content, dry_run)
+        results[status].append((model_info_file, old_content, content))
+        count(f'model_info_{status}')
 
         total_dirs += 1
 
         if character_name == series_name:
             models_to_check.append(model_dir)
 
+    flush_output(output, force=True)
+
     print(f"\nTotal Directories: {total_dirs}")
+    print(f"{'Would create' if dry_run else 'Created'}: {len(results['created'])}")
+    print(f"{'Would change' if dry_run else 'Changed'}: {len(results['changed'])}")
+    print(f"Unchanged: {len(results['unchanged'])}")
+
+    # Show what would change, new files are listed by name since every line in them is new
+    if dry_run:
+        changes = results['created'] + results['changed']
+        for model_info_file, old_content, content in changes[:max_diffs]:
+            if old_content is None:
+                output.append(f"\nNew file: {model_info_file}")
+            else:
+                output.append('')
+                output.extend(get_model_info_diff(model_info_file, old_content, content))
+            flush_output(output)
+        if len(changes) > max_diffs:
+            output.append(f"\n... and {len(changes) - max_diffs} more")
+        flush_output(output, force=True)
 
     # Sort the models to check
     models_to_check.sort()
 
     print("\nModels to Check:")
-    for model in models_to_check:
-        print(model)
+    output.extend(models_to_check)
+    flush_output(output, force=True)
+
+    return results
 
 # Main function
 def main():
@@ -139,6 +174,15 @@ def main():
 
         # Add a flag for using model-info.txt
         parser.add_argument('path', type=str, help="Path to the root models directory")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Don't write anything, show what would change instead")
+        parser.add_argument('--max-diffs', type=int, default=20,
+                            help="Number of changed files to show the diff of with --dry-run")
+        parser.add_argument('--verbose', action='store_true', help="Print the details of every model")
+
+        # Instrumentation options
+        parser.add_argument('--profile', type=str, help="Save a cProfile dump of the run to this file")
+        parser.add_argument('--stats-json', type=str, help="Save the phase timings and counters to this JSON file")
 
         # Parse the arguments
         args = parser.parse_args()
@@ -149,7 +193,16 @@ def main():
             print('Invalid path')
             return
 
-        gen_model_info_from_directory_structure(path)
+        reset_stats()
+        profiler = start_profile(args.profile)
+
+        with phase('total'):
+            gen_model_info_from_directory_structure(path, args.dry_run, args.verbose, args.max_diffs)
+
+        stop_profile(profiler, args.profile)
+        if args.stats_json:
+            write_stats_json(args.stats_json)
+            print(f'Stats written to {args.stats_json}')
 
     except Exception as e:
         print(e)
@@ -0,0 +1,115 @@
+# Fast image checks that only read the first few bytes of a file.
+# The format is worked out from the magic bytes at the start of the file, and the size is read from
+# the header where the format makes that cheap, so Pillow only has to open each image once to encode it.
+import os
+import struct
+
+from PIL import Image
+
+from instrumentation import count
+
+# How many bytes to read to identify the format
+HEADER_SIZE = 32
+
+# JPEG start of frame markers, which hold the image size
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# Results of read_image_header, keyed by (path, mtime)
+_image_info_cache = {}
+
+
+def identify_format(header):
+    """Return the Pillow format name for the magic bytes at the start of a file, or None."""
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'JPEG'
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'PNG'
+    if header.startswith((b'GIF87a', b'GIF89a')):
+        return 'GIF'
+    if header.startswith(b'BM'):
+        return 'BMP'
+    if header.startswith((b'II*\x00', b'MM\x00*')):
+        return 'TIFF'
+    if header.startswith(b'RIFF') and header[8:12] == b'WEBP':
+        return 'WEBP'
+    if header[4:8] == b'ftyp' and header[8:12] in (b'avif', b'avis'):
+        return 'AVIF'
+    return None
+
+
+def read_jpeg_size(f):
+    """Walk the JPEG markers until the start of frame and return (width, height), or (None, None)."""
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        # Skip any fill bytes before the marker
+        while byte == b'\xff':
+            byte = f.read(1)
+        if not byte:
+            return None, None
+
+        marker = byte[0]
+        length_data = f.read(2)
+        if len(length_data) < 2:
+            return None, None
+        length = struct.unpack('>H', length_data)[0]
+
+        if marker in JPEG_SOF_MARKERS:
+            frame = f.read(5)
+            if len(frame) < 5:
+                return None, None
+            height, width = struct.unpack('>HH', frame[1:5])
+            return width, height
+
+        f.seek(length - 2, os.SEEK_CUR)
+
+        # Read the 0xFF that starts the next marker
+        if f.read(1) != b'\xff':
+            return None, None
+
+
+def read_image_size(f, image_format, header):
+    """Return (width, height) from the image header, or (None, None) if the format doesn't make it cheap."""
+    if image_format == 'PNG' and len(header) >= 24:
+        return struct.unpack('>II', header[16:24])
+    if image_format == 'GIF' and len(header) >= 10:
+        return struct.unpack('<HH', header[6:10])
+    if image_format == 'BMP' and len(header) >= 26:
+        width, height = struct.unpack('<ii', header[18:26])
+        return width, abs(height)
+    if image_format == 'JPEG':
+        return read_jpeg_size(f)
+    return None, None
+
+
+def read_image_header(file):
+    """Identify an image from its header and return {'format', 'width', 'height'}, or None if it isn't one.
+
+    Results are cached by path and modified time, so checking the same file again only costs a stat.
+    """
+    try:
+        mtime_ns = os.stat(file).st_mtime_ns
+    except OSError:
+        return None
+
+    key = (file, mtime_ns)
+    if key in _image_info_cache:
+        return _image_info_cache[key]
+
+    image_info = None
+    count('image_headers_read')
+    try:
+        with open(file, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+            image_format = identify_format(header)
+
+            # Only accept formats this install of Pillow can actually open
+            Image.init()
+            if image_format is not None and image_format in Image.OPEN:
+                width, height = read_image_size(f, image_format, header)
+                image_info = {'format': image_format, 'width': width, 'height': height}
+    except (OSError, struct.error):
+        image_info = None
+
+    _image_info_cache[key] = image_info
+    return image_info
@@ -0,0 +1,77 @@
+// Search data written by main.py (see write_index_page) for the index page of a split up catalog.
+// shards lists every page, and rows holds one [character, model, series, category, page] entry per model.
+let searchIndex = null;
+
+// The searchable columns of each row, already uppercased like the search on each page
+let searchText = [];
+
+// Timer used to wait for the user to stop typing before searching
+let searchTimer = null;
+
+// Only the first results are shown, the rest are on the pages they link to
+const MAX_SEARCH_RESULTS = 200;
+
+function loadSearchIndex() {
+    searchIndex = JSON.parse(document.getElementById("searchIndex").textContent);
+    searchText = searchIndex.rows.map(row => row.slice(0, 4).join("\n").toUpperCase());
+}
+
+function escapeHtml(text) {
+    return text.replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;").replace(/"/g, "&quot;");
+}
+
+function searchPages() {
+    clearTimeout(searchTimer);
+
+    const value = document.getElementById("globalFilter").value;
+    const search = value.toUpperCase();
+    const shardList = document.getElementById("shardList");
+    const results = document.getElementById("searchResults");
+    const summary = document.getElementById("searchSummary");
+
+    if (search === "") {
+        shardList.style.display = "";
+        results.style.display = "none";
+        summary.textContent = "";
+        return;
+    }
+
+    let rowsHtml = "";
+    let found = 0;
+    for (let i = 0; i < searchText.length; i++) {
+        if (searchText[i].indexOf(search) < 0) {
+            continue;
+        }
+
+        found++;
+        if (found > MAX_SEARCH_RESULTS) {
+            continue;
+        }
+
+        // Link to the page with the search already filled in
+        const row = searchIndex.rows[i];
+        const shard = searchIndex.shards[row[4]];
+        const link = `${encodeURI(shard.file)}?q=${encodeURIComponent(value)}`;
+        rowsHtml += `<tr>` +
+            `<td>${escapeHtml(row[0])}</td>` +
+            `<td>${escapeHtml(row[1])}</td>` +
+            `<td>${escapeHtml(row[2])}</td>` +
+            `<td>${escapeHtml(row[3])}</td>` +
+            `<td><a href="${link}">${escapeHtml(shard.title)}</a></td>` +
+            `</tr>`;
+    }
+
+    results.tBodies[0].innerHTML = rowsHtml;
+    results.style.display = "";
+    shardList.style.display = "none";
+    summary.textContent = found > MAX_SEARCH_RESULTS ?
+        `Showing ${MAX_SEARCH_RESULTS} of ${found} models` : `Found ${found} models`;
+}
+
+// Search once the user has stopped typing for a moment, instead of on every key
+function scheduleSearchPages() {
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(searchPages, 150);
+}
+
+loadSearchIndex();
@@ -0,0 +1,82 @@
+# Timing and counters for the catalog pipeline.
+# Phases add up the time spent in each part of a run, and counters track how much work was done,
+# so a slow build can be narrowed down to the walk, parsing, Pillow or writing the html.
+import cProfile
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Stats for the current run
+_stats = {'phases': {}, 'counters': {}}
+
+# Directories can be listed from several threads at once, so updates to the stats are locked
+_stats_lock = threading.Lock()
+
+
+def reset_stats():
+    """Clear all phase timings and counters."""
+    _stats['phases'] = {}
+    _stats['counters'] = {}
+
+
+def add_time(name, seconds):
+    """Add time to a phase, for work that can't be wrapped in a single with block."""
+    with _stats_lock:
+        entry = _stats['phases'].setdefault(name, {'seconds': 0.0, 'calls': 0})
+        entry['seconds'] += seconds
+        entry['calls'] += 1
+
+
+@contextmanager
+def phase(name):
+    """Time the code in the with block and add it to the named phase."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(name, time.perf_counter() - start)
+
+
+def count(name, amount=1):
+    """Add to a counter."""
+    with _stats_lock:
+        _stats['counters'][name] = _stats['counters'].get(name, 0) + amount
+
+
+def get_stats():
+    """Return a copy of the phase timings and counters."""
+    return {
+        'phases': {name: dict(entry) for name, entry in _stats['phases'].items()},
+        'counters': dict(_stats['counters']),
+    }
+
+
+def write_stats_json(file_path, extra=None):
+    """Write the phase timings and counters to a JSON file, along with any extra details about the run."""
+    stats = get_stats()
+    if extra:
+        stats.update(extra)
+
+    with open(file_path, 'w') as f:
+        json.dump(stats, f, indent=2)
+
+
+def start_profile(profile_file):
+    """Start a cProfile run if a file was given to save it to, and return the profiler."""
+    if not profile_file:
+        return None
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def stop_profile(profiler, profile_file):
+    """Stop the profiler and save the results, so they can be opened with pstats or snakeviz."""
+    if profiler is None:
+        return
+
+    profiler.disable()
+    profiler.dump_stats(profile_file)
+    print(f'Profile written to {profile_file}')
@@ -1,27 +1,53 @@
+import argparse
 import os
 import sys
 
+from catalog_db import check_library, close_catalog, load_directory_index, open_catalog
+from directory_index import DEFAULT_DISCOVERY_WORKERS, build_directory_index
 from search_functions import find_directories
 
 
-def find_invalid_folders(base_path):
-    """Find folders that do not match valid criteria, considering parent folder validity."""
+def find_invalid_folders(base_path, catalog=None, workers=DEFAULT_DISCOVERY_WORKERS, stl_previews=False):
+    """Find folders that do not match valid criteria, considering parent folder validity.
 
-    invalid_folders, valid_folders = find_directories(base_path)
+    With a catalog, the folders saved by the last scan are checked instead of listing the library again.
+    With stl_previews set, model folders that only have an STL folder and no image aren't reported.
+    """
+
+    # List every folder once, and check all of them from the index
+    if catalog is not None:
+        index = load_directory_index(catalog)
+    else:
+        index = build_directory_index(base_path, workers=workers)
+    invalid_folders, valid_folders = find_directories(base_path, index, stl_previews=stl_previews)
     return invalid_folders
 
 
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: python script.py <base_path>")
-        sys.exit(1)
-
-    base_path = sys.argv[1]
+    parser = argparse.ArgumentParser(description="Find folders with models that don't follow the directory structure")
+    parser.add_argument('base_path', type=str, help="Path to the root models directory")
+    parser.add_argument('--catalog-db', type=str, help="Check the folders saved in this catalog database instead")
+    parser.add_argument('--discovery-workers', type=int, default=DEFAULT_DISCOVERY_WORKERS,
+                        help="Number of threads listing directories at once, more helps on network shares")
+    parser.add_argument('--stl-previews', action='store_true',
+                        help="Don't report model folders without an image, main.py --stl-previews renders one for them")
+    args = parser.parse_args()
+
+    base_path = args.base_path
     if not os.path.isdir(base_path):
         print(f"Error: The directory {base_path} does not exist.")
         sys.exit(1)
 
-    invalid_folders = find_invalid_folders(base_path)
+    catalog = None
+    if args.catalog_db:
+        catalog = open_catalog(args.catalog_db)
+        if not check_library(catalog, base_path):
+            sys.exit(1)
+
+    invalid_folders = find_invalid_folders(base_path, catalog, args.discovery_workers, args.stl_previews)
+
+    if catalog is not None:
+        close_catalog(catalog)
 
     if invalid_folders:
         print("Invalid folders with images, STL, or ZIP files:")
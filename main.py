@@ -2,12 +2,41 @@
 # If the directory contains an image, and a folder called 'STL' under it, print the name of the folder.
 import argparse
 import base64
+import hashlib
+import html
+import json
 import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
 
 from PIL import Image
 
-from search_functions import contains_stl_folder, is_valid_image_file
+from catalog_db import (DEFAULT_CATALOG_FILE, check_library, close_catalog, find_missing_thumbnails,
+                        get_catalog_thumbnail, load_models, open_catalog, store_catalog_thumbnail, store_library_listings,
+                        store_models)
+from directory_index import DEFAULT_DISCOVERY_WORKERS
+from fingerprints import (DEFAULT_FINGERPRINT_CACHE, DEFAULT_HASH_WORKERS, close_fingerprint_cache,
+                          fingerprint_models, open_fingerprint_cache)
+from folder_names import parse_model_path
+from image_header import read_image_header
+from instrumentation import (add_time, count, phase, reset_stats, start_profile, stop_profile,
+                             write_stats_json)
+from manifest import (DEFAULT_MANIFEST_FILE, cached_model, get_directory_mtimes, load_manifest, next_manifest,
+                      record_model, record_thumbnail_hash, save_manifest)
+from scanner import find_image_file, has_preview_folder, scan_models, walk_library
+from shards import (hash_template_files, load_shard_state, plan_shards, remove_stale_shards, save_shard_state,
+                    shard_signature)
+from stl_info import DEFAULT_STL_INFO_CACHE, close_stl_info_cache, open_stl_info_cache, read_models_stl_info
+from stl_preview import DEFAULT_PREVIEW_DIR, DEFAULT_PREVIEW_SIZE, add_stl_previews, remove_unused_previews
+from thumbnail_cache import (DEFAULT_CACHE_FILE, DEFAULT_MAX_BYTES, close_thumbnail_cache, get_cached_thumbnail,
+                             open_thumbnail_cache, store_thumbnail, thumbnail_cache_key)
+from watcher import (DEFAULT_DEBOUNCE, DEFAULT_POLL_INTERVAL, close_watcher, open_watcher, update_watches,
+                     wait_for_changes)
+from zip_contents import (DEFAULT_ZIP_CACHE, DEFAULT_ZIP_WORKERS, add_zip_previews, close_zip_cache, inspect_zips,
+                          open_zip_cache)
 
 # Read the model info from the model-info.txt file
 def parse_model_info(file_path):
@@ -40,27 +69,213 @@ def read_file(file):
         data = f.read()
     return data
 
-# Method to read an image, resize it, and convert it to base64 to embed in the html file
-def get_image_base64_data(file, max_height=200):
-    with Image.open(file) as img:
-        # Resize the image to a max height of 200px
+# Output formats for the thumbnails, with their mime type and file extension
+THUMBNAIL_FORMATS = {
+    'JPEG': {'mime_type': 'image/jpeg', 'extension': '.jpg'},
+    'WEBP': {'mime_type': 'image/webp', 'extension': '.webp'},
+}
+
+# Assets are named after the sha1 of the thumbnail, so the clean up never touches other images in the folder
+ASSET_FILE_NAME = re.compile(r'[0-9a-f]{40}(%s)\Z' % '|'.join(
+    re.escape(thumbnail_format['extension']) for thumbnail_format in THUMBNAIL_FORMATS.values()))
+
+# Resampling filters that can be used to shrink the images
+RESAMPLE_FILTERS = {
+    'nearest': Image.Resampling.NEAREST,
+    'bilinear': Image.Resampling.BILINEAR,
+    'bicubic': Image.Resampling.BICUBIC,
+    'lanczos': Image.Resampling.LANCZOS,
+}
+
+# Default thumbnail settings, these match what the thumbnails have always looked like
+DEFAULT_THUMBNAIL_OPTIONS = {
+    'max_height': 200,
+    'format': 'JPEG',
+    'quality': 75,
+    'resample': 'bicubic',
+}
+
+# Shrink by whole factors with reduce() until the image is within this factor of the final size,
+# then resample the rest of the way. Quality is indistinguishable from a full resample at 3.
+REDUCING_GAP = 3.0
+
+# Method to get the value used in the thumbnail cache key for the output settings
+def thumbnail_options_key(options):
+    return f"{options['format']}-{options['quality']}-{options['resample']}"
+
+# Method to shrink an open image to a size and convert it to mode
+def shrink_image(img, size, mode='RGB', resample='bicubic'):
+    # Let the JPEG decoder scale down by 1/2, 1/4 or 1/8 while decoding,
+    # so large renders are never decoded at their full resolution
+    if img.format == 'JPEG':
+        img.draft(mode, size)
+
+    # reduce() can't handle 16-bit grayscale (I;16, I;16B, ...), so those are resampled in one step
+    reducing_gap = None if img.mode.startswith('I;16') else REDUCING_GAP
+    resized_img = img.resize(size, resample=RESAMPLE_FILTERS[resample], reducing_gap=reducing_gap)
+    return resized_img.convert(mode)
+
+# Method to read an image and resize it into the bytes used for the thumbnail
+# Passing in the format found by read_image_header saves Pillow from trying every other format first.
+def encode_thumbnail(file, options=None, image_format=None):
+    if options is None:
+        options = DEFAULT_THUMBNAIL_OPTIONS
+
+    formats = [image_format] if image_format else None
+    with Image.open(file, formats=formats) as img:
+        # Resize the image to the max height, 200px by default
         # Calculate the new size while maintaining aspect ratio
         aspect_ratio = img.width / img.height
-        new_height = min(max_height, img.height)
-        new_width = int(new_height * aspect_ratio)
+        new_height = min(options['max_height'], img.height)
+        new_width = max(1, int(new_height * aspect_ratio))
 
         # Resize the image
-        resized_img = img.resize((new_width, new_height))
-        resized_img = resized_img.convert('RGB')
+        resized_img = shrink_image(img, (new_width, new_height), 'RGB', options['resample'])
 
         buffered = BytesIO()
-        resized_img.save(buffered, format="JPEG")
-        img_str = base64.b64encode(buffered.getvalue()).decode('utf-8')
+        resized_img.save(buffered, format=options['format'], quality=options['quality'])
+    return buffered.getvalue()
+
+# Method to encode a thumbnail in a worker process and return it along with how long Pillow took,
+# since the instrumentation in the worker process isn't shared with the main process
+def encode_thumbnail_timed(file, options=None, image_format=None):
+    start = time.perf_counter()
+    data = encode_thumbnail(file, options, image_format)
+    return data, time.perf_counter() - start
+
+# Method to read an image, resize it, and convert it to base64 to embed in the html file
+# If a thumbnail cache is passed in, unchanged images are read from it instead of being re-encoded.
+def get_image_base64_data(file, max_height=200, cache=None):
+    options = dict(DEFAULT_THUMBNAIL_OPTIONS, max_height=max_height)
+    if cache is None:
+        data = encode_thumbnail(file, options)
+    else:
+        key = thumbnail_cache_key(file, max_height, thumbnail_options_key(options))
+        data = get_cached_thumbnail(cache, key)
+        if data is None:
+            data = encode_thumbnail(file, options)
+            store_thumbnail(cache, key, data)
+
+    img_str = base64.b64encode(data).decode('utf-8')
     return img_str
 
+# Method to encode the thumbnails for all the models found during discovery.
+# Cached thumbnails are read in this process, everything else is spread across a process pool.
+# Rows are yielded in the original order as soon as they're ready, with only a bounded window of
+# thumbnails in memory at once. Images that fail are added to failures instead of stopping the run.
+def encode_images(models, jobs=None, cache=None, options=None, failures=None):
+    if options is None:
+        options = DEFAULT_THUMBNAIL_OPTIONS
+    if failures is None:
+        failures = []
+
+    # Keep a few thumbnails queued per process so the pool never sits idle
+    window = (jobs or os.cpu_count() or 1) * 4
+    in_flight = deque()
+    executor = None
+
+    # Turn a finished entry into a table row, or record why it failed
+    def finish(entry):
+        model, key, data, future = entry
+        if future is not None:
+            try:
+                with phase('encode_wait'):
+                    data, seconds = future.result()
+            except Exception as e:
+                failures.append({'image_path': model['image_path'], 'error': str(e)})
+                count('images_failed')
+                return None
+
+            add_time('pillow_encode', seconds)
+            count('images_encoded')
+            if cache is not None:
+                store_thumbnail(cache, key, data)
+        else:
+            count('thumbnail_cache_hits')
+
+        # Only the hash stays on the model, the thumbnail itself is dropped once the row is written
+        model['thumbnail_hash'] = hashlib.sha1(data).hexdigest()
+        row = dict(model)
+        row['image_data'] = data
+        row['image_format'] = options['format']
+        return row
+
+    try:
+        for model in models:
+            image_path = model['image_path']
+            key = None
+            data = None
+            if cache is not None:
+                try:
+                    key = thumbnail_cache_key(image_path, options['max_height'], thumbnail_options_key(options))
+                except OSError as e:
+                    failures.append({'image_path': image_path, 'error': str(e)})
+                    continue
+
+                data = get_cached_thumbnail(cache, key)
+
+            future = None
+            if data is None:
+                # The header was already read during discovery, so this is only a stat
+                image_info = read_image_header(image_path)
+                if image_info is None:
+                    failures.append({'image_path': image_path, 'error': 'not a supported image file'})
+                    continue
+
+                if executor is None:
+                    executor = ProcessPoolExecutor(max_workers=jobs)
+                future = executor.submit(encode_thumbnail_timed, image_path, options, image_info['format'])
+
+            in_flight.append((model, key, data, future))
+
+            while len(in_flight) > window:
+                row = finish(in_flight.popleft())
+                if row is not None:
+                    yield row
+
+        while in_flight:
+            row = finish(in_flight.popleft())
+            if row is not None:
+                yield row
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+# Method to save each encoded thumbnail into the catalog database as the rows go past
+def save_catalog_thumbnails(catalog, rows):
+    for row in rows:
+        store_catalog_thumbnail(catalog, row['thumbnail_hash'], row['image_format'], row['image_data'])
+        yield row
+
+# Method to read the thumbnails saved in the catalog database instead of encoding them.
+# Models whose thumbnail isn't in the catalog are added to failures.
+def read_catalog_rows(catalog, models, failures):
+    for model in models:
+        thumbnail = None
+        if 'thumbnail_hash' in model:
+            thumbnail = get_catalog_thumbnail(catalog, model['thumbnail_hash'])
+        if thumbnail is None:
+            failures.append({'image_path': model['image_path'], 'error': 'thumbnail not in the catalog'})
+            continue
+
+        row = dict(model)
+        row['image_format'], row['image_data'] = thumbnail
+        yield row
+
+# Method to get the rows for the table, either by encoding the thumbnails or by reading them from the catalog.
+# When a catalog is passed in without from_catalog, the encoded thumbnails are saved into it.
+def get_rows(models, jobs=None, cache=None, options=None, failures=None, catalog=None, from_catalog=False):
+    if from_catalog:
+        return read_catalog_rows(catalog, models, failures)
+
+    rows = encode_images(models, jobs, cache, options, failures)
+    if catalog is not None:
+        rows = save_catalog_thumbnails(catalog, rows)
+    return rows
 
 # Write the header of the html file
-def write_header(f):
+# nav is any html to show under the title, like the link back to the index page when the catalog is split up
+def write_header(f, nav=''):
 
     # Read in all the template files
     css = read_file('style.css')
@@ -68,11 +283,13 @@ def write_header(f):
 
     # Replace the CSS data in the html template
     header = header.replace('{{style}}', css)
+    header = header.replace('{{nav}}', nav)
 
     f.write(header)
 
 # Write the filters to the html file
-def write_filters(f, all_tags):
+# With the STL info columns, the size filters are written after the tags
+def write_filters(f, all_tags, columns=()):
     # Write the filters to the html file
     for tag in all_tags:
         if tag != '':
@@ -99,166 +316,744 @@ def write_filters(f, all_tags):
     
                     f'</div>')
 
+    if 'triangles' in columns:
+        write_stl_filters(f)
+
+# Write the filters on the triangle count and size of the models, from the STL info
+# A model fits the build volume if it does when turned on its side, so the order of the sizes doesn't matter.
+def write_stl_filters(f):
+    size_inputs = ' x '.join(f'<input type="number" id="{input_id}" min="0" oninput="scheduleFilterTable()">'
+                             for input_id in ['fitX', 'fitY', 'fitZ'])
+    f.write(f'<div class="stl-filters">'
+            f'<label>Max Triangles '
+            f'<input type="number" id="maxTriangles" min="0" oninput="scheduleFilterTable()">'
+            f'</label>'
+            f'<label>Fits In {size_inputs}</label>'
+            f'</div>')
+
+# Extra columns that can be added to the table between the tags and the image, as model key -> heading.
+# The model key holds the text shown in the column.
+TABLE_COLUMNS = {
+    'files': 'Files',
+    'triangles': 'Triangles',
+    'dimensions': 'Dimensions',
+    'zip_contents': 'Zip Contents',
+}
+
+# Method to read the table template, with headings for the extra columns
+def read_table_template(columns=()):
+    headings = ''.join(f'<th>{html.escape(TABLE_COLUMNS[column])}</th>' for column in columns)
+    return read_file('htmlTableTemplate.html').replace('{{columns}}', headings)
+
+# Method to start the search index that script.js uses to filter the table.
+# Each model gets its searchable columns pre-joined and uppercased, and its tags as a bitset
+# split into 32-bit words, one bit per tag in the same order as the filters.
+# With the STL info columns, each model's triangle count and size are added for the size filters.
+def new_model_index(all_tags, columns=()):
+    tags = [tag for tag in all_tags if tag != '']
+    model_index = {
+        'tags': tags,
+        'tagWords': max(1, (len(tags) + 31) // 32),
+        'text': [],
+        'tagBits': [],
+        'positions': {tag: position for position, tag in enumerate(tags)},
+    }
+    if 'triangles' in columns:
+        model_index['triangles'] = []
+        model_index['sizes'] = []
+    return model_index
+
+# Method to add a row to the search index, in the same order the rows are written to the table
+def add_to_model_index(model_index, model):
+    # Only the columns the search box has always looked at: character, model, series and category
+    text = '\n'.join([model['character_name'], model['model_name'], model['series_name'], model['category']])
+    model_index['text'].append(text.upper())
+
+    words = [0] * model_index['tagWords']
+    for tag in model['tags'].split(', '):
+        position = model_index['positions'].get(tag)
+        if position is not None:
+            words[position // 32] |= 1 << (position % 32)
+    model_index['tagBits'].extend(words)
+
+    # Models without any STL files have no size, and are never hidden by the size filters
+    if 'triangles' in model_index:
+        model_index['triangles'].append(model.get('triangle_count'))
+        size = None
+        if model.get('size_x') is not None:
+            size = [model['size_x'], model['size_y'], model['size_z']]
+        model_index['sizes'].append(size)
+
+# Write the search index to the html file as a JSON block for script.js to read
+def write_model_index(f, model_index):
+    data = {key: value for key, value in model_index.items() if key != 'positions'}
+    # Escape '</' so a model name can't close the script tag early
+    f.write('<script id="modelIndex" type="application/json">')
+    f.write(json.dumps(data, separators=(',', ':')).replace('</', '<\\/'))
+    f.write('</script>')
+
+# Method to save a thumbnail into the assets directory and return the url to it from the html file,
+# which is written to html_dir. Assets are named by the hash of their content, so a file that already
+# exists never needs rewriting.
+def write_thumbnail_asset(assets_dir, model, html_dir=os.curdir):
+    asset_name = model['thumbnail_hash'] + THUMBNAIL_FORMATS[model['image_format']]['extension']
+    asset_path = os.path.join(assets_dir, asset_name)
+
+    if not os.path.exists(asset_path):
+        temp_path = asset_path + '.tmp'
+        with open(temp_path, 'wb') as asset:
+            asset.write(model['image_data'])
+        os.replace(temp_path, asset_path)
+
+    return os.path.relpath(asset_path, html_dir).replace(os.sep, '/')
+
+# Method to remove thumbnails from the assets directory that aren't used by any model anymore
+def remove_unused_assets(assets_dir, models, image_format='JPEG'):
+    extension = THUMBNAIL_FORMATS[image_format]['extension']
+    used_assets = {model['thumbnail_hash'] + extension for model in models if 'thumbnail_hash' in model}
+    removed = 0
+
+    for asset_name in os.listdir(assets_dir):
+        if ASSET_FILE_NAME.match(asset_name) and asset_name not in used_assets:
+            os.remove(os.path.join(assets_dir, asset_name))
+            removed += 1
+
+    return removed
+
+# Method to get the src for a row's image, either the embedded thumbnail or the url to it in the assets directory
+def get_image_src(model, assets_dir=None, html_dir=os.curdir):
+    if assets_dir is None:
+        image_base64_data = base64.b64encode(model['image_data']).decode('utf-8')
+        mime_type = THUMBNAIL_FORMATS[model['image_format']]['mime_type']
+        return f'data:{mime_type};base64,{image_base64_data}'
+
+    return write_thumbnail_asset(assets_dir, model, html_dir)
+
+# Method to get the img tag for a row, either embedding the thumbnail or linking to it in the assets directory
+# Images for models tagged NSFW are blurred from the start, instead of script.js checking every row.
+def get_image_tag(model, assets_dir=None, html_dir=os.curdir):
+    image_class = ' class="blurred-image"' if 'NSFW' in model['tags'].upper() else ''
+    image_src = html.escape(get_image_src(model, assets_dir, html_dir))
+
+    if assets_dir is None:
+        return f'<img src="{image_src}"{image_class} />'
+    return f'<img src="{image_src}" loading="lazy"{image_class} />'
+
 # Write the table to the html file
-def write_table(f, models):
-    table = read_file('htmlTableTemplate.html')
+# Rows are written as they arrive, so models can be any iterable, and the number written is returned
+# If an assets directory is passed in, thumbnails are saved there instead of being embedded.
+# If a search index is passed in, every row written is added to it.
+# html_dir is the directory the html file is written to, so the links to the assets are relative to it.
+# columns are the keys in TABLE_COLUMNS to add to the table.
+def write_table(f, models, assets_dir=None, model_index=None, html_dir=os.curdir, columns=()):
+    table = read_table_template(columns)
     f.write(table)
 
+    total_rows = 0
+
     # Write the table rows to the html file
+    # Only the writing is timed, the time spent waiting on the thumbnails shows up under encode_wait
+    for model in models:
+        with phase('html_write'):
+            f.write(f'<tr>'
+                    f'<td>{model["character_name"]}</td>'
+                    f'<td>{model["model_name"]}</td>'
+                    f'<td>{model["series_name"]}</td>'
+                    f'<td>{model["category"]}</td>'
+                    f'<td>{model["tags"]}</td>'
+                    + ''.join(f'<td>{html.escape(model.get(column, ""))}</td>' for column in columns) +
+                    f'<td>{get_image_tag(model, assets_dir, html_dir)}</td>'
+                    f'</tr>')
+        if model_index is not None:
+            add_to_model_index(model_index, model)
+        total_rows += 1
+
+    return total_rows
+
+# Method to write the rows as a JSON array instead of table rows, so script.js can render only the rows on screen.
+# Rows are still written as they arrive, and the number written is returned.
+# The values of the extra columns go at the end of each row, after the image.
+def write_virtual_rows(f, models, model_index, assets_dir=None, row_height=220, html_dir=os.curdir, columns=()):
+    table = read_table_template(columns)
+    f.write(table)
+
+    model_index['rowHeight'] = row_height
+    total_rows = 0
+
+    # Script blocks are allowed inside a tbody, script.js replaces it with the rendered rows
+    f.write('<script id="modelRows" type="application/json">[')
     for model in models:
-        f.write(f'<tr>'
-                f'<td>{model["character_name"]}</td>'
-                f'<td>{model["model_name"]}</td>'
-                f'<td>{model["series_name"]}</td>'
-                f'<td>{model["category"]}</td>'
-                f'<td>{model["tags"]}</td>'
-                f'<td><img src="data:image/jpeg;base64,{model["image_base64_data"]}" /></td>'
-                f'</tr>')
-
-# Write the closing tags to the html file
-def write_close(f):
+        with phase('html_write'):
+            row = [
+                model['character_name'],
+                model['model_name'],
+                model['series_name'],
+                model['category'],
+                model['tags'],
+                get_image_src(model, assets_dir, html_dir),
+            ]
+            row.extend(model.get(column, '') for column in columns)
+            if total_rows > 0:
+                f.write(',')
+            f.write(json.dumps(row, separators=(',', ':')).replace('</', '<\\/'))
+        add_to_model_index(model_index, model)
+        total_rows += 1
+    f.write(']</script>')
+
+    return total_rows
+
+# Write the closing tags to the html file, along with the search index if there is one
+def write_close(f, model_index=None):
     script = read_file('script.js')
-    f.write('</tbody></table><script>')
+    f.write('</tbody></table>')
+    if model_index is not None:
+        write_model_index(f, model_index)
+    f.write('<script>')
     f.write(script)
     f.write('</script></body></html>')
 
+# Method to read rows from the encoded stream until the rows for the next shard start.
+# pending holds a row that was read ahead and belongs to a later shard.
+def take_shard_rows(rows, shard_file, pending):
+    while True:
+        if pending:
+            row = pending.pop()
+        else:
+            row = next(rows, None)
+            if row is None:
+                return
+
+        if row['shard_file'] != shard_file:
+            pending.append(row)
+            return
+        yield row
+
+# Write one shard of the catalog to its own page, with only the tags used on that page as filters.
+# The page is written to a temp file first, so a run that stops part way never leaves a broken page.
+def write_shard_page(output_dir, shard, rows, assets_dir=None, table_mode='full', row_height=220, columns=()):
+    shard_tags = []
+    for model in shard['models']:
+        collect_tags(model, shard_tags)
+
+    shard_path = os.path.join(output_dir, shard['file'])
+    temp_path = shard_path + '.tmp'
+    with open(temp_path, 'w') as f:
+        write_header(f, f'<p class="shard-nav"><a href="index.html">All pages</a> / {html.escape(shard["title"])}</p>')
+        write_filters(f, shard_tags, columns)
+
+        model_index = new_model_index(shard_tags, columns)
+        if table_mode == 'virtual':
+            total_rows = write_virtual_rows(f, rows, model_index, assets_dir, row_height, output_dir, columns)
+        else:
+            total_rows = write_table(f, rows, assets_dir, model_index, output_dir, columns)
+
+        write_close(f, model_index)
+    os.replace(temp_path, shard_path)
+
+    count('bytes_written', os.path.getsize(shard_path))
+    return total_rows
+
+# Write the index page, with a link to every shard and the search data to find a model on any of them.
+# The page is only replaced if it changed.
+def write_index_page(output_dir, shards, search_rows):
+    css = read_file('style.css')
+    index = read_file('htmlIndexTemplate.html')
+    script = read_file('index.js')
+
+    shard_links = ''.join(f'<li><a href="{html.escape(shard["file"])}">{html.escape(shard["title"])}</a> '
+                          f'({shard["count"]} models)</li>' for shard in shards)
+    search_data = {'shards': [{'file': shard['file'], 'title': shard['title']} for shard in shards],
+                   'rows': search_rows}
+
+    index = index.replace('{{style}}', css)
+    index = index.replace('{{shards}}', shard_links)
+    # Escape '</' so a model name can't close the script tag early
+    index = index.replace('{{search}}', json.dumps(search_data, separators=(',', ':')).replace('</', '<\\/'))
+    index = index.replace('{{script}}', script)
+
+    index_path = os.path.join(output_dir, 'index.html')
+    if os.path.isfile(index_path) and read_file(index_path) == index:
+        return
+
+    with open(index_path, 'w') as f:
+        f.write(index)
+    count('bytes_written', len(index))
+
+# Method to write the catalog as several pages, one per category or per page_size models, plus an index page.
+# Shards whose models, images and settings haven't changed since the last run are left alone, and only the
+# models on the shards that changed have their thumbnails encoded. Returns the number of models on all the pages.
+def write_sharded_output(output_dir, models, shard_by='category', page_size=500, jobs=None, cache=None,
+                         options=None, failures=None, assets_dir=None, table_mode='full', catalog=None,
+                         from_catalog=False, columns=()):
+    if options is None:
+        options = DEFAULT_THUMBNAIL_OPTIONS
+    if failures is None:
+        failures = []
+
+    os.makedirs(output_dir, exist_ok=True)
+    previous_state = load_shard_state(output_dir)
+    shards = plan_shards(models, shard_by, page_size)
+
+    # Everything other than the models that changes what's written to the pages
+    settings = {
+        'thumbnails': dict(options),
+        'assets': os.path.relpath(assets_dir, output_dir) if assets_dir is not None else None,
+        'table_mode': table_mode,
+        'columns': list(columns),
+        'templates': hash_template_files(),
+    }
+
+    changed_shards = []
+    for shard in shards:
+        shard['signature'] = shard_signature(shard, settings)
+
+        previous = previous_state.get(shard['file'])
+        unchanged = (previous is not None and previous['signature'] == shard['signature']
+                     and os.path.isfile(os.path.join(output_dir, shard['file'])))
+
+        # When saving into a catalog that doesn't have the page's thumbnails yet, the page is written again
+        # so they get encoded and saved, otherwise building from the catalog would be missing them
+        if unchanged and catalog is not None and not from_catalog:
+            unchanged = not find_missing_thumbnails(catalog, previous['thumbnails'].values())
+
+        if unchanged:
+            # Keep the thumbnail hashes from the run that wrote the page, so its assets aren't cleaned up
+            shard['count'] = previous['count']
+            shard['thumbnails'] = previous['thumbnails']
+            for model in shard['models']:
+                if model['model_dir'] in shard['thumbnails']:
+                    model['thumbnail_hash'] = shard['thumbnails'][model['model_dir']]
+            count('shards_unchanged')
+        else:
+            changed_shards.append(shard)
+
+    print(f'{len(changed_shards)} of {len(shards)} pages changed')
+
+    # Encode the thumbnails for every changed shard as one stream, so the pool stays busy between pages
+    rows = get_rows([model for shard in changed_shards for model in shard['models']],
+                    jobs, cache, options, failures, catalog, from_catalog)
+    pending = []
+    for shard in changed_shards:
+        shard_rows = take_shard_rows(rows, shard['file'], pending)
+        shard['count'] = write_shard_page(output_dir, shard, shard_rows, assets_dir, table_mode,
+                                          options['max_height'] + 20, columns)
+        shard['thumbnails'] = {model['model_dir']: model['thumbnail_hash']
+                               for model in shard['models'] if 'thumbnail_hash' in model}
+        count('shards_written')
+
+    # Pages with images that failed are written again next run, in case the images get fixed
+    failed_images = {failure['image_path'] for failure in failures}
+    for shard in changed_shards:
+        if any(model['image_path'] in failed_images for model in shard['models']):
+            shard['signature'] = None
+
+    # Search data for the index page, the same columns the search box on each page looks at
+    search_rows = []
+    for shard_number, shard in enumerate(shards):
+        for model in shard['models']:
+            if model['image_path'] not in failed_images:
+                search_rows.append([model['character_name'], model['model_name'], model['series_name'],
+                                    model['category'], shard_number])
+
+    write_index_page(output_dir, shards, search_rows)
+    save_shard_state(output_dir, shards, search_rows)
+
+    removed = remove_stale_shards(output_dir, shards, previous_state)
+    if removed:
+        print(f'Removed {removed} pages that no longer have any models')
+
+    return sum(shard['count'] for shard in shards)
+
+# Method to work out the model details from the names of the model directory and the folders above it
+# The tags are joined into one string, the way they're shown in the table
+def parse_model_directory(root, folder_name):
+    model = parse_model_path(root, folder_name)
+    model['tags'] = ", ".join(model['tags'])
+    return model
+
+# Method to add any new tags from a model to the all_tags list
+def collect_tags(model, all_tags):
+    for tag in model['tags'].split(', '):
+        if tag not in all_tags and tag != '':
+            all_tags.append(tag)
+
 # Method to generate the html file from the directory structure
-def gen_from_directory_structure(path):
-    total_models = 0
+# With a manifest, only models whose directory changed since the last run are parsed again.
+# With more than one worker, directories are listed on a pool of threads, which helps a lot on network shares.
+# With preview options, models without an image get a preview rendered from their STL files.
+def gen_from_directory_structure(path, manifest=None, workers=DEFAULT_DISCOVERY_WORKERS, preview_options=None):
     models = []
     all_tags = []
 
     # Get the last folder name in the path
     folder_name = os.path.basename(path)
 
-    for root, dirs, files in os.walk(path):
-        for file in files:
-            if is_valid_image_file(os.path.join(root, file)):
-                if contains_stl_folder(root):
-                    # Break the path up into tokens separated by '/'
-                    tokens = root.split('\\')
-
-                    category = ''
-
-                    # Start at the token that matches the folder name.
-                    # Could probably screw up here if the folder name is not unique to a subfolder.
-                    # But that doesn't sound like a "me" problem.
-                    for i in range(len(tokens)):
-                        if tokens[i] == folder_name:
-                            # Save the next token as the category.
-                            category = tokens[i + 1]
-                            break
-
-                    tags = []
-
-                    # Save the folder above the Model folder as 'Series Name'.
-                    series_name = tokens[-2]
-                    # Save the Name of the folder as 'Model Name'.
-                    model_name = tokens[-1]
-                    character_name = tokens[-1]
-
-                    # If the character name has a '-' in it, split it and take the first part.
-                    if ' - ' in character_name:
-                        model_tags = character_name.split(' - ')[1].strip()
-                        character_name = character_name.split(' - ')[0]
-                        character_name = character_name.strip()
-                        model_name = character_name
-
-                        # Get the model tags
-                        # Split the model_tags by spaces, and add them to the tags list.
-                        print("Splitting model tags")
-                        model_tags = model_tags.split(' ')
-                        for tag in model_tags:
-                            tags.append(tag)
-
-                    # If the character name has a number at the end, remove it and trim the whitespace.
-                    # Only do this if it's a single number (for now).
-                    if character_name[-1].isdigit():
-                        if character_name[-2] == ' ':
-                            character_name = character_name[:-1]
-
-                    # If the character name has an '_' in it, split it.
-                    # The first part becomes the character name, and the second part becomes the model name.
-                    if '_' in character_name:
-                        model_name = character_name.split('_')[1]
-                        character_name = character_name.split('_')[0]
-
-                        character_name = character_name.strip()
-                        model_name = character_name + ' - ' + model_name.strip()
+    # The scanner lists each directory once and only yields model directories with a valid image
+    for model_record in scan_models(path, manifest, workers, previews=preview_options is not None):
+        root = model_record['path']
 
-                    else:
-                        character_name = character_name.strip()
+        model = None
+        if manifest is not None:
+            model = cached_model(manifest, root)
 
-                    # Get the image base64 data
-                    image_base64_data = get_image_base64_data(os.path.join(root, file))
+        if model is None:
+            with phase('parse_directory_name'):
+                model = parse_model_directory(root, folder_name)
 
-                    for tag in tags:
-                        if tag not in all_tags:
-                            all_tags.append(tag)
+        # Save the model details, the image gets encoded once discovery is done
+        model['model_dir'] = root
+        model['image_path'] = model_record['image_path']
+        if manifest is not None:
+            record_model(manifest, root, model)
 
-                    # Write the output to the html file
-                    # Embed the image data in the html file as a base64 string
-                    model = {
-                        'character_name': character_name,
-                        'model_name': model_name,
-                        'series_name': series_name,
-                        'category': category,
-                        'tags': ", ".join(tags),
-                        'image_base64_data': image_base64_data
-                    }
-                    models.append(model)
+        models.append(model)
 
-                    total_models += 1
-                    break
+    models = add_previews(models, preview_options)
+    for model in models:
+        collect_tags(model, all_tags)
 
-    return total_models, models, all_tags
+    return len(models), models, all_tags
 
 # Method to generate the html file from the model-info.txt file
-def gen_from_model_info_file(file_path):
-    total_models = 0
+# With a manifest, only models whose directory or model-info.txt changed since the last run are parsed again.
+# With preview options, models without an image get a preview rendered from their STL files.
+def gen_from_model_info_file(file_path, manifest=None, workers=DEFAULT_DISCOVERY_WORKERS, preview_options=None):
     models = []
     all_tags = []
 
-    # Starting at the base directory, find all files named 'model-info.txt'
-    for root, dirs, files in os.walk(file_path):
-        for file in files:
-            if file == 'model-info.txt':
-                # Parse the model info from the file
-                model_info = parse_model_info(os.path.join(root, file))
+    # Starting at the base directory, find all directories with a 'model-info.txt' file
+    for listing in walk_library(file_path, manifest, workers):
+        if 'model-info.txt' not in listing['files']:
+            continue
+
+        # Check the directory for an image file
+        # Name could be anything, so check each file in the directory
+        image_path = find_image_file(listing, manifest)
+        if image_path is None and (preview_options is None or not has_preview_folder(listing)):
+            continue
+
+        root = listing['path']
+        model_info_file = os.path.join(root, 'model-info.txt')
+
+        model = None
+        if manifest is not None:
+            model = cached_model(manifest, root, model_info_file)
+
+        if model is None:
+            # Parse the model info from the file
+            with phase('parse_model_info'):
+                model_info = parse_model_info(model_info_file)
+
+            model = {
+                'character_name': model_info['Character Name'],
+                'model_name': model_info['Model Name'],
+                'series_name': model_info['Series'],
+                'category': model_info['Model Category'],
+                'tags': ", ".join(model_info['Tags']),
+            }
+
+        # Save the model details, the image gets encoded once discovery is done
+        model['model_dir'] = root
+        model['image_path'] = image_path
+        if manifest is not None:
+            record_model(manifest, root, model, model_info_file)
+
+        models.append(model)
+
+    models = add_previews(models, preview_options)
+    for model in models:
+        collect_tags(model, all_tags)
+
+    return len(models), models, all_tags
+
+# Method to find previews for the models without an image, dropping the models that can't get one
+def add_previews(models, preview_options=None):
+    if preview_options is None:
+        return models
+
+    # An image from inside a zip comes first, a real render looks better than one drawn from the STL
+    if preview_options['zip_previews']:
+        failures = []
+        with phase('zip_previews'):
+            add_zip_previews(models, preview_options['preview_dir'], preview_options['zip_cache'],
+                             preview_options['zip_workers'], failures)
+
+        if failures:
+            print(f"Zips that can't be read: {len(failures)}")
+            for failure in failures:
+                print(f"\t{failure['file_path']}: {failure['error']}")
+
+    if preview_options['stl_previews']:
+        failures = []
+        with phase('stl_previews'):
+            models = add_stl_previews(models, preview_options['preview_dir'], preview_options['size'],
+                                      preview_options['jobs'], failures)
+
+        if failures:
+            print(f"STL files that can't be rendered: {len(failures)}")
+            for failure in failures:
+                print(f"\t{failure['file_path']}: {failure['error']}")
+
+    return [model for model in models if model['image_path'] is not None]
+
+# Method to get the models from the catalog database saved by an earlier run, without walking the library
+def gen_from_catalog(catalog):
+    models = load_models(catalog)
+    all_tags = []
+    for model in models:
+        collect_tags(model, all_tags)
+
+    return len(models), models, all_tags
+
+
+# Method to build the catalog once, with everything set by the command line arguments.
+# Returns the manifest for the build, or None if nothing was built.
+def build_catalog(args, previous=None):
+    path = args.path
+
+    reset_stats()
+    profiler = start_profile(args.profile)
+    start_time = time.perf_counter()
+
+    # Open the thumbnail cache unless it's been turned off
+    cache = None
+    if not args.no_thumb_cache:
+        cache = open_thumbnail_cache(args.thumb_cache, args.thumb_cache_size * 1024 * 1024)
+
+    # Everything opened is closed again even if the build fails, so a failed rebuild while watching
+    # doesn't leave them open or lose what was written to them
+    catalog = None
+    zip_cache = None
+    try:
+        # Load the manifest from the last run, it's always saved so the next run can be incremental.
+        # When watching, the manifest from the build before is passed in instead.
+        manifest = previous
+        if manifest is None:
+            manifest = load_manifest(args.manifest, path, args.use_model_info,
+                                     incremental=args.incremental and not args.full_rebuild)
+
+        # Open the catalog database if the run is saved into it or read from it
+        if args.catalog_db or args.from_catalog:
+            catalog = open_catalog(args.catalog_db or DEFAULT_CATALOG_FILE)
+            if args.from_catalog and not check_library(catalog, path):
+                return None
+
+        # Extra columns in the table
+        columns = []
+        if args.fingerprints:
+            columns.append('files')
+        if args.stl_info:
+            columns.extend(['triangles', 'dimensions'])
+        if args.zip_contents:
+            columns.append('zip_contents')
+
+        thumbnail_options = {
+            'max_height': args.thumb_height,
+            'format': args.thumb_format.upper(),
+            'quality': args.thumb_quality,
+            'resample': args.resample,
+        }
+
+        # Zip listings are used for the zip contents column and for finding previews inside zips
+        if (args.zip_contents or args.zip_previews) and not args.from_catalog and not args.no_zip_cache:
+            zip_cache = open_zip_cache(args.zip_cache)
+
+        # Models without an image get a preview from their zips or their STL files, the catalog already has them
+        preview_options = None
+        if (args.stl_previews or args.zip_previews) and not args.from_catalog:
+            preview_options = {
+                'preview_dir': args.preview_dir,
+                'size': args.preview_size,
+                'jobs': args.jobs,
+                'stl_previews': args.stl_previews,
+                'zip_previews': args.zip_previews,
+                'zip_cache': zip_cache,
+                'zip_workers': args.zip_workers,
+            }
+
+        # Make sure the assets directory exists before any thumbnails are saved to it
+        assets_dir = None
+        if args.thumbnail_mode == 'assets':
+            assets_dir = args.assets_dir
+            if assets_dir is None:
+                assets_dir = ('output_assets' if args.output_mode == 'single'
+                              else os.path.join(args.output_dir, 'assets'))
+            os.makedirs(assets_dir, exist_ok=True)
+
+        # Check if the flag is triggered
+        with phase('discovery'):
+            if args.from_catalog:
+                print("Reading models from the catalog...")
+                total_models, models, all_tags = gen_from_catalog(catalog)
+            elif args.use_model_info:
+                print("Using model-info.txt...")
+                total_models, models, all_tags = gen_from_model_info_file(path, manifest, args.discovery_workers,
+                                                                          preview_options)
+            else:
+                print("Flag not triggered, no model-info.txt used.")
+                total_models, models, all_tags = gen_from_directory_structure(path, manifest, args.discovery_workers,
+                                                                              preview_options)
+
+        # Fingerprint the STL and zip files, the catalog already has them from the run that saved it
+        if args.fingerprints and not args.from_catalog:
+            print('Fingerprinting STL and zip files...')
+            fingerprint_cache = None
+            if not args.no_fingerprint_cache:
+                fingerprint_cache = open_fingerprint_cache(args.fingerprint_cache)
+            try:
+                broken_zips = fingerprint_models(models, fingerprint_cache, args.hash_workers)
+            finally:
+                if fingerprint_cache is not None:
+                    close_fingerprint_cache(fingerprint_cache, prune=True)
+
+            if broken_zips:
+                print(f"Zips that can't be opened: {len(broken_zips)}")
+                for file_path in broken_zips:
+                    print(f"\t{file_path}")
 
-                # Check the directory for an image file
-                # Name could be anything, so check each file in the directory
-                image_found = False
+        # Read the triangle counts and sizes from the STL files, the catalog already has them from the run that saved it
+        if args.stl_info and not args.from_catalog:
+            print(f'Reading STL files with {args.jobs} processes...')
+            stl_info_cache = None
+            if not args.no_stl_info_cache:
+                stl_info_cache = open_stl_info_cache(args.stl_info_cache)
+            try:
+                stl_failures = read_models_stl_info(models, stl_info_cache, args.jobs)
+            finally:
+                if stl_info_cache is not None:
+                    close_stl_info_cache(stl_info_cache, prune=True)
 
-                for image_file in os.listdir(root):
-                    if image_found:
-                        continue
-                    if not is_valid_image_file(os.path.join(root, image_file)):
-                        continue
+            if stl_failures:
+                print(f"STL files that can't be read: {len(stl_failures)}")
+                for failure in stl_failures:
+                    print(f"\t{failure['file_path']}: {failure['error']}")
 
-                    image_found = True
-                    image_base64_data = get_image_base64_data(os.path.join(root, image_file))
+        # List the STL and image files inside the zips, the catalog already has them from the run that saved it.
+        # Models that needed a preview had their zips listed during discovery.
+        if args.zip_contents and not args.from_catalog:
+            print('Reading zip listings...')
+            zip_failures = inspect_zips([model for model in models if 'zip_members' not in model], zip_cache,
+                                        args.zip_workers)
+            if zip_failures:
+                print(f"Zips that can't be read: {len(zip_failures)}")
+                for failure in zip_failures:
+                    print(f"\t{failure['file_path']}: {failure['error']}")
 
-                    # Add the tags to the all_tags list
-                    for tag in model_info['Tags']:
-                        if tag not in all_tags and tag != '':
-                            all_tags.append(tag)
+        # Every model's zips were listed only with the zip contents column, so only then can the cache be pruned
+        if zip_cache is not None:
+            close_zip_cache(zip_cache, prune=args.zip_contents)
+            zip_cache = None
 
-                    # Write the output to the html file
-                    # Embed the image data in the html file as a base64 string
-                    model = {
-                        'character_name': model_info['Character Name'],
-                        'model_name': model_info['Model Name'],
-                        'series_name': model_info['Series'],
-                        'category': model_info['Model Category'],
-                        'tags': ", ".join(model_info['Tags']),
-                        'image_base64_data': image_base64_data
-                    }
-                    models.append(model)
-                    total_models += 1
+        # The discovery pre-pass only holds the model details and tags,
+        # thumbnails are encoded and written to the table one row at a time
+        print('Models Found:', total_models)
+        print('All Tags Found:', all_tags)
 
+        failures = []
+        if args.output_mode == 'single':
+            print(f'Writing to html file, encoding thumbnails with {args.jobs} processes...')
 
-    return total_models, models, all_tags
+            # Create an html file to write the output to
+            # Embed the CSS data in the html file
+            with open('output.html', 'w') as f:
+
+                # Write the header of the html file
+                write_header(f)
+
+                # Write the filters to the html file
+                write_filters(f, all_tags, columns)
+
+                # Write the table to the html file
+                model_index = new_model_index(all_tags, columns)
+                rows = get_rows(models, args.jobs, cache, thumbnail_options, failures, catalog, args.from_catalog)
+                if args.table_mode == 'virtual':
+                    total_models = write_virtual_rows(f, rows, model_index, assets_dir, args.thumb_height + 20,
+                                                      columns=columns)
+                else:
+                    total_models = write_table(f, rows, assets_dir, model_index, columns=columns)
+
+                # Write the closing tags to the html file
+                write_close(f, model_index)
+
+            count('bytes_written', os.path.getsize('output.html'))
+        else:
+            print(f'Writing pages to {args.output_dir}, encoding thumbnails with {args.jobs} processes...')
+            total_models = write_sharded_output(args.output_dir, models, args.output_mode, args.page_size, args.jobs,
+                                                cache, thumbnail_options, failures, assets_dir, args.table_mode,
+                                                catalog, args.from_catalog, columns)
+
+        for model in models:
+            if 'thumbnail_hash' in model:
+                record_thumbnail_hash(manifest, model['model_dir'], model['thumbnail_hash'])
+
+        # Clean up thumbnails from models that changed or were removed
+        if assets_dir is not None:
+            removed = remove_unused_assets(assets_dir, models, thumbnail_options['format'])
+            print(f'Removed {removed} unused thumbnails from {assets_dir}')
+
+        # Clean up previews of STL files that changed or were removed
+        if preview_options is not None:
+            removed = remove_unused_previews(preview_options['preview_dir'], models)
+            print(f"Removed {removed} unused previews from {preview_options['preview_dir']}")
+
+        # Report any images that couldn't be encoded
+        if failures:
+            print(f'Failed to encode {len(failures)} images:')
+            for failure in failures:
+                print(f"\t{failure['image_path']}: {failure['error']}")
+
+        # The manifest only has this run's models in it when the library was walked
+        if not args.from_catalog:
+            save_manifest(manifest, args.manifest)
+
+        # Save the library into the catalog, so the other scripts can use it without walking the library
+        if catalog is not None:
+            if not args.from_catalog:
+                store_library_listings(catalog, path, manifest['directories'])
+                store_models(catalog, models)
+                print(f'Catalog saved to {args.catalog_db}')
+    finally:
+        if zip_cache is not None:
+            close_zip_cache(zip_cache)
+        if cache is not None:
+            close_thumbnail_cache(cache)
+        if catalog is not None:
+            close_catalog(catalog)
+
+    add_time('total', time.perf_counter() - start_time)
+    stop_profile(profiler, args.profile)
+
+    if args.stats_json:
+        write_stats_json(args.stats_json, {'models': total_models, 'tags': len(all_tags), 'failures': len(failures)})
+        print(f'Stats written to {args.stats_json}')
+
+    print('Done!')
+    print(f'Total Models: {total_models}')
+
+    return manifest
+
+# Method to rebuild the catalog every time the library changes, until it's stopped with Ctrl+C.
+# The manifest stays in memory between builds, so each rebuild only re-processes the directories that changed.
+def watch_library(args, manifest):
+    watcher = open_watcher(get_directory_mtimes(manifest), args.watch_interval, use_inotify=not args.watch_poll)
+    print(f"Watching {args.path} for changes using {watcher['mode']}, press Ctrl+C to stop...")
+
+    try:
+        while True:
+            changed = wait_for_changes(watcher, args.watch_debounce)
+            print(f'{len(changed)} directories changed, rebuilding...')
+
+            # A failed rebuild shouldn't stop the watch, the next change gets another try
+            try:
+                manifest = build_catalog(args, next_manifest(manifest))
+            except Exception as e:
+                print(f'Rebuild failed: {e}')
+                continue
+            update_watches(watcher, get_directory_mtimes(manifest))
+    except KeyboardInterrupt:
+        print('Stopped watching')
+    finally:
+        close_watcher(watcher)
 
 
 # Main function
@@ -271,6 +1066,118 @@ def main():
         parser.add_argument('path', type=str, help="Path to the root models directory")
         parser.add_argument('--use-model-info', action='store_true', help="Use model-info.txt file")
 
+        # Thumbnail cache options
+        parser.add_argument('--thumb-cache', type=str, default=DEFAULT_CACHE_FILE,
+                            help="Path to the thumbnail cache file")
+        parser.add_argument('--no-thumb-cache', action='store_true', help="Encode every thumbnail without the cache")
+        parser.add_argument('--thumb-cache-size', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                            help="Maximum size of the thumbnail cache in MB")
+
+        # Number of processes used to encode the thumbnails
+        parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                            help="Number of processes used to encode thumbnails (defaults to the CPU count)")
+
+        # Number of threads used to list directories
+        parser.add_argument('--discovery-workers', type=int, default=DEFAULT_DISCOVERY_WORKERS,
+                            help="Number of threads listing directories at once, more helps on network shares")
+
+        # Incremental build options
+        parser.add_argument('--incremental', action='store_true',
+                            help="Only re-process directories that changed since the last run")
+        parser.add_argument('--full-rebuild', action='store_true',
+                            help="Ignore the manifest from the last run and re-process everything")
+        parser.add_argument('--manifest', type=str, default=DEFAULT_MANIFEST_FILE,
+                            help="Path to the scan manifest file")
+
+        # How the thumbnails are encoded
+        parser.add_argument('--thumb-height', type=int, default=DEFAULT_THUMBNAIL_OPTIONS['max_height'],
+                            help="Maximum height of the thumbnails in pixels")
+        parser.add_argument('--thumb-format', choices=['jpeg', 'webp'], default='jpeg',
+                            help="Image format of the thumbnails")
+        parser.add_argument('--thumb-quality', type=int, default=DEFAULT_THUMBNAIL_OPTIONS['quality'],
+                            help="Quality of the thumbnails, from 1 to 100")
+        parser.add_argument('--resample', choices=list(RESAMPLE_FILTERS), default=DEFAULT_THUMBNAIL_OPTIONS['resample'],
+                            help="Filter used to shrink the images")
+
+        # Where the thumbnails go
+        parser.add_argument('--thumbnail-mode', choices=['inline', 'assets'], default='inline',
+                            help="Embed thumbnails in the html file, or save them as separate files")
+        parser.add_argument('--assets-dir', type=str,
+                            help="Directory to save thumbnails to when using --thumbnail-mode assets "
+                                 "(defaults to output_assets, or assets in the output directory)")
+
+        # Whether the catalog is one page or split into several
+        parser.add_argument('--output-mode', choices=['single', 'category', 'pages'], default='single',
+                            help="Write one output.html, or split the catalog into a page per category "
+                                 "or per --page-size models")
+        parser.add_argument('--page-size', type=int, default=500,
+                            help="Number of models on each page when using --output-mode pages")
+        parser.add_argument('--output-dir', type=str, default='output',
+                            help="Directory to write the pages to when the catalog is split up")
+
+        # How the table is built in the page
+        parser.add_argument('--table-mode', choices=['full', 'virtual'], default='full',
+                            help="Write every row to the page, or only render the rows on screen")
+
+        # Catalog database options
+        parser.add_argument('--catalog-db', type=str,
+                            help="Save the directories, models and thumbnails found to this catalog database")
+        parser.add_argument('--from-catalog', action='store_true',
+                            help=f"Build the html from the catalog database instead of walking the library "
+                                 f"(uses {DEFAULT_CATALOG_FILE} if --catalog-db isn't set)")
+
+        # Watch mode options
+        parser.add_argument('--watch', action='store_true',
+                            help="Keep running and rebuild the catalog whenever the library changes")
+        parser.add_argument('--watch-interval', type=float, default=DEFAULT_POLL_INTERVAL,
+                            help="Seconds between checks for changes when polling")
+        parser.add_argument('--watch-poll', action='store_true',
+                            help="Poll for changes even if inotify is available, for network drives")
+        parser.add_argument('--watch-debounce', type=float, default=DEFAULT_DEBOUNCE,
+                            help="Seconds the library has to be quiet before rebuilding")
+
+        # STL and zip fingerprint options
+        parser.add_argument('--fingerprints', action='store_true',
+                            help="Hash the STL and zip files of each model and add a Files column to the table")
+        parser.add_argument('--fingerprint-cache', type=str, default=DEFAULT_FINGERPRINT_CACHE,
+                            help="Path to the fingerprint cache file")
+        parser.add_argument('--no-fingerprint-cache', action='store_true',
+                            help="Hash every file without the fingerprint cache")
+        parser.add_argument('--hash-workers', type=int, default=DEFAULT_HASH_WORKERS,
+                            help="Number of threads hashing STL and zip files at once")
+
+        # STL info options
+        parser.add_argument('--stl-info', action='store_true',
+                            help="Read the STL files of each model and add Triangles and Dimensions columns "
+                                 "and size filters to the table")
+        parser.add_argument('--stl-info-cache', type=str, default=DEFAULT_STL_INFO_CACHE,
+                            help="Path to the STL info cache file")
+        parser.add_argument('--no-stl-info-cache', action='store_true',
+                            help="Read every STL file without the STL info cache")
+
+        # Zip contents options
+        parser.add_argument('--zip-contents', action='store_true',
+                            help="List the STL and image files inside each model's zips and add a Zip Contents column")
+        parser.add_argument('--zip-previews', action='store_true',
+                            help="Use an image from inside the zips of models that don't have an image")
+        parser.add_argument('--zip-cache', type=str, default=DEFAULT_ZIP_CACHE,
+                            help="Path to the zip listing cache file")
+        parser.add_argument('--no-zip-cache', action='store_true', help="Open every zip without the zip listing cache")
+        parser.add_argument('--zip-workers', type=int, default=DEFAULT_ZIP_WORKERS,
+                            help="Number of threads reading zip listings at once")
+
+        # STL preview options
+        parser.add_argument('--stl-previews', action='store_true',
+                            help="Render a preview from the biggest STL file of models that don't have an image")
+        parser.add_argument('--preview-dir', type=str, default=DEFAULT_PREVIEW_DIR,
+                            help="Folder to save the rendered previews in, they're reused until the STL changes")
+        parser.add_argument('--preview-size', type=int, default=DEFAULT_PREVIEW_SIZE,
+                            help="Width and height of the rendered previews in pixels")
+
+        # Instrumentation options
+        parser.add_argument('--profile', type=str, help="Save a cProfile dump of the run to this file")
+        parser.add_argument('--stats-json', type=str, help="Save the phase timings and counters to this JSON file")
+
         # Parse the arguments
         args = parser.parse_args()
 
@@ -280,37 +1187,14 @@ def main():
             print('Invalid path')
             return
 
-        # Create an html file to write the output to
-        # Embed the CSS data in the html file
-        with open('output.html', 'w') as f:
+        manifest = build_catalog(args)
 
-            # Check if the flag is triggered
-            if args.use_model_info:
-                print("Using model-info.txt...")
-                total_models, models, all_tags = gen_from_model_info_file(path)
+        # Keep the catalog up to date as models are added
+        if args.watch and manifest is not None:
+            if args.from_catalog:
+                print('--watch needs to walk the library, it can\'t be used with --from-catalog')
             else:
-                print("Flag not triggered, no model-info.txt used.")
-                total_models, models, all_tags = gen_from_directory_structure(path)
-
-            print('Total Models:', total_models)
-            print('All Tags Found:', all_tags)
-
-            print('Writing to html file...')
-
-            # Write the header of the html file
-            write_header(f)
-
-            # Write the filters to the html file
-            write_filters(f, all_tags)
-
-            # Write the table to the html file
-            write_table(f, models)
-
-            # Write the closing tags to the html file
-            write_close(f)
-
-            print('Done!')
-            print(f'Total Models: {total_models}')
+                watch_library(args, manifest)
     except Exception as e:
         print(e)
 
@@ -0,0 +1,167 @@
+# Scan manifest used for incremental catalog builds.
+# After each run the manifest records every directory listing (with its mtime) and every model found,
+# so the next run only has to re-stat directories and re-process the models that changed.
+import json
+import os
+
+from instrumentation import count
+
+# Default location of the manifest file
+DEFAULT_MANIFEST_FILE = 'catalog-manifest.json'
+MANIFEST_VERSION = 1
+
+
+def load_manifest(manifest_file, base_dir, use_model_info, incremental=True):
+    """Load the manifest from the last run and return a fresh manifest to record this run into.
+
+    The previous run is ignored if it doesn't exist, can't be read, was made for a different
+    directory or mode, or incremental builds are turned off.
+    """
+    previous = {'directories': {}, 'models': {}}
+
+    if incremental and os.path.isfile(manifest_file):
+        try:
+            with open(manifest_file, 'r') as f:
+                data = json.load(f)
+            if (data.get('version') == MANIFEST_VERSION
+                    and data.get('base_dir') == os.path.abspath(base_dir)
+                    and data.get('use_model_info') == use_model_info):
+                previous = data
+            else:
+                print('Manifest is from a different library or mode, doing a full rebuild.')
+        except (OSError, ValueError) as e:
+            print(f"Unable to read manifest {manifest_file}: {e}")
+
+    return {
+        'base_dir': os.path.abspath(base_dir),
+        'use_model_info': use_model_info,
+        'previous': previous,
+        'directories': {},
+        'models': {},
+    }
+
+
+def save_manifest(manifest, manifest_file):
+    """Write the manifest for this run, replacing the old file in one step."""
+    data = {
+        'version': MANIFEST_VERSION,
+        'base_dir': manifest['base_dir'],
+        'use_model_info': manifest['use_model_info'],
+        'directories': manifest['directories'],
+        'models': manifest['models'],
+    }
+
+    temp_file = manifest_file + '.tmp'
+    with open(temp_file, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp_file, manifest_file)
+
+
+def get_mtime_ns(path):
+    """Return the modified time of a path in nanoseconds, or None if it can't be read."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def cached_listing(manifest, path):
+    """Return the listing from the last run if the directory hasn't changed since, otherwise None."""
+    previous = manifest['previous']['directories'].get(path)
+    if previous is None:
+        return None
+
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if stat.st_mtime_ns != previous['mtime_ns']:
+        return None
+
+    count('directories_from_manifest')
+    return {
+        'path': path,
+        'files': previous['files'],
+        'dirs': previous['dirs'],
+        'extensions': {os.path.splitext(file_name)[1].lower() for file_name in previous['files']},
+        'mtime_ns': stat.st_mtime_ns,
+        'identity': (stat.st_dev, stat.st_ino),
+    }
+
+
+def record_listing(manifest, listing):
+    """Save a directory listing into the manifest for this run."""
+    if listing['mtime_ns'] is None:
+        return
+
+    manifest['directories'][listing['path']] = {
+        'mtime_ns': listing['mtime_ns'],
+        'files': listing['files'],
+        'dirs': listing['dirs'],
+    }
+
+
+def cached_image_path(manifest, listing):
+    """Return the model image found last run if it's still in the directory and unchanged, otherwise None."""
+    previous = manifest['previous']['models'].get(listing['path'])
+    if previous is None:
+        return None
+
+    image_path = previous['image_path']
+    if os.path.basename(image_path) not in listing['files']:
+        return None
+    if get_mtime_ns(image_path) != previous['image_mtime_ns']:
+        return None
+
+    return image_path
+
+
+def record_image_path(manifest, model_dir, image_path):
+    """Save the image found for a model directory into the manifest for this run."""
+    entry = manifest['models'].setdefault(model_dir, {})
+    entry['image_path'] = image_path
+    entry['image_mtime_ns'] = get_mtime_ns(image_path)
+
+
+def cached_model(manifest, model_dir, model_info_file=None):
+    """Return the parsed model details from the last run, or None if they need to be parsed again.
+
+    When a model-info.txt file is passed in, the details are only reused if it hasn't changed.
+    """
+    previous = manifest['previous']['models'].get(model_dir)
+    if previous is None or 'model' not in previous:
+        return None
+
+    if model_info_file is not None and get_mtime_ns(model_info_file) != previous.get('model_info_mtime_ns'):
+        return None
+
+    return dict(previous['model'])
+
+
+def record_model(manifest, model_dir, model, model_info_file=None):
+    """Save the parsed model details for a model directory into the manifest for this run."""
+    entry = manifest['models'].setdefault(model_dir, {})
+    entry['model'] = {key: value for key, value in model.items() if key != 'image_data'}
+    if model_info_file is not None:
+        entry['model_info_mtime_ns'] = get_mtime_ns(model_info_file)
+
+
+def record_thumbnail_hash(manifest, model_dir, thumbnail_hash):
+    """Save the hash of the encoded thumbnail for a model directory into the manifest for this run."""
+    manifest['models'].setdefault(model_dir, {})['thumbnail_hash'] = thumbnail_hash
+
+
+def get_directory_mtimes(manifest):
+    """Return {path: modified time} for every directory listed this run, as they were when they were listed."""
+    return {path: directory['mtime_ns'] for path, directory in manifest['directories'].items()}
+
+
+def next_manifest(manifest):
+    """Return a fresh manifest that uses this run as the previous run, for rebuilding without reading the file."""
+    return {
+        'base_dir': manifest['base_dir'],
+        'use_model_info': manifest['use_model_info'],
+        'previous': {'directories': manifest['directories'], 'models': manifest['models']},
+        'directories': {},
+        'models': {},
+    }
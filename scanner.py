@@ -0,0 +1,162 @@
+# Single pass scanner for the model library.
+# Every directory is listed once with os.scandir and classified from that one listing,
+# instead of re-walking the subtree below each image like contains_stl_folder does.
+import os
+
+from directory_index import (DEFAULT_DISCOVERY_WORKERS, close_listing_pool, get_subfolder_paths, list_directory,
+                             open_listing_pool, prefetch_listings, take_listing)
+from instrumentation import count
+from manifest import cached_image_path, cached_listing, record_image_path, record_listing
+from search_functions import IMAGE_EXTENSIONS, VALID_FILE_EXTENSIONS, is_valid_image_file
+
+# Folders that mark their parent as a model directory (case insensitive)
+MODEL_SUBFOLDER_NAMES = {'stl', 'zips', 'renders'}
+
+# Folders a preview can be made from when a model directory has no image
+PREVIEW_SUBFOLDER_NAMES = {'stl', 'zips'}
+
+# Directory kinds returned by classify_directory
+MODEL = 'model'
+NO_IMAGE = 'no_image'
+CONTAINER = 'container'
+STRAY = 'stray'
+OTHER = 'other'
+
+
+def has_preview_folder(listing):
+    """Check if a listed directory has an STL or Zips subfolder (case insensitive) a preview can be made from."""
+    return any(subfolder.lower() in PREVIEW_SUBFOLDER_NAMES for subfolder in listing['dirs'])
+
+
+def classify_directory(listing):
+    """Classify a listed directory as a model directory, an STL/Zips/Renders container, a stray folder or other.
+
+    Directories laid out like a model but without an image are NO_IMAGE, they can get a preview
+    rendered from an STL or taken from a zip.
+    """
+    if os.path.basename(listing['path']).lower() in MODEL_SUBFOLDER_NAMES:
+        return CONTAINER
+
+    has_images = not listing['extensions'].isdisjoint(IMAGE_EXTENSIONS)
+    if any(subfolder.lower() in MODEL_SUBFOLDER_NAMES for subfolder in listing['dirs']):
+        if has_images:
+            return MODEL
+        if has_preview_folder(listing):
+            return NO_IMAGE
+
+    if has_images or not listing['extensions'].isdisjoint(VALID_FILE_EXTENSIONS):
+        return STRAY
+
+    return OTHER
+
+
+def find_image_file(listing, manifest=None):
+    """Return the path of the first valid image in a listed directory, or None.
+
+    With a manifest, the image found last run is reused if it hasn't changed.
+    """
+    image_path = None
+    if manifest is not None:
+        image_path = cached_image_path(manifest, listing)
+
+    if image_path is None:
+        for file_name in listing['files']:
+            if is_valid_image_file(os.path.join(listing['path'], file_name)):
+                image_path = os.path.join(listing['path'], file_name)
+                break
+
+    if manifest is not None and image_path is not None:
+        record_image_path(manifest, listing['path'], image_path)
+
+    return image_path
+
+
+def walk_library(base_dir, manifest=None, workers=DEFAULT_DISCOVERY_WORKERS):
+    """Walk the library top-down, yielding each directory listing with its 'kind' filled in.
+
+    STL, Zips and Renders containers are yielded but never listed, since the model
+    directory above them is classified from its own listing.
+    With a manifest, directories that haven't changed since the last run are only re-stat'ed.
+    Symlinks are followed, but a link that points back at one of its own parent folders is skipped
+    so symlink loops can't send the walk around forever.
+    With more than one worker, directories are listed ahead of the walk on a thread pool,
+    and still yielded in the same order as a serial walk.
+    """
+    # Checking the manifest costs a stat, so it's done on the pool as well
+    def get_directory_listing(path):
+        listing = None
+        if manifest is not None:
+            listing = cached_listing(manifest, path)
+        if listing is None:
+            listing = list_directory(path)
+        return listing
+
+    def is_container(path):
+        return os.path.basename(path).lower() in MODEL_SUBFOLDER_NAMES and path != base_dir
+
+    def get_children(listing):
+        return [child_path for child_path in get_subfolder_paths(listing) if not is_container(child_path)]
+
+    stack = [(base_dir, ())]
+    pending = {}
+    pool = open_listing_pool(workers)
+
+    try:
+        while stack:
+            path, ancestors = stack.pop()
+
+            if is_container(path):
+                yield {'path': path, 'files': [], 'dirs': [], 'extensions': set(), 'mtime_ns': None,
+                       'identity': None, 'kind': CONTAINER}
+                continue
+
+            listing = take_listing(pending, path, get_directory_listing)
+
+            # The (device, inode) pair identifies the real folder behind any symlinks
+            identity = listing['identity']
+            if identity is not None and identity in ancestors:
+                print(f"Skipping symlink loop: {path}")
+                count('symlink_loops_skipped')
+                continue
+            ancestors = ancestors + (identity,)
+
+            if manifest is not None:
+                record_listing(manifest, listing)
+
+            listing['kind'] = classify_directory(listing)
+
+            # Push in reverse so the subfolders come off the stack in sorted order
+            for subfolder in reversed(listing['dirs']):
+                stack.append((os.path.join(path, subfolder), ancestors))
+
+            # Start listing the folders the walk reaches next, before handing this one back
+            next_paths = (next_path for next_path, _ in reversed(stack) if not is_container(next_path))
+            prefetch_listings(pool, pending, next_paths, get_directory_listing, get_children)
+
+            yield listing
+    finally:
+        close_listing_pool(pool)
+
+
+def scan_models(base_dir, manifest=None, workers=DEFAULT_DISCOVERY_WORKERS, previews=False):
+    """Yield a record for every model directory in the library that has a readable image.
+
+    With previews set, model directories with an STL or Zips folder but no readable image are yielded as well,
+    with an image_path of None.
+    """
+    for listing in walk_library(base_dir, manifest, workers):
+        if listing['kind'] == MODEL:
+            image_path = find_image_file(listing, manifest)
+        elif listing['kind'] == NO_IMAGE:
+            image_path = None
+        else:
+            continue
+
+        if image_path is None and not (previews and has_preview_folder(listing)):
+            continue
+
+        yield {
+            'path': listing['path'],
+            'image_path': image_path,
+            'has_model_info': 'model-info.txt' in listing['files'],
+        }
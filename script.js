@@ -1,80 +1,355 @@
-function filterTable() {
-    let globalInput = document.getElementById("globalFilter").value.toUpperCase();
+// Search index written by main.py (see write_model_index), loaded once when the page opens.
+// text[i] holds the searchable columns of row i, already uppercased,
+// and tagBits holds each row's tags as tagWords 32-bit words, one bit per tag in the filter order.
+let modelIndex = null;
 
-    let excludes = [];
-    let onlys = [];
+// Trigram -> list of rows whose text contains it, so searches only check rows that can match
+let trigramIndex = null;
 
-    // Get all the radio buttons
-    const filters = document.querySelectorAll('input[type=radio]');
-    for (let i = 0; i < filters.length; i++) {
-        if (filters[i].checked) {
-            if (filters[i].value === 'exclude') {
-                excludes.push(filters[i].name);
-            } else if (filters[i].value === 'only') {
-                onlys.push(filters[i].name);
+// Whether each row is currently shown, so only rows that change get their style touched
+let rowVisible = [];
+
+// Timer used to wait for the user to stop typing before filtering
+let filterTimer = null;
+
+// In virtual mode (main.py --table-mode virtual) modelIndex.rows holds the row data from the modelRows block, and only the rows
+// on screen are rendered. visibleRows is the list of rows that pass the filters, in table order.
+let visibleRows = [];
+let renderedRange = null;
+let renderPending = false;
+
+// Number of extra rows rendered above and below the screen so scrolling doesn't show gaps
+const VIRTUAL_OVERSCAN = 10;
+
+// When the page comes from serve.py there's no index in the page. The server does the searching
+// and the table shows one page of results at a time, serverRequest makes sure only the latest search is shown.
+let serverPage = 0;
+let serverRequest = 0;
+
+function isServer() {
+    return document.getElementById("modelIndex") === null;
+}
+
+function loadModelIndex() {
+    const indexElement = document.getElementById("modelIndex");
+    modelIndex = JSON.parse(indexElement.textContent);
+
+    // In virtual mode the row data is written as its own block inside the table
+    const rowsElement = document.getElementById("modelRows");
+    if (rowsElement) {
+        modelIndex.rows = JSON.parse(rowsElement.textContent);
+    }
+
+    trigramIndex = new Map();
+    for (let i = 0; i < modelIndex.text.length; i++) {
+        const text = modelIndex.text[i];
+        const seen = new Set();
+
+        for (let j = 0; j + 3 <= text.length; j++) {
+            const trigram = text.substring(j, j + 3);
+            if (seen.has(trigram)) {
+                continue;
+            }
+            seen.add(trigram);
+
+            let rows = trigramIndex.get(trigram);
+            if (!rows) {
+                rows = [];
+                trigramIndex.set(trigram, rows);
             }
+            rows.push(i);
         }
     }
 
-    let table = document.getElementById("figuresTable");
-    let tbody = table.getElementsByTagName("tbody")[0];
-    let tr = tbody.getElementsByTagName("tr");
+    rowVisible = new Array(modelIndex.text.length).fill(true);
+}
 
-    for (let i = 0; i < tr.length; i++) {
-        const tds = tr[i].getElementsByTagName("td");
-        let textMatch = false;
+function isVirtual() {
+    return modelIndex !== null && Array.isArray(modelIndex.rows);
+}
 
-        // Check if the text input matches any of the columns except isMini and isSafe
-        for (let j = 0; j < tds.length - 2; j++) {
-            if (tds[j]) {
-                const txtValue = tds[j].textContent || tds[j].innerText;
-                if (txtValue.toUpperCase().indexOf(globalInput) > -1) {
-                    textMatch = true;
-                    break;
-                }
-            }
+function escapeHtml(text) {
+    return text.replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;").replace(/"/g, "&quot;");
+}
+
+// Build the html for one row from the index, the same way main.py writes it in full mode
+function getRowHtml(i) {
+    return buildRowHtml(modelIndex.rows[i], i, "");
+}
+
+// Build the html for a row of [character, model, series, category, tags, image src, extra columns...].
+// The extra columns are shown before the image, the same as main.py writes them.
+// Rows are striped by their place in the whole table, like the css does in full mode.
+function buildRowHtml(row, i, imageAttributes) {
+    const imageClass = row[4].toUpperCase().includes("NSFW") ? ' class="blurred-image"' : '';
+    const background = i % 2 === 1 ? '#D0E4F5' : 'none';
+    const extraColumns = row.slice(6).map(value => `<td>${escapeHtml(String(value))}</td>`).join("");
+
+    return `<tr style="background: ${background};">` +
+        `<td>${escapeHtml(row[0])}</td>` +
+        `<td>${escapeHtml(row[1])}</td>` +
+        `<td>${escapeHtml(row[2])}</td>` +
+        `<td>${escapeHtml(row[3])}</td>` +
+        `<td>${escapeHtml(row[4])}</td>` +
+        extraColumns +
+        `<td><img src="${escapeHtml(row[5])}"${imageAttributes}${imageClass} /></td>` +
+        `</tr>`;
+}
+
+// Render the visible rows that are on screen, with spacer rows standing in for the rest
+function renderVirtualRows(force) {
+    renderPending = false;
+
+    const tbody = document.getElementById("figuresTable").tBodies[0];
+    const rowHeight = modelIndex.rowHeight;
+    const bodyTop = tbody.getBoundingClientRect().top + window.scrollY;
+
+    let first = Math.floor((window.scrollY - bodyTop) / rowHeight) - VIRTUAL_OVERSCAN;
+    let last = Math.ceil((window.scrollY + window.innerHeight - bodyTop) / rowHeight) + VIRTUAL_OVERSCAN;
+    first = Math.max(0, Math.min(first, visibleRows.length));
+    last = Math.max(first, Math.min(last, visibleRows.length));
+
+    if (!force && renderedRange !== null && renderedRange[0] === first && renderedRange[1] === last) {
+        return;
+    }
+    renderedRange = [first, last];
+
+    let rowsHtml = `<tr style="height: ${first * rowHeight}px; background: none;"></tr>`;
+    for (let k = first; k < last; k++) {
+        rowsHtml += getRowHtml(visibleRows[k]);
+    }
+    rowsHtml += `<tr style="height: ${(visibleRows.length - last) * rowHeight}px; background: none;"></tr>`;
+    tbody.innerHTML = rowsHtml;
+
+    // Rows with long names can wrap, so learn the real row height from what was just rendered.
+    // Row 0 is the top spacer, so the rendered rows are 1 to last - first.
+    if (last - first > 1) {
+        const renderedHeight = tbody.rows[last - first].getBoundingClientRect().top -
+            tbody.rows[1].getBoundingClientRect().top;
+        const measuredHeight = renderedHeight / (last - first - 1);
+        if (Math.abs(measuredHeight - rowHeight) > 1) {
+            modelIndex.rowHeight = measuredHeight;
         }
+    }
+}
 
-        // Check if the tags column (index 4) matches the filters
-        // Look for it not being in the excludes array
-        // Or not in the onlys array
-        let matchesFilters = false;
+// Re-render at most once per frame while scrolling
+function scheduleRenderVirtualRows() {
+    if (!renderPending) {
+        renderPending = true;
+        window.requestAnimationFrame(() => renderVirtualRows(false));
+    }
+}
 
-        // Get the tags column
-        const txtValue = tds[4].textContent || tds[4].innerText;
+// Find the rows whose text contains the search, or null if every row matches
+function findTextMatches(search) {
+    if (search === "") {
+        return null;
+    }
 
-        // Split the tags into an array
-        const tags = txtValue.split(', ');
+    const matches = new Uint8Array(modelIndex.text.length);
+    let candidates = null;
 
-        // Check if the tags match the filters
-        for (let j = 0; j < tags.length; j++) {
-            if (!excludes.includes(tags[j])) {
-                if (onlys.length === 0 || (onlys.includes(tags[j]))) {
-                    matchesFilters = true;
-                    break;
-                }
-            }else{
-                break;
+    // Only check the rows that have the rarest trigram of the search
+    if (search.length >= 3) {
+        for (let j = 0; j + 3 <= search.length; j++) {
+            const rows = trigramIndex.get(search.substring(j, j + 3));
+            if (!rows) {
+                return matches;
+            }
+            if (candidates === null || rows.length < candidates.length) {
+                candidates = rows;
+            }
+        }
+    }
+
+    if (candidates === null) {
+        for (let i = 0; i < modelIndex.text.length; i++) {
+            if (modelIndex.text[i].indexOf(search) > -1) {
+                matches[i] = 1;
+            }
+        }
+    } else {
+        for (let k = 0; k < candidates.length; k++) {
+            const i = candidates[k];
+            if (modelIndex.text[i].indexOf(search) > -1) {
+                matches[i] = 1;
             }
         }
+    }
+
+    return matches;
+}
+
+// Build bitmasks of the tags set to exclude and only, in the same layout as tagBits
+function getTagMasks() {
+    const excludeMask = new Array(modelIndex.tagWords).fill(0);
+    const onlyMask = new Array(modelIndex.tagWords).fill(0);
+    let hasOnly = false;
 
-        // Apply blur effect if column 4 contains NSFW
-        let imgCell = tds[5].getElementsByTagName("img")[0];
-        if (tds[4].textContent.toUpperCase().includes("NSFW")) {
-            imgCell.classList.add("blurred-image");
-        } else {
-            imgCell.classList.remove("blurred-image");
+    // Get all the checked radio buttons
+    const filters = document.querySelectorAll('input[type=radio]:checked');
+    for (let i = 0; i < filters.length; i++) {
+        const position = modelIndex.tags.indexOf(filters[i].name);
+        if (position < 0) {
+            continue;
         }
 
+        const word = Math.floor(position / 32);
+        const bit = (1 << (position % 32)) >>> 0;
+        if (filters[i].value === 'exclude') {
+            excludeMask[word] = (excludeMask[word] | bit) >>> 0;
+        } else if (filters[i].value === 'only') {
+            onlyMask[word] = (onlyMask[word] | bit) >>> 0;
+            hasOnly = true;
+        }
+    }
+
+    return {excludeMask, onlyMask, hasOnly};
+}
+
+// A row matches if it has none of the excluded tags, and at least one of the only tags if any are set
+function matchesTags(i, masks) {
+    const words = modelIndex.tagWords;
+    let hasOnlyTag = !masks.hasOnly;
+
+    for (let w = 0; w < words; w++) {
+        const bits = modelIndex.tagBits[i * words + w];
+        if ((bits & masks.excludeMask[w]) !== 0) {
+            return false;
+        }
+        if ((bits & masks.onlyMask[w]) !== 0) {
+            hasOnlyTag = true;
+        }
+    }
+
+    return hasOnlyTag;
+}
+
+// Read the size filters, or null if there are none on the page or none are set.
+// The build volume sizes are sorted, so a model can be turned any way to fit.
+function getSizeFilter() {
+    if (!Array.isArray(modelIndex.triangles)) {
+        return null;
+    }
+
+    const maxTriangles = parseFloat(document.getElementById("maxTriangles").value);
+    const fit = ["fitX", "fitY", "fitZ"].map(id => parseFloat(document.getElementById(id).value));
+    if (isNaN(maxTriangles) && fit.every(isNaN)) {
+        return null;
+    }
+
+    return {
+        maxTriangles: isNaN(maxTriangles) ? Infinity : maxTriangles,
+        fit: fit.map(size => isNaN(size) ? Infinity : size).sort((a, b) => b - a),
+    };
+}
+
+// A row matches if it has no more triangles than the max and fits in the build volume.
+// Rows without any STL info always match.
+function matchesSize(i, sizeFilter) {
+    if (sizeFilter === null || modelIndex.triangles[i] === null) {
+        return true;
+    }
+    if (modelIndex.triangles[i] > sizeFilter.maxTriangles) {
+        return false;
+    }
+
+    const size = modelIndex.sizes[i];
+    if (size === null) {
+        return true;
+    }
+    const sorted = size.slice().sort((a, b) => b - a);
+    return sorted.every((value, axis) => value <= sizeFilter.fit[axis]);
+}
+
+// Build the query for the server from the search box and the tag filters
+function getServerParameters() {
+    const parameters = new URLSearchParams();
+    parameters.set("q", document.getElementById("globalFilter").value);
+    parameters.set("page", serverPage);
+
+    const filters = document.querySelectorAll('input[type=radio]:checked');
+    for (let i = 0; i < filters.length; i++) {
+        if (filters[i].value === 'exclude' || filters[i].value === 'only') {
+            parameters.append(filters[i].value, filters[i].name);
+        }
+    }
+    return parameters;
+}
+
+// Ask the server for the current page of results and show them in the table
+async function filterServerTable() {
+    const request = ++serverRequest;
+    const response = await fetch(`/api/search?${getServerParameters()}`);
+    const results = await response.json();
+    if (request !== serverRequest) {
+        return;
+    }
+
+    let rowsHtml = "";
+    for (let k = 0; k < results.rows.length; k++) {
+        rowsHtml += buildRowHtml(results.rows[k], results.page * results.pageSize + k, ' loading="lazy"');
+    }
+    document.getElementById("figuresTable").tBodies[0].innerHTML = rowsHtml;
+
+    const first = results.total === 0 ? 0 : results.page * results.pageSize + 1;
+    const last = results.page * results.pageSize + results.rows.length;
+    document.getElementById("serverPageInfo").textContent = `Showing ${first} to ${last} of ${results.total} models`;
+    document.getElementById("serverPrevious").disabled = results.page === 0;
+    document.getElementById("serverNext").disabled = last >= results.total;
+}
+
+function changeServerPage(step) {
+    serverPage = Math.max(0, serverPage + step);
+    filterServerTable();
+    window.scrollTo(0, 0);
+}
+
+function filterTable() {
+    clearTimeout(filterTimer);
+
+    if (isServer()) {
+        serverPage = 0;
+        filterServerTable();
+        return;
+    }
+
+    const search = document.getElementById("globalFilter").value.toUpperCase();
+    const textMatches = findTextMatches(search);
+    const masks = getTagMasks();
+    const sizeFilter = getSizeFilter();
+
+    if (isVirtual()) {
+        visibleRows = [];
+        for (let i = 0; i < modelIndex.text.length; i++) {
+            if ((textMatches === null || textMatches[i] === 1) && matchesTags(i, masks) && matchesSize(i, sizeFilter)) {
+                visibleRows.push(i);
+            }
+        }
+        renderVirtualRows(true);
+        return;
+    }
+
+    const rows = document.getElementById("figuresTable").tBodies[0].rows;
+    for (let i = 0; i < modelIndex.text.length; i++) {
+        const visible = (textMatches === null || textMatches[i] === 1) && matchesTags(i, masks) &&
+            matchesSize(i, sizeFilter);
+
         // Show the row if all conditions are met
-        if (textMatch && matchesFilters) {
-            tr[i].style.display = "";
-        } else {
-            tr[i].style.display = "none";
+        if (rowVisible[i] !== visible) {
+            rows[i].style.display = visible ? "" : "none";
+            rowVisible[i] = visible;
         }
     }
 }
 
+// Filter once the user has stopped typing for a moment, instead of on every key
+function scheduleFilterTable() {
+    clearTimeout(filterTimer);
+    filterTimer = setTimeout(filterTable, 150);
+}
+
 function toggleFilterVisible() {
     filterDiv = document.getElementById("filters");
     if (filterDiv.style.display === "none") {
@@ -84,35 +359,63 @@ function toggleFilterVisible() {
     }
 }
 
+// Set the count in each label with a type=count and value property
+function setFilterCounts(getCount) {
+    const labels = document.querySelectorAll('label[type=count]');
+    for (let i = 0; i < labels.length; i++) {
+        const value = labels[i].getAttribute('value');
+        const count = getCount(value);
+        if (count !== null) {
+            labels[i].textContent = `Total ${value} Models: ${count}`;
+        }
+    }
+}
+
 function getModelsPerFilter(){
-    // Find each label with a type=count and value property
-    const labels = document.querySelectorAll('label');
+    if (isServer()) {
+        fetch("/api/tags").then(response => response.json()).then(counts => {
+            setFilterCounts(value => value in counts ? counts[value] : null);
+        });
+        return;
+    }
 
-    for (let i = 0; i < labels.length; i++) {
-        // See if the label has a type=count and value property
-        if (labels[i].getAttribute('type') === 'count' && labels[i].getAttribute('value')) {
-            // Get the value of the label
-            const value = labels[i].getAttribute('value');
-
-            // Count the rows that have the value in the tags column
-            let table = document.getElementById("figuresTable");
-            let tbody = table.getElementsByTagName("tbody")[0];
-            let tr = tbody.getElementsByTagName("tr");
-
-            let count = 0;
-            for (let j = 0; j < tr.length; j++) {
-                const tds = tr[j].getElementsByTagName("td");
-                const txtValue = tds[4].textContent || tds[4].innerText;
-                if (txtValue.includes(value)) {
-                    count++;
+    // Count the models for every tag in one pass over the bitsets
+    const counts = new Array(modelIndex.tags.length).fill(0);
+    const words = modelIndex.tagWords;
+
+    for (let i = 0; i < modelIndex.text.length; i++) {
+        for (let w = 0; w < words; w++) {
+            let bits = modelIndex.tagBits[i * words + w];
+            let position = w * 32;
+            while (bits !== 0) {
+                if (bits & 1) {
+                    counts[position]++;
                 }
+                bits >>>= 1;
+                position++;
             }
-
-            // Set the count in the label
-            labels[i].textContent = `Total ${value} Models: ${count}`;
         }
     }
+
+    setFilterCounts(value => {
+        const position = modelIndex.tags.indexOf(value);
+        return position >= 0 ? counts[position] : null;
+    });
 }
 
+if (!isServer()) {
+    loadModelIndex();
+}
 getModelsPerFilter();
+
+// Pages linked from the index page's search have the search in the url
+const searchParameter = new URLSearchParams(window.location.search).get("q");
+if (searchParameter) {
+    document.getElementById("globalFilter").value = searchParameter;
+}
 filterTable();
+
+if (isVirtual()) {
+    window.addEventListener("scroll", scheduleRenderVirtualRows);
+    window.addEventListener("resize", scheduleRenderVirtualRows);
+}
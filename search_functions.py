@@ -1,7 +1,9 @@
 # List of common image file extensions
 import os
 
-from PIL import Image
+from directory_index import DEFAULT_DISCOVERY_WORKERS, build_directory_index, get_listing
+from image_header import read_image_header
+from instrumentation import phase
 
 # Valid image extensions
 IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.svg', '.webp', '.avif'}
@@ -9,44 +11,46 @@ IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.svg', '.
 VALID_FILE_EXTENSIONS = {'.stl', '.zip'}
 
 
-def directory_contains_image_file(folder_path):
+def directory_contains_image_file(folder_path, index=None):
     """Check if there is any image file in the folder."""
-    for file_name in os.listdir(folder_path):
-        if any(file_name.lower().endswith(ext) for ext in IMAGE_EXTENSIONS):
-            return True
-    return False
+    listing = get_listing(folder_path, index)
+    return not listing['extensions'].isdisjoint(IMAGE_EXTENSIONS)
 
 def is_valid_image_file(file):
-    try:
-        # Skip the file if it does not have an image extension
-        if not any(file.lower().endswith(ext) for ext in IMAGE_EXTENSIONS):
-            return False
-        Image.open(file)
-        return True
-    except:
+    """Check if the file is an image Pillow can open, from its extension and the magic bytes in its header."""
+    # Skip the file if it does not have an image extension
+    if not any(file.lower().endswith(ext) for ext in IMAGE_EXTENSIONS):
         return False
+    return read_image_header(file) is not None
 
 
-def contains_valid_file(folder_path):
+def contains_valid_file(folder_path, index=None):
     """Check if the folder contains a file with '.stl' or '.zip' extension (case insensitive)."""
-    for file_name in os.listdir(folder_path):
-        if any(file_name.lower().endswith(ext) for ext in VALID_FILE_EXTENSIONS):
-            return True
-    return False
+    listing = get_listing(folder_path, index)
+    return not listing['extensions'].isdisjoint(VALID_FILE_EXTENSIONS)
 
 
-def contains_valid_subfolder(folder_path):
+def contains_valid_subfolder(folder_path, index=None):
     """Check if the folder contains a subfolder named 'STL' or 'Zips' (case insensitive)."""
     valid_subfolder_names = {'stl', 'zips'}
-    for subfolder in os.listdir(folder_path):
-        if os.path.isdir(os.path.join(folder_path, subfolder)) and subfolder.lower() in valid_subfolder_names:
-            return True
-    return False
+    listing = get_listing(folder_path, index)
+    return any(subfolder.lower() in valid_subfolder_names for subfolder in listing['dirs'])
+
+
+def contains_stl_subfolder(folder_path, index=None):
+    """Check if the folder contains a subfolder named 'STL' (case insensitive)."""
+    listing = get_listing(folder_path, index)
+    return any(subfolder.lower() == 'stl' for subfolder in listing['dirs'])
 
 
-def is_valid_folder(folder_path):
-    """Check if the folder meets the criteria for being valid."""
-    return directory_contains_image_file(folder_path) and contains_valid_subfolder(folder_path)
+def is_valid_folder(folder_path, index=None, stl_previews=False):
+    """Check if the folder meets the criteria for being valid.
+
+    With stl_previews set, a folder with an STL subfolder is valid without an image, since one gets rendered for it.
+    """
+    if stl_previews and contains_stl_subfolder(folder_path, index):
+        return True
+    return directory_contains_image_file(folder_path, index) and contains_valid_subfolder(folder_path, index)
 
 
 def contains_stl_folder(folder):
@@ -63,41 +67,48 @@ def contains_stl_folder(folder):
                 return True
 
 
-def find_directories(base_dir):
-    """Find folders that do not match valid criteria, considering parent folder validity."""
-    invalid_folders = set()
-    valid_folders = set()
+def find_directories(base_dir, index=None, workers=DEFAULT_DISCOVERY_WORKERS, stl_previews=False):
+    """Find folders that do not match valid criteria, considering parent folder validity.
+
+    If no index is passed in, the library is listed with workers threads.
+    With stl_previews set, model folders without an image count as valid, like main.py --stl-previews treats them.
+    """
+    with phase('find_directories'):
+        invalid_folders = set()
+        valid_folders = set()
 
-    # First pass to identify valid folders
-    for root, dirs, files in os.walk(base_dir, followlinks=True):
-        if is_valid_folder(root):
-            valid_folders.add(root)
+        # List every folder once, following symlinks like the old os.walk did
+        if index is None:
+            index = build_directory_index(base_dir, follow_links=True, workers=workers)
 
-    # Second pass to identify invalid folders
-    for root, dirs, files in os.walk(base_dir, followlinks=True):
-        # Skip if it's a known valid folder
-        if root in valid_folders:
-            continue
+        # First pass to identify valid folders
+        for root in index:
+            if is_valid_folder(root, index, stl_previews):
+                valid_folders.add(root)
 
-        # Skip if the folder is named "zips" (case-insensitive)
-        if os.path.basename(root).lower() == 'zips':
-            continue
+        # Second pass to identify invalid folders
+        # The index is in top-down order, so a folder's parent is always checked before the folder itself
+        under_valid_folder = set()
+        for root, listing in index.items():
+            # Track folders that have a valid parent somewhere above them
+            parent = listing['parent']
+            if parent is not None and (parent in valid_folders or parent in under_valid_folder):
+                under_valid_folder.add(root)
 
-        # Check if any parent of the current folder is valid
-        current_folder = root
-        valid_parent_found = False
+            # Skip if it's a known valid folder
+            if root in valid_folders:
+                continue
 
-        while current_folder != base_dir:
-            current_folder = os.path.dirname(current_folder)
-            if current_folder in valid_folders:
-                valid_parent_found = True
-                break
+            # Skip if the folder is named "zips" (case-insensitive)
+            if os.path.basename(root).lower() == 'zips':
+                continue
 
-        if valid_parent_found:
-            continue
+            # Skip if any parent of the current folder is valid
+            if root in under_valid_folder:
+                continue
 
-        # If no valid parent found, check for images, STL, or ZIP files
-        if directory_contains_image_file(root) or contains_valid_file(root):
-            invalid_folders.add(root)
+            # If no valid parent found, check for images, STL, or ZIP files
+            if directory_contains_image_file(root, index) or contains_valid_file(root, index):
+                invalid_folders.add(root)
 
-    return invalid_folders, valid_folders
\ No newline at end of file
+        return invalid_folders, valid_folders
@@ -0,0 +1,248 @@
+# Serve the catalog from a local web server instead of writing output.html.
+# The page is built from the same templates, but the server keeps the model index in memory and answers
+# searches one page of results at a time, and thumbnails are only encoded when the browser asks for them,
+# so the server is ready as soon as the library has been scanned no matter how many images it has.
+import argparse
+import json
+import os
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from urllib.parse import parse_qs, urlparse
+
+from catalog_db import check_library, close_catalog, open_catalog
+from main import (DEFAULT_THUMBNAIL_OPTIONS, THUMBNAIL_FORMATS, encode_thumbnail, gen_from_catalog,
+                  gen_from_directory_structure, gen_from_model_info_file, read_table_template, write_close,
+                  write_filters, write_header)
+from manifest import DEFAULT_MANIFEST_FILE, load_manifest, save_manifest
+
+# Rows in each page of search results
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Memory used to keep recently served thumbnails, in MB
+DEFAULT_THUMBNAIL_MEMORY = 64
+
+
+def new_search_index(models):
+    """Build the in-memory index the searches run against: the searchable text of each model and tag -> models."""
+    search_index = {'models': models, 'text': [], 'tags': {}}
+
+    for model_id, model in enumerate(models):
+        # Only the columns the search box has always looked at: character, model, series and category
+        text = '\n'.join([model['character_name'], model['model_name'], model['series_name'], model['category']])
+        search_index['text'].append(text.upper())
+
+        for tag in model['tags'].split(', '):
+            if tag != '':
+                search_index['tags'].setdefault(tag, set()).add(model_id)
+
+    return search_index
+
+
+def search_models(search_index, search='', only=(), exclude=()):
+    """Return the ids of the models that match the search and tag filters, in table order.
+
+    A model matches if its text contains the search, it has none of the excluded tags,
+    and it has at least one of the only tags if any are set.
+    """
+    model_ids = set(range(len(search_index['models'])))
+    if only:
+        model_ids = set().union(*(search_index['tags'].get(tag, set()) for tag in only))
+    for tag in exclude:
+        model_ids -= search_index['tags'].get(tag, set())
+
+    search = search.upper()
+    return [model_id for model_id in sorted(model_ids) if search in search_index['text'][model_id]]
+
+
+def new_thumbnail_cache(max_bytes):
+    """Create the in-memory LRU cache for encoded thumbnails, shared by all the request threads."""
+    return {'entries': OrderedDict(), 'bytes': 0, 'max_bytes': max_bytes, 'lock': threading.Lock()}
+
+
+def get_thumbnail(cache, model, options):
+    """Return the thumbnail bytes for a model, encoding them if they aren't cached or the image changed."""
+    image_path = model['image_path']
+    stat = os.stat(image_path)
+    key = (image_path, stat.st_size, stat.st_mtime_ns)
+
+    with cache['lock']:
+        data = cache['entries'].get(key)
+        if data is not None:
+            cache['entries'].move_to_end(key)
+            return data
+
+    # Encode outside the lock, so one slow image doesn't hold up the others
+    data = encode_thumbnail(image_path, options)
+
+    with cache['lock']:
+        if key not in cache['entries']:
+            cache['entries'][key] = data
+            cache['bytes'] += len(data)
+
+        # Drop the least recently used thumbnails until the cache fits
+        while cache['bytes'] > cache['max_bytes'] and len(cache['entries']) > 1:
+            _, evicted = cache['entries'].popitem(last=False)
+            cache['bytes'] -= len(evicted)
+
+    return data
+
+
+def build_page(all_tags):
+    """Build the catalog page from the templates, with an empty table that script.js fills from the server."""
+    pager = ('<p class="shard-nav">'
+             '<button id="serverPrevious" onclick="changeServerPage(-1)">Previous</button> '
+             '<span id="serverPageInfo"></span> '
+             '<button id="serverNext" onclick="changeServerPage(1)">Next</button>'
+             '</p>')
+
+    f = StringIO()
+    write_header(f, pager)
+    write_filters(f, all_tags)
+    f.write(read_table_template())
+    write_close(f)
+    return f.getvalue().encode('utf-8')
+
+
+def get_rows(search_index, model_ids):
+    """Return the table rows for the models, with links to their thumbnails."""
+    rows = []
+    for model_id in model_ids:
+        model = search_index['models'][model_id]
+        rows.append([model['character_name'], model['model_name'], model['series_name'], model['category'],
+                     model['tags'], f'/thumbnail/{model_id}'])
+    return rows
+
+
+class CatalogRequestHandler(BaseHTTPRequestHandler):
+    # Set by main before the server starts
+    page = b''
+    search_index = None
+    thumbnail_cache = None
+    thumbnail_options = DEFAULT_THUMBNAIL_OPTIONS
+    page_size = DEFAULT_PAGE_SIZE
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+
+        if url.path in ('/', '/index.html'):
+            self.send_data(self.page, 'text/html; charset=utf-8')
+        elif url.path == '/api/search':
+            self.send_search(query)
+        elif url.path == '/api/tags':
+            counts = {tag: len(model_ids) for tag, model_ids in self.search_index['tags'].items()}
+            self.send_json(counts)
+        elif url.path.startswith('/thumbnail/'):
+            self.send_thumbnail(url.path[len('/thumbnail/'):])
+        else:
+            self.send_error(404)
+
+    def send_search(self, query):
+        try:
+            page = max(0, int(query.get('page', ['0'])[0]))
+            page_size = min(MAX_PAGE_SIZE, max(1, int(query.get('page_size', [self.page_size])[0])))
+        except ValueError:
+            self.send_error(400, 'page and page_size must be numbers')
+            return
+
+        model_ids = search_models(self.search_index, query.get('q', [''])[0], query.get('only', []),
+                                  query.get('exclude', []))
+        page_ids = model_ids[page * page_size:(page + 1) * page_size]
+
+        self.send_json({
+            'total': len(model_ids),
+            'page': page,
+            'pageSize': page_size,
+            'rows': get_rows(self.search_index, page_ids),
+        })
+
+    def send_thumbnail(self, model_id):
+        if not model_id.isdigit() or int(model_id) >= len(self.search_index['models']):
+            self.send_error(404)
+            return
+
+        model = self.search_index['models'][int(model_id)]
+        try:
+            data = get_thumbnail(self.thumbnail_cache, model, self.thumbnail_options)
+        except Exception as e:
+            self.send_error(500, f"Unable to encode {model['image_path']}: {e}")
+            return
+
+        self.send_data(data, THUMBNAIL_FORMATS[self.thumbnail_options['format']]['mime_type'])
+
+    def send_json(self, data):
+        self.send_data(json.dumps(data, separators=(',', ':')).encode('utf-8'), 'application/json')
+
+    def send_data(self, data, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Only log errors, every thumbnail request would drown out everything else
+        pass
+
+    def log_error(self, format, *args):
+        print(format % args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the model catalog from a local web server")
+    parser.add_argument('path', type=str, help="Path to the root models directory")
+    parser.add_argument('--use-model-info', action='store_true', help="Use model-info.txt file")
+    parser.add_argument('--host', type=str, default='127.0.0.1', help="Address to listen on")
+    parser.add_argument('--port', type=int, default=8000, help="Port to listen on")
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE, help="Number of models on each page")
+    parser.add_argument('--thumb-height', type=int, default=DEFAULT_THUMBNAIL_OPTIONS['max_height'],
+                        help="Maximum height of the thumbnails in pixels")
+    parser.add_argument('--thumb-memory', type=int, default=DEFAULT_THUMBNAIL_MEMORY,
+                        help="Memory used to keep recently served thumbnails, in MB")
+    parser.add_argument('--manifest', type=str, default=DEFAULT_MANIFEST_FILE,
+                        help="Path to the scan manifest file, used to skip directories that haven't changed")
+    parser.add_argument('--catalog-db', type=str, help="Read the models from this catalog database instead")
+    args = parser.parse_args()
+
+    path = args.path
+    if not os.path.isdir(path):
+        print('Invalid path')
+        return
+
+    # Find the models, using the catalog or the manifest so only changed directories are listed again
+    if args.catalog_db:
+        catalog = open_catalog(args.catalog_db)
+        if not check_library(catalog, path):
+            close_catalog(catalog)
+            return
+        total_models, models, all_tags = gen_from_catalog(catalog)
+        close_catalog(catalog)
+    else:
+        manifest = load_manifest(args.manifest, path, args.use_model_info)
+        if args.use_model_info:
+            total_models, models, all_tags = gen_from_model_info_file(path, manifest)
+        else:
+            total_models, models, all_tags = gen_from_directory_structure(path, manifest)
+        save_manifest(manifest, args.manifest)
+
+    CatalogRequestHandler.page = build_page(all_tags)
+    CatalogRequestHandler.search_index = new_search_index(models)
+    CatalogRequestHandler.thumbnail_cache = new_thumbnail_cache(args.thumb_memory * 1024 * 1024)
+    CatalogRequestHandler.thumbnail_options = dict(DEFAULT_THUMBNAIL_OPTIONS, max_height=args.thumb_height)
+    CatalogRequestHandler.page_size = args.page_size
+
+    server = ThreadingHTTPServer((args.host, args.port), CatalogRequestHandler)
+    print(f'Serving {total_models} models at http://{args.host}:{args.port}/, press Ctrl+C to stop...')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('Stopped serving')
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
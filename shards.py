@@ -0,0 +1,142 @@
+# Split the catalog into several smaller pages, by category or by a fixed number of models per page.
+# Each shard gets a signature built from its models, their images and the output settings, which is saved
+# in shards.json next to the pages, so the next run only rewrites the shards whose signature changed.
+import hashlib
+import json
+import os
+import re
+
+# File in the output directory that holds the shard signatures and the cross-shard search data
+SHARD_STATE_FILE = 'shards.json'
+SHARD_STATE_VERSION = 1
+
+# Template files that end up in every page, a change to any of them rewrites every shard
+PAGE_TEMPLATE_FILES = ['style.css', 'htmlHeaderTemplate.html', 'htmlTableTemplate.html', 'script.js']
+
+
+def shard_file_name(title, used_names):
+    """Turn a category into a file name that is safe to use in a url and isn't already taken."""
+    slug = re.sub(r'[^a-z0-9]+', '-', title.lower()).strip('-') or 'uncategorized'
+    file_name = f'{slug}.html'
+
+    number = 2
+    while file_name in used_names:
+        file_name = f'{slug}-{number}.html'
+        number += 1
+
+    used_names.add(file_name)
+    return file_name
+
+
+def plan_shards(models, shard_by='category', page_size=500):
+    """Group the models into shards and return them in the order they're listed on the index page.
+
+    Each shard is {'file', 'title', 'models'}. Category shards are sorted by name and keep the
+    models in the order they were found, page shards split the models in the order they were found.
+    """
+    shards = []
+
+    if shard_by == 'category':
+        models_by_category = {}
+        for model in models:
+            models_by_category.setdefault(model['category'], []).append(model)
+
+        used_names = set()
+        for category in sorted(models_by_category, key=str.lower):
+            shards.append({
+                'file': shard_file_name(category, used_names),
+                'title': category or 'Uncategorized',
+                'models': models_by_category[category],
+            })
+    else:
+        page_size = max(1, page_size)
+        for start in range(0, len(models), page_size):
+            page_number = start // page_size + 1
+            shards.append({
+                'file': f'page-{page_number:04d}.html',
+                'title': f'Page {page_number}',
+                'models': models[start:start + page_size],
+            })
+
+    for shard in shards:
+        for model in shard['models']:
+            model['shard_file'] = shard['file']
+
+    return shards
+
+
+def hash_template_files(file_names=PAGE_TEMPLATE_FILES):
+    """Return a hash of the template files, so pages are rewritten when the page itself changes."""
+    template_hash = hashlib.sha1()
+    for file_name in file_names:
+        with open(file_name, 'rb') as f:
+            template_hash.update(f.read())
+    return template_hash.hexdigest()
+
+
+def shard_signature(shard, settings):
+    """Return a hash of everything that ends up in a shard's page.
+
+    That's the details of each model, the size and modified time of its image, and the output settings,
+    so a shard only needs rewriting when one of its models, images or the settings changed.
+    """
+    entries = []
+    for model in shard['models']:
+        try:
+            stat = os.stat(model['image_path'])
+            image_version = [stat.st_size, stat.st_mtime_ns]
+        except OSError:
+            image_version = None
+
+        entries.append([model['character_name'], model['model_name'], model['series_name'], model['category'],
+                        model['tags'], model['image_path'], image_version,
+                        [model.get(column, '') for column in settings.get('columns', [])]])
+
+    data = json.dumps([shard['file'], shard['title'], settings, entries], separators=(',', ':'))
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def load_shard_state(output_dir):
+    """Load the shard signatures saved by the last run, keyed by shard file."""
+    state_file = os.path.join(output_dir, SHARD_STATE_FILE)
+    if not os.path.isfile(state_file):
+        return {}
+
+    try:
+        with open(state_file, 'r') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Unable to read shard state {state_file}: {e}")
+        return {}
+
+    if data.get('version') != SHARD_STATE_VERSION:
+        return {}
+    return {shard['file']: shard for shard in data.get('shards', [])}
+
+
+def save_shard_state(output_dir, shards, search_rows):
+    """Save the shard signatures and the cross-shard search data, replacing the old file in one step."""
+    data = {
+        'version': SHARD_STATE_VERSION,
+        'shards': [{key: value for key, value in shard.items() if key != 'models'} for shard in shards],
+        'search': search_rows,
+    }
+
+    state_file = os.path.join(output_dir, SHARD_STATE_FILE)
+    temp_file = state_file + '.tmp'
+    with open(temp_file, 'w') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(temp_file, state_file)
+
+
+def remove_stale_shards(output_dir, shards, previous_state):
+    """Delete the pages from the last run that aren't part of this run, and return how many were removed."""
+    current_files = {shard['file'] for shard in shards}
+    removed = 0
+
+    for file_name in previous_state:
+        if file_name not in current_files and os.path.isfile(os.path.join(output_dir, file_name)):
+            os.remove(os.path.join(output_dir, file_name))
+            removed += 1
+
+    return removed
@@ -0,0 +1,363 @@
+# Read the triangle count and bounding box of the STL files in each model directory, for print planning.
+# Binary STLs are memory mapped and their vertices read with NumPy a block at a time, ASCII STLs are streamed
+# line by line, so no STL is ever read into memory whole. Files are read on a process pool, and the results
+# are cached by path, size and modified time so re-runs only read the files that changed.
+import argparse
+import os
+import sqlite3
+import struct
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from directory_index import DEFAULT_DISCOVERY_WORKERS
+from fingerprints import list_payload_files
+from instrumentation import add_time, count, phase
+from scanner import scan_models
+
+# Default location of the cache file
+DEFAULT_STL_INFO_CACHE = 'stl-info-cache.sqlite'
+
+# A binary STL is an 80 byte header, the number of triangles, then 50 bytes per triangle
+STL_HEADER_SIZE = 80
+TRIANGLE_DTYPE = np.dtype([('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)), ('attribute', '<u2')])
+
+# Triangles read from a binary STL at a time, and vertices parsed from an ASCII STL at a time
+TRIANGLE_BLOCK_SIZE = 64 * 1024
+VERTEX_BLOCK_SIZE = 64 * 1024
+
+
+def open_stl_info_cache(cache_file=DEFAULT_STL_INFO_CACHE):
+    """Open (or create) the STL info cache and return a handle for the other STL info functions."""
+    connection = sqlite3.connect(cache_file)
+    connection.execute('CREATE TABLE IF NOT EXISTS stl_files ('
+                       'path TEXT PRIMARY KEY, '
+                       'size INTEGER NOT NULL, '
+                       'mtime_ns INTEGER NOT NULL, '
+                       'triangles INTEGER NOT NULL, '
+                       'bounds TEXT, '
+                       'last_seen REAL NOT NULL)')
+
+    return {'connection': connection, 'hits': 0, 'misses': 0, 'started': time.time()}
+
+
+def get_cached_stl_info(cache, file_path, stat):
+    """Return the cached info for an STL file, or None if it changed since it was read."""
+    connection = cache['connection']
+    row = connection.execute('SELECT triangles, bounds FROM stl_files WHERE path = ? AND size = ? AND mtime_ns = ?',
+                             (file_path, stat.st_size, stat.st_mtime_ns)).fetchone()
+    if row is None:
+        cache['misses'] += 1
+        return None
+
+    connection.execute('UPDATE stl_files SET last_seen = ? WHERE path = ?', (time.time(), file_path))
+    cache['hits'] += 1
+    return {'triangles': row[0], 'bounds': None if row[1] is None else [float(v) for v in row[1].split(',')]}
+
+
+def store_stl_info(cache, file_path, stat, info):
+    """Save the info for an STL file, along with the size and modified time it was read at."""
+    bounds = None if info['bounds'] is None else ','.join(repr(v) for v in info['bounds'])
+    cache['connection'].execute(
+        'INSERT OR REPLACE INTO stl_files (path, size, mtime_ns, triangles, bounds, last_seen) '
+        'VALUES (?, ?, ?, ?, ?, ?)', (file_path, stat.st_size, stat.st_mtime_ns, info['triangles'], bounds, time.time()))
+
+
+def close_stl_info_cache(cache, prune=False):
+    """Save and close the cache.
+
+    With prune set, files that weren't looked at since the cache was opened are dropped first,
+    so only prune when every model in the library was read.
+    """
+    connection = cache['connection']
+    pruned = 0
+    if prune:
+        pruned = connection.execute('DELETE FROM stl_files WHERE last_seen < ?', (cache['started'],)).rowcount
+    connection.commit()
+    connection.close()
+
+    print(f"STL info cache: {cache['hits']} hits, {cache['misses']} misses, {pruned} removed")
+
+
+def read_binary_stl(file_path, triangles):
+    """Return the [min x, min y, min z, max x, max y, max z] of a binary STL's vertices, or None if it's empty."""
+    if triangles == 0:
+        return None
+
+    # Each 50 byte triangle is a normal, three vertices and an attribute. The records aren't aligned, so each block
+    # of vertices is copied out into an aligned array first, which NumPy reduces far faster.
+    data = np.memmap(file_path, dtype=np.uint8, mode='r', offset=STL_HEADER_SIZE + 4,
+                     shape=(triangles, TRIANGLE_DTYPE.itemsize))
+    vertex_start = TRIANGLE_DTYPE.fields['vertices'][1]
+    vertex_end = vertex_start + TRIANGLE_DTYPE['vertices'].itemsize
+
+    bounds = [np.inf] * 3 + [-np.inf] * 3
+    for start in range(0, triangles, TRIANGLE_BLOCK_SIZE):
+        block = data[start:start + TRIANGLE_BLOCK_SIZE, vertex_start:vertex_end]
+        vertices = np.ascontiguousarray(block).view('<f4').reshape(-1, 3)
+        for axis in range(3):
+            values = vertices[:, axis]
+            low, high = values.min(), values.max()
+            # A stray NaN would hide every other vertex in the block
+            if np.isnan(low) or np.isnan(high):
+                low, high = np.nanmin(values), np.nanmax(values)
+            bounds[axis] = min(bounds[axis], float(low))
+            bounds[axis + 3] = max(bounds[axis + 3], float(high))
+    del data
+
+    return bounds
+
+
+def read_ascii_stl(file_path):
+    """Return (triangles, bounds) for an ASCII STL, reading it a line at a time."""
+    triangles = 0
+    minimum = np.full(3, np.inf)
+    maximum = np.full(3, -np.inf)
+    vertices = []
+
+    # Parse the vertices a block at a time, so NumPy does the number conversion
+    def add_vertices():
+        nonlocal minimum, maximum
+        block = np.array(vertices, dtype=np.float64)
+        minimum = np.fmin(minimum, block.min(axis=0))
+        maximum = np.fmax(maximum, block.max(axis=0))
+        vertices.clear()
+
+    with open(file_path, 'rb') as f:
+        for line in f:
+            words = line.split()
+            if not words:
+                continue
+            if words[0] == b'vertex':
+                if len(words) != 4:
+                    raise ValueError(f'bad vertex line: {line.strip()[:80]!r}')
+                vertices.append(words[1:])
+                if len(vertices) >= VERTEX_BLOCK_SIZE:
+                    add_vertices()
+            elif words[0] == b'facet':
+                triangles += 1
+
+    if vertices:
+        add_vertices()
+    if not np.isfinite(minimum).all():
+        return triangles, None
+    return triangles, [float(v) for v in minimum] + [float(v) for v in maximum]
+
+
+def read_stl_info(file_path):
+    """Return {'triangles', 'bounds'} for an STL file, binary or ASCII. bounds is None for an empty file."""
+    size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        header = f.read(STL_HEADER_SIZE + 4)
+
+    # The size of a binary STL always matches its triangle count, an ASCII STL only ever does by accident
+    if len(header) == STL_HEADER_SIZE + 4:
+        triangles = struct.unpack_from('<I', header, STL_HEADER_SIZE)[0]
+        if size == STL_HEADER_SIZE + 4 + triangles * TRIANGLE_DTYPE.itemsize:
+            return {'triangles': triangles, 'bounds': read_binary_stl(file_path, triangles)}
+
+    if header.lstrip().startswith(b'solid'):
+        triangles, bounds = read_ascii_stl(file_path)
+        return {'triangles': triangles, 'bounds': bounds}
+
+    raise ValueError('not a binary or ASCII STL file')
+
+
+def read_stl_triangles(file_path, max_triangles=None):
+    """Return the vertices of an STL file as a (triangles, 3, 3) float32 array.
+
+    With max_triangles, only every n-th triangle is kept so the array never has more than that many.
+    """
+    size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        header = f.read(STL_HEADER_SIZE + 4)
+
+    if len(header) == STL_HEADER_SIZE + 4:
+        triangles = struct.unpack_from('<I', header, STL_HEADER_SIZE)[0]
+        if size == STL_HEADER_SIZE + 4 + triangles * TRIANGLE_DTYPE.itemsize:
+            if triangles == 0:
+                return np.zeros((0, 3, 3), dtype=np.float32)
+
+            step = 1 if not max_triangles else max(1, -(-triangles // max_triangles))
+            data = np.memmap(file_path, dtype=np.uint8, mode='r', offset=STL_HEADER_SIZE + 4,
+                             shape=(triangles, TRIANGLE_DTYPE.itemsize))
+            vertex_start = TRIANGLE_DTYPE.fields['vertices'][1]
+            vertex_end = vertex_start + TRIANGLE_DTYPE['vertices'].itemsize
+            vertices = np.ascontiguousarray(data[::step, vertex_start:vertex_end]).view('<f4').reshape(-1, 3, 3)
+            del data
+            return vertices
+
+    if not header.lstrip().startswith(b'solid'):
+        raise ValueError('not a binary or ASCII STL file')
+
+    # Collect the vertices in blocks, so NumPy does the number conversion
+    blocks = []
+    vertices = []
+    with open(file_path, 'rb') as f:
+        for line in f:
+            words = line.split()
+            if words and words[0] == b'vertex':
+                if len(words) != 4:
+                    raise ValueError(f'bad vertex line: {line.strip()[:80]!r}')
+                vertices.append(words[1:])
+                if len(vertices) >= VERTEX_BLOCK_SIZE * 3:
+                    blocks.append(np.array(vertices, dtype=np.float32))
+                    vertices.clear()
+    if vertices:
+        blocks.append(np.array(vertices, dtype=np.float32))
+
+    if not blocks:
+        return np.zeros((0, 3, 3), dtype=np.float32)
+    all_vertices = np.concatenate(blocks)
+    all_vertices = all_vertices[:len(all_vertices) // 3 * 3].reshape(-1, 3, 3)
+    if max_triangles and len(all_vertices) > max_triangles:
+        all_vertices = all_vertices[::-(-len(all_vertices) // max_triangles)]
+    return all_vertices
+
+
+def read_stl_info_timed(file_path):
+    """Read an STL file in a worker process and return its info along with how long it took."""
+    start = time.perf_counter()
+    info = read_stl_info(file_path)
+    return info, time.perf_counter() - start
+
+
+def format_triangles(model):
+    """Return the text shown in the Triangles column of the table."""
+    return f"{model['triangle_count']:,}"
+
+
+def format_dimensions(model):
+    """Return the text shown in the Dimensions column of the table, in the STL's units (usually mm)."""
+    if model['size_x'] is None:
+        return ''
+    return f"{model['size_x']:.1f} x {model['size_y']:.1f} x {model['size_z']:.1f}"
+
+
+def read_models_stl_info(models, cache=None, jobs=None, failures=None):
+    """Read the STL files of each model on a process pool, skipping the ones that are cached.
+
+    Each model gets triangle_count (for all its STL files), size_x, size_y and size_z (of the box around all of them,
+    or None if there weren't any vertices), and the triangles and dimensions column text.
+    STL files that can't be read are added to failures.
+    """
+    if failures is None:
+        failures = []
+
+    # Keep a few models queued per process so the pool never sits idle
+    window = (jobs or os.cpu_count() or 1) * 4
+    in_flight = deque()
+    executor = None
+
+    # Wait for a model's files to be read, then add them up
+    def finish(entry):
+        model, stats, infos, futures = entry
+        for file_path, future in futures.items():
+            try:
+                with phase('stl_info_wait'):
+                    infos[file_path], seconds = future.result()
+            except Exception as e:
+                failures.append({'file_path': file_path, 'error': str(e)})
+                count('stl_files_failed')
+                continue
+
+            add_time('stl_info_read', seconds)
+            count('stl_files_read')
+            if cache is not None:
+                store_stl_info(cache, file_path, stats[file_path], infos[file_path])
+
+        bounds = [info['bounds'] for info in infos.values() if info['bounds'] is not None]
+        model['triangle_count'] = sum(info['triangles'] for info in infos.values())
+        model['size_x'] = model['size_y'] = model['size_z'] = None
+        if bounds:
+            bounds = np.array(bounds)
+            size = bounds[:, 3:].max(axis=0) - bounds[:, :3].min(axis=0)
+            model['size_x'], model['size_y'], model['size_z'] = (round(float(v), 2) for v in size)
+        model['triangles'] = format_triangles(model)
+        model['dimensions'] = format_dimensions(model)
+
+    try:
+        for model in models:
+            with phase('stl_info_list'):
+                stl_files = [file_path for file_path in list_payload_files(model['model_dir'])
+                             if file_path.lower().endswith('.stl')]
+
+            # Look everything up in the cache first, only the files that changed get read
+            stats = {}
+            infos = {}
+            futures = {}
+            for file_path in stl_files:
+                try:
+                    stats[file_path] = os.stat(file_path)
+                except OSError:
+                    continue
+
+                info = None
+                if cache is not None:
+                    info = get_cached_stl_info(cache, file_path, stats[file_path])
+                if info is None:
+                    if executor is None:
+                        executor = ProcessPoolExecutor(max_workers=jobs)
+                    futures[file_path] = executor.submit(read_stl_info_timed, file_path)
+                else:
+                    infos[file_path] = info
+
+            in_flight.append((model, stats, infos, futures))
+            while len(in_flight) > window:
+                finish(in_flight.popleft())
+
+        while in_flight:
+            finish(in_flight.popleft())
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the triangle count and size of the STL files in each model")
+    parser.add_argument('base_path', type=str, help="Path to the root models directory")
+    parser.add_argument('--stl-info-cache', type=str, default=DEFAULT_STL_INFO_CACHE,
+                        help="Path to the STL info cache file")
+    parser.add_argument('--no-stl-info-cache', action='store_true', help="Read every STL file without the cache")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help="Number of processes reading STL files (defaults to the CPU count)")
+    parser.add_argument('--discovery-workers', type=int, default=DEFAULT_DISCOVERY_WORKERS,
+                        help="Number of threads listing directories at once, more helps on network shares")
+    args = parser.parse_args()
+
+    base_path = args.base_path
+    if not os.path.isdir(base_path):
+        print(f"Error: The directory {base_path} does not exist.")
+        sys.exit(1)
+
+    models = [{'model_dir': record['path']} for record in scan_models(base_path, workers=args.discovery_workers)]
+
+    cache = None
+    if not args.no_stl_info_cache:
+        cache = open_stl_info_cache(args.stl_info_cache)
+    try:
+        failures = read_models_stl_info(models, cache, args.jobs)
+    finally:
+        if cache is not None:
+            close_stl_info_cache(cache, prune=True)
+
+    # Most detailed models first
+    models.sort(key=lambda model: (-model['triangle_count'], model['model_dir']))
+    for model in models:
+        print(f"{model['triangles']:>14} {model['dimensions']:>28}  {model['model_dir']}")
+
+    if failures:
+        print(f"\nSTL files that can't be read: {len(failures)}")
+        for failure in failures:
+            print(f"\t{failure['file_path']}: {failure['error']}")
+
+    print(f"\n{len(models)} models, {sum(model['triangle_count'] for model in models):,} triangles")
+
+
+if __name__ == "__main__":
+    main()
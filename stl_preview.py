@@ -0,0 +1,301 @@
+# Render a preview image from the STL files of model folders that don't have an image of their own,
+# so they still show up in the catalog instead of being skipped.
+# The renderer runs on the CPU with NumPy: the triangles are turned to a fixed three-quarter view, flat shaded,
+# and drawn into a depth buffer, with no OpenGL or display needed. Previews are saved as PNGs named after the STL's
+# path, size and modified time, so each version of a file is only rendered once, and they go through the same
+# thumbnail encoding and caching as every other image.
+import argparse
+import hashlib
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from fingerprints import list_payload_files
+from instrumentation import add_time, count, phase
+from stl_info import read_stl_triangles
+
+# Default folder the previews are saved in, and their size in pixels (they're square)
+DEFAULT_PREVIEW_DIR = 'stl-previews'
+DEFAULT_PREVIEW_SIZE = 400
+
+# Previews are drawn this many times bigger and scaled down, which smooths the edges
+SUPERSAMPLE = 2
+
+# Big STLs only have every n-th triangle drawn, at preview sizes the gaps don't show
+MAX_PREVIEW_TRIANGLES = 500000
+
+# The camera looks down at the model from the front right, in degrees
+CAMERA_AZIMUTH = 35
+CAMERA_ELEVATION = 25
+
+# Space left around the model, as a fraction of the image
+MARGIN = 0.05
+
+# Colours, and how the faces are lit: the light comes from the upper left, behind the camera
+BACKGROUND_COLOR = (245, 245, 245)
+MODEL_COLOR = (150, 170, 200)
+LIGHT_DIRECTION = np.array([-0.4, 0.7, -0.6]) / np.linalg.norm([-0.4, 0.7, -0.6])
+AMBIENT_LIGHT = 0.25
+
+# Faces at the back of the model are darkened by up to this much, so overlapping parts stand apart
+DEPTH_FADE = 0.3
+
+# Points drawn at a time, which bounds the memory a huge triangle or a big STL can take
+SAMPLE_BLOCK_SIZE = 4 * 1024 * 1024
+
+# Most points drawn for one preview, only a pile of huge overlapping triangles gets near it
+MAX_SAMPLES = 32 * 1024 * 1024
+
+# Previews are named after a sha1, which keeps the clean up away from any other files in the folder
+PREVIEW_FILE_NAME = re.compile(r'[0-9a-f]{40}\.\w+\Z')
+
+# Bumped whenever the renderer changes, so the old previews are rendered again
+RENDER_VERSION = 1
+
+
+def find_preview_stl(model_dir):
+    """Return the path of the biggest STL file in a model directory, usually the whole model, or None."""
+    stl_files = []
+    for file_path in list_payload_files(model_dir):
+        if file_path.lower().endswith('.stl'):
+            try:
+                stl_files.append((os.path.getsize(file_path), file_path))
+            except OSError:
+                continue
+
+    if not stl_files:
+        return None
+    return max(stl_files, key=lambda stl_file: (stl_file[0], stl_file[1]))[1]
+
+
+def preview_file_name(stl_path, size=DEFAULT_PREVIEW_SIZE):
+    """Return the file name of the preview for the current version of an STL file."""
+    stat = os.stat(stl_path)
+    key = f'{RENDER_VERSION}\0{os.path.abspath(stl_path)}\0{stat.st_size}\0{stat.st_mtime_ns}\0{size}'
+    return hashlib.sha1(key.encode('utf-8')).hexdigest() + '.png'
+
+
+def view_matrix():
+    """Return the rotation from model space (Z up) to view space (x right, y up, z away from the camera)."""
+    azimuth = np.radians(CAMERA_AZIMUTH)
+    elevation = np.radians(CAMERA_ELEVATION)
+
+    turn = np.array([[np.cos(azimuth), -np.sin(azimuth), 0],
+                     [np.sin(azimuth), np.cos(azimuth), 0],
+                     [0, 0, 1]])
+    tilt = np.array([[1, 0, 0],
+                     [0, np.sin(elevation), np.cos(elevation)],
+                     [0, np.cos(elevation), -np.sin(elevation)]])
+    return tilt @ turn
+
+
+def barycentric_grid(steps):
+    """Return the weights of the points on a grid across a triangle, with steps points along each edge."""
+    i, j = np.meshgrid(np.arange(steps + 1), np.arange(steps + 1), indexing='ij')
+    inside = i + j <= steps
+    a = i[inside] / steps
+    b = j[inside] / steps
+    return np.stack([a, b, 1 - a - b], axis=1)
+
+
+def draw_samples(depth_buffer, shade_buffer, pixels, depths, shades):
+    """Draw points into the buffers, keeping the nearest point at each pixel."""
+    np.minimum.at(depth_buffer, pixels, depths)
+
+    # The points that ended up in the depth buffer are the ones that're seen
+    seen = depths == depth_buffer[pixels]
+    shade_buffer[pixels[seen]] = shades[seen]
+
+
+def render_triangles(vertices, size=DEFAULT_PREVIEW_SIZE):
+    """Render a (triangles, 3, 3) array of vertices to a square RGB image size pixels across.
+
+    Each triangle is filled by sampling a grid of points across it no more than a pixel apart,
+    and the nearest point at each pixel is kept, so there's no per-pixel Python loop anywhere.
+    """
+    canvas = size * SUPERSAMPLE
+    depth_buffer = np.full(canvas * canvas, np.inf)
+    shade_buffer = np.zeros(canvas * canvas)
+
+    vertices = vertices[np.isfinite(vertices).all(axis=(1, 2))]
+    if len(vertices):
+        # Turn the model to the camera, then scale and centre it to fill the image
+        points = vertices.reshape(-1, 3).astype(np.float64) @ view_matrix().T
+        low = points.min(axis=0)
+        high = points.max(axis=0)
+        extent = max(high[0] - low[0], high[1] - low[1])
+        scale = canvas * (1 - 2 * MARGIN) / extent if extent > 0 else 1.0
+
+        projected = np.empty_like(points)
+        projected[:, 0] = (points[:, 0] - (low[0] + high[0]) / 2) * scale + canvas / 2
+        projected[:, 1] = canvas / 2 - (points[:, 1] - (low[1] + high[1]) / 2) * scale
+        projected[:, 2] = points[:, 2]
+        points = points.reshape(-1, 3, 3)
+        projected = projected.reshape(-1, 3, 3)
+
+        # Flat shading from the face normals, lit from either side since STL winding often isn't reliable
+        normals = np.cross(points[:, 1] - points[:, 0], points[:, 2] - points[:, 0])
+        lengths = np.linalg.norm(normals, axis=1)
+        lengths[lengths == 0] = 1
+        shades = AMBIENT_LIGHT + (1 - AMBIENT_LIGHT) * np.abs(normals @ LIGHT_DIRECTION) / lengths
+
+        depth_range = high[2] - low[2]
+        if depth_range > 0:
+            shades *= 1 - DEPTH_FADE * (projected[:, :, 2].mean(axis=1) - low[2]) / depth_range
+
+        # Triangles are grouped by how many points they need along their longest edge
+        edges = projected[:, [1, 2, 0], :2] - projected[:, :, :2]
+        longest = np.sqrt((edges ** 2).sum(axis=2)).max(axis=1)
+        steps = np.clip(np.ceil(longest), 1, canvas * 2).astype(np.int64)
+
+        # Past the budget the grids get coarser, leaving gaps rather than taking minutes
+        total_samples = ((steps + 1) * (steps + 2) // 2).sum()
+        if total_samples > MAX_SAMPLES:
+            steps = np.maximum(1, steps * np.sqrt(MAX_SAMPLES / total_samples)).astype(np.int64)
+
+        for step_count in np.unique(steps):
+            weights = barycentric_grid(step_count)
+            triangle_ids = np.flatnonzero(steps == step_count)
+            per_block = max(1, SAMPLE_BLOCK_SIZE // len(weights))
+
+            for start in range(0, len(triangle_ids), per_block):
+                block = triangle_ids[start:start + per_block]
+                samples = np.einsum('pk,tkd->tpd', weights, projected[block]).reshape(-1, 3)
+                x = np.floor(samples[:, 0]).astype(np.int64)
+                y = np.floor(samples[:, 1]).astype(np.int64)
+                inside = (x >= 0) & (x < canvas) & (y >= 0) & (y < canvas)
+
+                draw_samples(depth_buffer, shade_buffer, (y * canvas + x)[inside], samples[:, 2][inside],
+                             np.repeat(shades[block], len(weights))[inside])
+
+    pixels = np.empty((canvas * canvas, 3), dtype=np.uint8)
+    pixels[:] = BACKGROUND_COLOR
+    covered = np.isfinite(depth_buffer)
+    pixels[covered] = np.clip(np.outer(shade_buffer[covered], MODEL_COLOR), 0, 255).astype(np.uint8)
+
+    image = Image.fromarray(pixels.reshape(canvas, canvas, 3))
+    return image.reduce(SUPERSAMPLE) if SUPERSAMPLE > 1 else image
+
+
+def render_preview(stl_path, preview_path, size=DEFAULT_PREVIEW_SIZE):
+    """Render an STL file and save the preview as a PNG, returning the seconds it took. Runs on the render processes."""
+    start = time.perf_counter()
+    vertices = read_stl_triangles(stl_path, MAX_PREVIEW_TRIANGLES)
+    image = render_triangles(vertices, size)
+
+    # Save to a temporary file first, so a run that's stopped part way never leaves half a preview behind
+    temp_path = f'{preview_path}.{os.getpid()}.tmp'
+    try:
+        image.save(temp_path, 'PNG')
+        os.replace(temp_path, preview_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return time.perf_counter() - start
+
+
+def add_stl_previews(models, preview_dir=DEFAULT_PREVIEW_DIR, size=DEFAULT_PREVIEW_SIZE, jobs=None, failures=None):
+    """Give each model without an image a preview rendered from its biggest STL file.
+
+    Previews that were rendered on an earlier run are reused, the rest are rendered on a process pool.
+    Returns the models that have an image, in the same order; models without any STL file, or whose STL
+    couldn't be rendered, are left out. STL files that can't be rendered are added to failures.
+    """
+    if failures is None:
+        failures = []
+
+    os.makedirs(preview_dir, exist_ok=True)
+    futures = {}
+    skipped = set()
+    executor = None
+
+    try:
+        for model_id, model in enumerate(models):
+            if model['image_path'] is not None:
+                continue
+
+            with phase('stl_preview_list'):
+                stl_path = find_preview_stl(model['model_dir'])
+                if stl_path is not None:
+                    try:
+                        preview_path = os.path.join(preview_dir, preview_file_name(stl_path, size))
+                    except OSError:
+                        stl_path = None
+            if stl_path is None:
+                count('stl_previews_without_stl')
+                skipped.add(model_id)
+                continue
+
+            model['image_path'] = preview_path
+            if os.path.exists(preview_path):
+                count('stl_previews_cached')
+                continue
+
+            if executor is None:
+                executor = ProcessPoolExecutor(max_workers=jobs)
+            futures[model_id] = (stl_path, executor.submit(render_preview, stl_path, preview_path, size))
+
+        for model_id, (stl_path, future) in futures.items():
+            try:
+                with phase('stl_preview_wait'):
+                    seconds = future.result()
+            except Exception as e:
+                failures.append({'file_path': stl_path, 'error': str(e)})
+                count('stl_previews_failed')
+                skipped.add(model_id)
+                continue
+
+            add_time('stl_preview_render', seconds)
+            count('stl_previews_rendered')
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    return [model for model_id, model in enumerate(models) if model_id not in skipped]
+
+
+def remove_unused_previews(preview_dir, models):
+    """Delete the previews in preview_dir that none of the models use, returning how many were removed.
+
+    Only files named like a preview are touched, the rendered PNGs and the images taken out of zips.
+    """
+    used_previews = {os.path.abspath(model['image_path']) for model in models}
+    removed = 0
+
+    for file_name in os.listdir(preview_dir):
+        file_path = os.path.join(preview_dir, file_name)
+        if PREVIEW_FILE_NAME.match(file_name) and os.path.abspath(file_path) not in used_previews:
+            os.remove(file_path)
+            removed += 1
+
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a preview image of an STL file")
+    parser.add_argument('stl_path', type=str, help="Path to the STL file")
+    parser.add_argument('output_path', type=str, help="Path to save the PNG preview to")
+    parser.add_argument('--size', type=int, default=DEFAULT_PREVIEW_SIZE, help="Width and height of the preview")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.stl_path):
+        print(f"Error: The file {args.stl_path} does not exist.")
+        sys.exit(1)
+
+    try:
+        seconds = render_preview(args.stl_path, args.output_path, args.size)
+    except (OSError, ValueError) as e:
+        print(f"Unable to render {args.stl_path}: {e}")
+        sys.exit(1)
+
+    print(f"Preview saved to {args.output_path} in {seconds:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
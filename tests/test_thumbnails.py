@@ -0,0 +1,28 @@
+from io import BytesIO
+
+from PIL import Image
+
+import dedup
+from main import DEFAULT_THUMBNAIL_OPTIONS, encode_thumbnail
+
+
+def save_png(path, img):
+    img.save(path, 'PNG')
+    return str(path)
+
+
+def test_encode_thumbnail_16_bit_grayscale(tmp_path):
+    file = save_png(tmp_path / 'render.png', Image.new('I;16', (1800, 1200), 40000))
+
+    data = encode_thumbnail(file, DEFAULT_THUMBNAIL_OPTIONS, 'PNG')
+
+    with Image.open(BytesIO(data)) as thumbnail:
+        assert thumbnail.format == 'JPEG'
+        assert thumbnail.mode == 'RGB'
+        assert thumbnail.size == (300, 200)
+
+
+def test_hash_image_16_bit_grayscale(tmp_path):
+    file = save_png(tmp_path / 'render.png', Image.new('I;16', (1800, 1200), 40000))
+
+    assert dedup.hash_image(file) is not None
@@ -0,0 +1,77 @@
+# Persistent on-disk cache for the thumbnails embedded in the html file.
+# Everything lives in a single SQLite file so re-runs only need to encode new or changed images.
+import os
+import sqlite3
+import time
+
+# Default location and size of the cache file
+DEFAULT_CACHE_FILE = 'thumbnail-cache.sqlite'
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def open_thumbnail_cache(cache_file=DEFAULT_CACHE_FILE, max_bytes=DEFAULT_MAX_BYTES):
+    """Open (or create) the thumbnail cache and return a handle for the other cache functions."""
+    connection = sqlite3.connect(cache_file)
+    connection.execute('CREATE TABLE IF NOT EXISTS thumbnails ('
+                       'key TEXT PRIMARY KEY, '
+                       'data BLOB NOT NULL, '
+                       'size INTEGER NOT NULL, '
+                       'last_used REAL NOT NULL)')
+    connection.execute('CREATE INDEX IF NOT EXISTS thumbnails_last_used ON thumbnails (last_used)')
+
+    return {'connection': connection, 'max_bytes': max_bytes, 'hits': 0, 'misses': 0}
+
+
+def thumbnail_cache_key(file, max_height, image_format):
+    """Build the cache key for an image from its absolute path, size, mtime and the output settings."""
+    stat = os.stat(file)
+    return f'{os.path.abspath(file)}|{stat.st_size}|{stat.st_mtime_ns}|{max_height}|{image_format}'
+
+
+def get_cached_thumbnail(cache, key):
+    """Return the cached thumbnail bytes for the key, or None if it hasn't been encoded yet."""
+    connection = cache['connection']
+    row = connection.execute('SELECT data FROM thumbnails WHERE key = ?', (key,)).fetchone()
+    if row is None:
+        cache['misses'] += 1
+        return None
+
+    # Mark the entry as recently used so it survives eviction
+    connection.execute('UPDATE thumbnails SET last_used = ? WHERE key = ?', (time.time(), key))
+    cache['hits'] += 1
+    return row[0]
+
+
+def store_thumbnail(cache, key, data):
+    """Save the encoded thumbnail bytes under the key."""
+    cache['connection'].execute('INSERT OR REPLACE INTO thumbnails (key, data, size, last_used) VALUES (?, ?, ?, ?)',
+                                (key, data, len(data), time.time()))
+
+
+def evict_thumbnails(cache):
+    """Drop the least recently used thumbnails until the cache fits in its size limit."""
+    connection = cache['connection']
+    total_size = connection.execute('SELECT COALESCE(SUM(size), 0) FROM thumbnails').fetchone()[0]
+    if total_size <= cache['max_bytes']:
+        return 0
+
+    evicted = 0
+    rows = connection.execute('SELECT key, size FROM thumbnails ORDER BY last_used').fetchall()
+    for key, size in rows:
+        if total_size <= cache['max_bytes']:
+            break
+        connection.execute('DELETE FROM thumbnails WHERE key = ?', (key,))
+        total_size -= size
+        evicted += 1
+
+    return evicted
+
+
+def close_thumbnail_cache(cache):
+    """Evict anything over the size limit, then save and close the cache."""
+    evicted = evict_thumbnails(cache)
+    connection = cache['connection']
+    connection.commit()
+    connection.close()
+
+    print(f"Thumbnail cache: {cache['hits']} hits, {cache['misses']} misses, {evicted} evicted")
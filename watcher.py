@@ -0,0 +1,201 @@
+# Watch the model library for changes, so main.py --watch can rebuild the catalog as models are added.
+# On Linux the directories are watched with inotify, everywhere else (or when inotify runs out of watches)
+# their modified times are polled. Changes are batched: a rebuild only starts once the library has been
+# quiet for the debounce time, so copying in a folder full of files triggers one rebuild instead of hundreds.
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+from manifest import get_mtime_ns
+
+# Default seconds between checks when polling, and seconds of quiet before a rebuild
+DEFAULT_POLL_INTERVAL = 2.0
+DEFAULT_DEBOUNCE = 2.0
+
+# Rebuild at least this often while changes keep coming in, so a long copy still shows up part way through
+MAX_BATCH_WAIT = 60.0
+
+# inotify flags, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+# Events that can change what's in the catalog: files and folders added, removed, renamed or rewritten
+WATCH_EVENTS = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+# Each inotify event starts with the watch descriptor, mask, cookie and the length of the name after it
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def load_inotify():
+    """Return libc if it has the inotify functions, otherwise None."""
+    if not sys.platform.startswith('linux'):
+        return None
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    except OSError:
+        return None
+
+    if not hasattr(libc, 'inotify_init1') or not hasattr(libc, 'inotify_add_watch'):
+        return None
+    return libc
+
+
+def open_watcher(directories, poll_interval=DEFAULT_POLL_INTERVAL, use_inotify=True):
+    """Start watching the directories ({path: modified time when listed}) and return a handle
+    for the other watcher functions.
+    """
+    watcher = {
+        'mode': 'polling',
+        'libc': None,
+        'fd': None,
+        'watches': {},
+        'snapshot': {},
+        'changed': set(),
+        'poll_interval': poll_interval,
+    }
+
+    libc = load_inotify() if use_inotify else None
+    if libc is not None:
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd >= 0:
+            watcher.update(mode='inotify', libc=libc, fd=fd)
+
+    update_watches(watcher, directories)
+    return watcher
+
+
+def close_watcher(watcher):
+    """Stop watching, closing inotify if it was used."""
+    if watcher['fd'] is not None:
+        os.close(watcher['fd'])
+        watcher['fd'] = None
+    watcher['mode'] = 'polling'
+    watcher['watches'] = {}
+
+
+def update_watches(watcher, directories):
+    """Watch any directories that aren't watched yet, and reset the modified times used for polling.
+
+    directories maps each path to its modified time when the build listed it, rather than now,
+    so a directory that changed while the build was running still counts as changed.
+    """
+    watcher['snapshot'] = dict(directories)
+    if watcher['mode'] != 'inotify':
+        return
+
+    watched = set(watcher['watches'].values())
+    for path, mtime_ns in directories.items():
+        if path in watched:
+            continue
+
+        watch = watcher['libc'].inotify_add_watch(watcher['fd'], os.fsencode(path), WATCH_EVENTS)
+        if watch < 0:
+            # Every user has a limit on inotify watches, polling still works past it
+            if ctypes.get_errno() == errno.ENOSPC:
+                print('Ran out of inotify watches, polling for changes instead')
+                close_watcher(watcher)
+                return
+            # The directory was removed since it was listed
+            continue
+
+        watcher['watches'][watch] = path
+
+        # Nothing sends an event for changes made between the build listing the directory and the watch starting
+        if get_mtime_ns(path) != mtime_ns:
+            watcher['changed'].add(path)
+
+
+def read_inotify_events(watcher):
+    """Read every waiting inotify event and return the set of directories they happened in."""
+    changed = set()
+
+    while True:
+        try:
+            data = os.read(watcher['fd'], 64 * 1024)
+        except BlockingIOError:
+            break
+        if not data:
+            break
+
+        offset = 0
+        while offset < len(data):
+            watch, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size + length
+
+            # Events were dropped, so anything could have changed
+            if mask & IN_Q_OVERFLOW:
+                changed.update(watcher['watches'].values())
+                continue
+
+            path = watcher['watches'].get(watch)
+            if path is not None:
+                changed.add(path)
+
+            # The directory is gone and inotify has already dropped the watch
+            if mask & IN_IGNORED:
+                watcher['watches'].pop(watch, None)
+
+    return changed
+
+
+def poll_changes(watcher):
+    """Return the set of directories whose modified time changed since they were last checked."""
+    changed = set()
+    snapshot = watcher['snapshot']
+
+    for path, mtime_ns in snapshot.items():
+        current_mtime_ns = get_mtime_ns(path)
+        if current_mtime_ns != mtime_ns:
+            snapshot[path] = current_mtime_ns
+            changed.add(path)
+
+    return changed
+
+
+def check_for_changes(watcher, timeout):
+    """Wait up to timeout seconds and return the set of directories that changed in that time."""
+    # Directories that changed before their watch was added are reported straight away
+    if watcher['changed']:
+        changed = watcher['changed']
+        watcher['changed'] = set()
+        return changed
+
+    if watcher['mode'] == 'inotify':
+        ready, _, _ = select.select([watcher['fd']], [], [], timeout)
+        return read_inotify_events(watcher) if ready else set()
+
+    time.sleep(timeout)
+    return poll_changes(watcher)
+
+
+def wait_for_changes(watcher, debounce=DEFAULT_DEBOUNCE):
+    """Block until something changes, then keep collecting changes until the library has been quiet
+    for debounce seconds. Returns the set of directories that changed.
+    """
+    changed = set()
+    while not changed:
+        changed = check_for_changes(watcher, watcher['poll_interval'])
+
+    first_change = time.monotonic()
+    while time.monotonic() - first_change < MAX_BATCH_WAIT:
+        more_changes = check_for_changes(watcher, debounce)
+        if not more_changes:
+            break
+        changed |= more_changes
+
+    return changed
@@ -0,0 +1,325 @@
+# List what's inside the zips in each model directory, without extracting them: the STL and image files
+# in each archive, how big they are and how well they compressed.
+# Only the central directory at the end of each zip is read, and the listings are cached by path, size and
+# modified time so re-runs only open the zips that changed. Models without an image of their own can use an
+# image from inside one of their zips, and only that one file is decompressed.
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from directory_index import DEFAULT_DISCOVERY_WORKERS
+from fingerprints import HASH_BUFFER_SIZE, format_size, list_payload_files
+from instrumentation import count, phase
+from scanner import scan_models
+from search_functions import IMAGE_EXTENSIONS
+
+# Default location of the cache file
+DEFAULT_ZIP_CACHE = 'zip-cache.sqlite'
+
+# Threads reading zip listings at once, it's mostly waiting on the disk or network
+DEFAULT_ZIP_WORKERS = 4
+
+# Images inside a zip that can be used as a preview, Pillow can't read SVGs
+PREVIEW_IMAGE_EXTENSIONS = IMAGE_EXTENSIONS - {'.svg'}
+
+# Images bigger than this aren't taken out of a zip for a preview, it's more likely a texture than a render
+MAX_PREVIEW_IMAGE_BYTES = 64 * 1024 * 1024
+
+
+def open_zip_cache(cache_file=DEFAULT_ZIP_CACHE):
+    """Open (or create) the zip listing cache and return a handle for the other zip functions."""
+    connection = sqlite3.connect(cache_file)
+    connection.execute('CREATE TABLE IF NOT EXISTS zip_files ('
+                       'path TEXT PRIMARY KEY, '
+                       'size INTEGER NOT NULL, '
+                       'mtime_ns INTEGER NOT NULL, '
+                       'members TEXT NOT NULL, '
+                       'last_seen REAL NOT NULL)')
+
+    return {'connection': connection, 'hits': 0, 'misses': 0, 'started': time.time()}
+
+
+def get_cached_zip_members(cache, file_path, stat):
+    """Return the cached members of a zip, or None if it changed since it was listed."""
+    connection = cache['connection']
+    row = connection.execute('SELECT members FROM zip_files WHERE path = ? AND size = ? AND mtime_ns = ?',
+                             (file_path, stat.st_size, stat.st_mtime_ns)).fetchone()
+    if row is None:
+        cache['misses'] += 1
+        return None
+
+    connection.execute('UPDATE zip_files SET last_seen = ? WHERE path = ?', (time.time(), file_path))
+    cache['hits'] += 1
+    return [tuple(member) for member in json.loads(row[0])]
+
+
+def store_zip_members(cache, file_path, stat, members):
+    """Save the members of a zip, along with the size and modified time it was listed at."""
+    cache['connection'].execute(
+        'INSERT OR REPLACE INTO zip_files (path, size, mtime_ns, members, last_seen) VALUES (?, ?, ?, ?, ?)',
+        (file_path, stat.st_size, stat.st_mtime_ns, json.dumps(members), time.time()))
+
+
+def close_zip_cache(cache, prune=False):
+    """Save and close the cache.
+
+    With prune set, zips that weren't looked at since the cache was opened are dropped first,
+    so only prune when every model in the library was inspected.
+    """
+    connection = cache['connection']
+    pruned = 0
+    if prune:
+        pruned = connection.execute('DELETE FROM zip_files WHERE last_seen < ?', (cache['started'],)).rowcount
+    connection.commit()
+    connection.close()
+
+    print(f"Zip cache: {cache['hits']} hits, {cache['misses']} misses, {pruned} removed")
+
+
+def is_stl_member(name):
+    """Check if a zip member is an STL file."""
+    return name.lower().endswith('.stl')
+
+
+def is_image_member(name):
+    """Check if a zip member is an image file."""
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def read_zip_members(file_path):
+    """Return [(name, size, compressed size)] for the STL and image files in a zip, from its central directory.
+
+    Nothing is decompressed, so this takes about as long for a 10 GB zip as a 10 KB one.
+    """
+    with zipfile.ZipFile(file_path) as archive:
+        return [(member.filename, member.file_size, member.compress_size) for member in archive.infolist()
+                if not member.is_dir() and (is_stl_member(member.filename) or is_image_member(member.filename))]
+
+
+def compression_ratio(size, compressed_size):
+    """Return how many times smaller the files got in the zip, 1.0 for stored files."""
+    return size / compressed_size if compressed_size else 1.0
+
+
+def format_zip_contents(model):
+    """Return the text shown in the Zip Contents column of the table for an inspected model."""
+    if not model['zip_stl_count'] and not model['zip_image_count']:
+        return ''
+
+    parts = []
+    if model['zip_stl_count']:
+        parts.append(f"{model['zip_stl_count']} STL")
+    if model['zip_image_count']:
+        parts.append(f"{model['zip_image_count']} image" + ('s' if model['zip_image_count'] > 1 else ''))
+    ratio = compression_ratio(model['zip_bytes'], model['zip_compressed_bytes'])
+    parts.append(f"{format_size(model['zip_bytes'])} ({ratio:.1f}x)")
+    return ', '.join(parts)
+
+
+def inspect_zips(models, cache=None, workers=DEFAULT_ZIP_WORKERS, failures=None):
+    """List the zips of each model, reading the ones that aren't cached on a thread pool.
+
+    Each model gets zip_members ({zip path: [(name, size, compressed size)]}), zip_stl_count, zip_image_count,
+    zip_bytes and zip_compressed_bytes (for the STL and image files only) and the zip contents column text.
+    Zips that can't be read are added to failures.
+    """
+    if failures is None:
+        failures = []
+
+    # Keep a few models listing per thread so the pool never sits idle between models
+    window = workers * 4
+    in_flight = deque()
+
+    # Wait for a model's zips to be listed, then add them up
+    def finish(entry):
+        model, stats, listings, futures = entry
+        with phase('zip_list_wait'):
+            for file_path, future in futures.items():
+                try:
+                    listings[file_path] = future.result()
+                except (zipfile.BadZipFile, OSError, ValueError) as e:
+                    failures.append({'file_path': file_path, 'error': str(e)})
+                    count('zips_failed')
+                    continue
+
+                count('zips_listed')
+                if cache is not None:
+                    store_zip_members(cache, file_path, stats[file_path], listings[file_path])
+
+        members = [member for file_path in listings for member in listings[file_path]]
+        model['zip_members'] = {file_path: listings[file_path] for file_path in sorted(listings)}
+        model['zip_stl_count'] = sum(1 for name, _, _ in members if is_stl_member(name))
+        model['zip_image_count'] = sum(1 for name, _, _ in members if is_image_member(name))
+        model['zip_bytes'] = sum(size for _, size, _ in members)
+        model['zip_compressed_bytes'] = sum(compressed_size for _, _, compressed_size in members)
+        model['zip_contents'] = format_zip_contents(model)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for model in models:
+            with phase('zip_find'):
+                zip_files = [file_path for file_path in list_payload_files(model['model_dir'])
+                             if file_path.lower().endswith('.zip')]
+
+            # Look everything up in the cache first, only the zips that changed get opened
+            stats = {}
+            listings = {}
+            futures = {}
+            for file_path in zip_files:
+                try:
+                    stats[file_path] = os.stat(file_path)
+                except OSError:
+                    continue
+
+                members = None
+                if cache is not None:
+                    members = get_cached_zip_members(cache, file_path, stats[file_path])
+                if members is None:
+                    futures[file_path] = executor.submit(read_zip_members, file_path)
+                else:
+                    listings[file_path] = members
+
+            in_flight.append((model, stats, listings, futures))
+            while len(in_flight) > window:
+                finish(in_flight.popleft())
+
+        while in_flight:
+            finish(in_flight.popleft())
+
+    return failures
+
+
+def find_preview_member(zip_members):
+    """Return (zip path, member name) of the image to use as a model's preview, or None.
+
+    Images nearest the top of the zip win, since renders usually sit next to the STL folders,
+    then the biggest one.
+    """
+    candidates = []
+    for file_path, members in zip_members.items():
+        for name, size, _ in members:
+            if os.path.splitext(name)[1].lower() in PREVIEW_IMAGE_EXTENSIONS and 0 < size <= MAX_PREVIEW_IMAGE_BYTES:
+                candidates.append((name.count('/'), -size, file_path, name))
+
+    if not candidates:
+        return None
+    _, _, file_path, name = min(candidates)
+    return file_path, name
+
+
+def preview_file_name(file_path, member_name):
+    """Return the file name of the preview taken from a member of the current version of a zip."""
+    stat = os.stat(file_path)
+    key = f'{os.path.abspath(file_path)}\0{stat.st_size}\0{stat.st_mtime_ns}\0{member_name}'
+    return hashlib.sha1(key.encode('utf-8')).hexdigest() + os.path.splitext(member_name)[1].lower()
+
+
+def extract_member(file_path, member_name, output_path):
+    """Decompress one member of a zip to output_path, a buffer at a time, without touching the rest of the zip."""
+    # Save to a temporary file first, so a run that's stopped part way never leaves half an image behind
+    temp_path = f'{output_path}.{os.getpid()}.tmp'
+    try:
+        with zipfile.ZipFile(file_path) as archive, archive.open(member_name) as source, open(temp_path, 'wb') as f:
+            shutil.copyfileobj(source, f, HASH_BUFFER_SIZE)
+        os.replace(temp_path, output_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def add_zip_previews(models, preview_dir, cache=None, workers=DEFAULT_ZIP_WORKERS, failures=None):
+    """Give each model without an image the best image from inside its zips, taken out into preview_dir.
+
+    Images taken out on an earlier run are reused until the zip changes. Models without any image in their zips
+    keep an image_path of None. Zips that can't be read are added to failures.
+    """
+    if failures is None:
+        failures = []
+
+    missing = [model for model in models if model['image_path'] is None]
+    inspect_zips([model for model in missing if 'zip_members' not in model], cache, workers, failures)
+    if missing:
+        os.makedirs(preview_dir, exist_ok=True)
+
+    for model in missing:
+        found = find_preview_member(model['zip_members'])
+        if found is None:
+            count('zip_previews_without_image')
+            continue
+
+        file_path, member_name = found
+        try:
+            preview_path = os.path.join(preview_dir, preview_file_name(file_path, member_name))
+            if os.path.exists(preview_path):
+                count('zip_previews_cached')
+            else:
+                with phase('zip_preview_extract'):
+                    extract_member(file_path, member_name, preview_path)
+                count('zip_previews_extracted')
+        except (zipfile.BadZipFile, OSError, ValueError, RuntimeError) as e:
+            failures.append({'file_path': f'{file_path}/{member_name}', 'error': str(e)})
+            count('zip_previews_failed')
+            continue
+
+        model['image_path'] = preview_path
+
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List the STL and image files inside the zips of each model")
+    parser.add_argument('base_path', type=str, help="Path to the root models directory")
+    parser.add_argument('--zip-cache', type=str, default=DEFAULT_ZIP_CACHE, help="Path to the zip listing cache file")
+    parser.add_argument('--no-zip-cache', action='store_true', help="Open every zip without the cache")
+    parser.add_argument('--zip-workers', type=int, default=DEFAULT_ZIP_WORKERS,
+                        help="Number of threads reading zips at once")
+    parser.add_argument('--discovery-workers', type=int, default=DEFAULT_DISCOVERY_WORKERS,
+                        help="Number of threads listing directories at once, more helps on network shares")
+    args = parser.parse_args()
+
+    base_path = args.base_path
+    if not os.path.isdir(base_path):
+        print(f"Error: The directory {base_path} does not exist.")
+        sys.exit(1)
+
+    models = [{'model_dir': record['path']}
+              for record in scan_models(base_path, workers=args.discovery_workers, previews=True)]
+
+    cache = None
+    if not args.no_zip_cache:
+        cache = open_zip_cache(args.zip_cache)
+    try:
+        failures = inspect_zips(models, cache, args.zip_workers)
+    finally:
+        if cache is not None:
+            close_zip_cache(cache, prune=True)
+
+    for model in models:
+        for file_path, members in model['zip_members'].items():
+            print(f"\n{file_path}")
+            for name, size, compressed_size in members:
+                print(f"\t{format_size(size):>10} {compression_ratio(size, compressed_size):5.1f}x  {name}")
+
+    if failures:
+        print(f"\nZips that can't be read: {len(failures)}")
+        for failure in failures:
+            print(f"\t{failure['file_path']}: {failure['error']}")
+
+    zip_count = sum(len(model['zip_members']) for model in models)
+    total_bytes = sum(model['zip_bytes'] for model in models)
+    total_compressed = sum(model['zip_compressed_bytes'] for model in models)
+    print(f"\n{zip_count} zips, {sum(model['zip_stl_count'] for model in models)} STL files, "
+          f"{sum(model['zip_image_count'] for model in models)} images, {format_size(total_bytes)} "
+          f"({format_size(total_compressed)} zipped, {compression_ratio(total_bytes, total_compressed):.1f}x)")
+
+
+if __name__ == "__main__":
+    main()